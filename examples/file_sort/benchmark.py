@@ -0,0 +1,564 @@
+#!/usr/bin/python
+"""Module containing benchmarks for the file sorting tools."""
+
+import os
+import sys
+import json
+import time
+import random
+import bisect
+import argparse
+import tempfile
+import multiprocessing
+
+from functools import partial
+
+from file_sort import FileSorter
+from run_format import RunCodec,\
+                       items_to_run,\
+                       items_from_run
+from sorting_methods import numpy,\
+                            heapsort,\
+                            quicksort,\
+                            merge_sort,\
+                            numpy_sort,\
+                            radix_sort,\
+                            default_sort,\
+                            integer_sort,\
+                            counting_sort,\
+                            insertion_sort
+
+
+# Distributions of the generated integers of the benchmark suite.
+DISTRIBUTIONS = ('random', 'sorted', 'reverse', 'few_unique', 'zipf')
+
+# Maximum of the random integers and number of distinct few unique ones.
+MAX_NUMBER = 2**62
+FEW_UNIQUE_NUMBERS = 16
+
+# Exponent of the zipfian distribution, over as many ranks as the numbers.
+ZIPF_EXPONENT = 1.2
+
+# Sorting functions timed by the benchmark suite.
+SORT_FUNCTIONS = [('default_sort', default_sort), ('quicksort', quicksort),
+                  ('merge_sort', merge_sort), ('heapsort', heapsort),
+                  ('insertion_sort', insertion_sort),
+                  ('radix_sort', radix_sort), ('counting_sort', counting_sort),
+                  ('integer_sort', integer_sort)]
+if numpy is not None:  # pragma: no cover
+    SORT_FUNCTIONS.append(('numpy_sort', numpy_sort))
+
+# Maximum number of items sorted by the quadratic insertion sort, and
+# maximum ratio of the range of values to the items for counting sort.
+QUADRATIC_MAX_ITEMS = 10000
+COUNTING_MAX_RANGE_RATIO = 16
+
+# Slowdown ratio over the baseline reported as a regression by default.
+REGRESSION_THRESHOLD = 0.1
+
+
+def create_numbers_file(count, seed=0, chunk=100000):
+    """
+    Description:
+        Create a temporary file containing random integer numbers, one
+        in a row.
+
+    Input:
+        count: <int> number of integers to be written.
+        [seed]: <int> seed of the random numbers generator.
+        [chunk]: <int> numbers generated and written at once.
+
+    Returns:
+        <string> path of the created file.
+    """
+    rand = random.Random(seed)
+    fdesc, path = tempfile.mkstemp(suffix='.bench')
+    with os.fdopen(fdesc, 'w') as fobj:
+        while count > 0:
+            size = min(chunk, count)
+            fobj.write(''.join(['%d\n' % rand.randint(0, 2**62)
+                                for _ in xrange(size)]))
+            count -= size
+    return path
+
+
+def generate_numbers(distribution, count, seed=0):
+    """
+    Description:
+        Generate integers of the given distribution.
+
+    Input:
+        distribution: <string> one of DISTRIBUTIONS.
+        count: <int> number of integers.
+        [seed]: <int> seed of the random numbers generator.
+
+    Returns:
+        <list> of integers.
+
+    Raises:
+        ValueError: on unknown distribution.
+    """
+    rand = random.Random(seed)
+    if distribution == 'few_unique':
+        return [rand.randint(0, FEW_UNIQUE_NUMBERS-1) for _ in xrange(count)]
+    if distribution == 'zipf':
+        # Rank k is drawn with probability proportional to 1/k**exponent.
+        bounds = []
+        total = 0.0
+        for rank in xrange(1, count+1):
+            total += rank ** -ZIPF_EXPONENT
+            bounds.append(total)
+        return [bisect.bisect_left(bounds, rand.random()*total)+1
+                for _ in xrange(count)]
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError('Unknown distribution: "%s"' % (distribution))
+    numbers = [rand.randint(0, MAX_NUMBER) for _ in xrange(count)]
+    if distribution == 'sorted':
+        numbers.sort()
+    elif distribution == 'reverse':
+        numbers.sort(reverse=True)
+    return numbers
+
+
+def _measure_in_child(case, repeat, conn):
+    """
+    Description:
+        Run a benchmark case repeatedly in a child process and send the
+        best seconds and the peak memory it used over the memory of the
+        process when it started.
+
+    Input:
+        case: <function> running the case once and returning its seconds.
+        repeat: <int> number of runs.
+        conn: <multiprocessing.Connection> to send the result to.
+    """
+    try:
+        start_memory = FileSorter._measure_peak_memory()
+        seconds = min(case() for _ in xrange(repeat))
+        peak_memory = FileSorter._measure_peak_memory()
+        if start_memory is not None:
+            peak_memory -= start_memory
+        conn.send({'seconds': seconds, 'peak_memory': peak_memory})
+    except Exception as exc:  # pylint: disable=broad-except
+        conn.send({'error': '%s - %s' % (exc.__class__.__name__, exc)})
+    conn.close()
+
+
+def measure_case(case, repeat=3):
+    """
+    Description:
+        Measure a benchmark case in a forked child process, so that its
+        peak memory is measured separately from the other cases.
+
+    Input:
+        case: <function> running the case once and returning its seconds.
+        [repeat]: <int> number of runs, the fastest one is reported.
+
+    Returns:
+        <dict> with the seconds and the peak_memory in bytes, or the error
+               of the case.
+    """
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_measure_in_child,
+                                      args=(case, repeat, child_conn))
+    process.start()
+    child_conn.close()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        result = {'error': 'Process exited with code %s' % (process.exitcode)}
+    process.join()
+    return result
+
+
+def _time_sort_function(sort_function, numbers, expected):
+    """
+    Description:
+        Time a sorting function on a copy of the numbers and check its
+        result.
+
+    Returns:
+        <float> seconds spent.
+    """
+    items = list(numbers)
+    start = time.time()
+    sort_function(items)
+    elapsed = time.time() - start
+    if items != expected:
+        raise AssertionError('%s result is not sorted' %
+                             (sort_function.__name__))
+    return elapsed
+
+
+def _time_file_sorter(path, method, *args):
+    """
+    Description:
+        Time a sorting method of FileSorter on a file.
+
+    Returns:
+        <float> seconds spent.
+    """
+    fdesc, output = tempfile.mkstemp(suffix='.bench')
+    os.close(fdesc)
+    try:
+        start = time.time()
+        getattr(FileSorter(path, output), method)(*args)
+        return time.time() - start
+    finally:
+        os.unlink(output)
+
+
+def benchmark_cases(numbers, path, external_divisors):
+    """
+    Description:
+        Generator method for yielding the benchmark cases of a dataset.
+
+    Input:
+        numbers: <list> of integers of the dataset.
+        path: <string> path of a file containing the numbers.
+        external_divisors: <list> of ints, external sort is timed with an
+                           items limit of the numbers divided by each one.
+
+    Yields:
+        <tuple> of the method name and the case function, or None if the
+                method is not applicable to the dataset.
+    """
+    expected = sorted(numbers)
+    value_range = expected[-1] - expected[0] if expected else 0
+    for name, sort_function in SORT_FUNCTIONS:
+        if (sort_function is insertion_sort and
+                len(numbers) > QUADRATIC_MAX_ITEMS) or\
+           (sort_function is counting_sort and
+                value_range > COUNTING_MAX_RANGE_RATIO*len(numbers)):
+            yield name, None
+        else:
+            yield name, partial(_time_sort_function, sort_function, numbers,
+                                expected)
+    yield 'FileSorter.sort', partial(_time_file_sorter, path, 'sort')
+    for divisor in external_divisors:
+        yield ('FileSorter.external_sort/%d' % (divisor),
+               partial(_time_file_sorter, path, 'external_sort',
+                       max(1, len(numbers)/divisor)))
+
+
+def run_suite(sizes, distributions=DISTRIBUTIONS, methods=None, repeat=3,
+              external_divisors=(10, 100)):
+    """
+    Description:
+        Time the sorting functions and FileSorter methods on generated
+        datasets of every distribution and size.
+
+    Input:
+        sizes: <list> of ints, numbers of the datasets.
+        [distributions]: <list> of DISTRIBUTIONS of the datasets.
+        [methods]: <list> of names of the methods to be timed, all if None.
+        [repeat]: <int> number of runs of each case.
+        [external_divisors]: <list> of ints, external sort is timed with an
+                             items limit of the size divided by each one.
+
+    Returns:
+        <dict> of the results and the environment they were measured in,
+               that can be stored as JSON.
+    """
+    results = []
+    print "%-12s %10s %-30s %10s %14s %12s" % (
+        'distribution', 'size', 'method', 'seconds', 'items/sec',
+        'memory')
+    for distribution in distributions:
+        for size in sizes:
+            numbers = generate_numbers(distribution, size)
+            fdesc, path = tempfile.mkstemp(suffix='.bench')
+            with os.fdopen(fdesc, 'w') as fobj:
+                FileSorter._ints_to_fileobj(fobj, iter(numbers))
+            try:
+                for method, case in benchmark_cases(numbers, path,
+                                                    external_divisors):
+                    if methods is not None and method not in methods:
+                        continue
+                    if case is None:
+                        print "%-12s %10d %-30s %10s" % (distribution, size,
+                                                         method, 'skipped')
+                        continue
+                    result = measure_case(case, repeat)
+                    result.update({'distribution': distribution,
+                                   'size': size, 'method': method})
+                    results.append(result)
+                    if 'error' in result:
+                        print "%-12s %10d %-30s %s" % (
+                            distribution, size, method, result['error'])
+                        continue
+                    result['items_per_second'] = size / result['seconds']\
+                        if result['seconds'] > 0 else None
+                    print "%-12s %10d %-30s %10.4f %14.0f %12s" % (
+                        distribution, size, method, result['seconds'],
+                        result['items_per_second'] or 0,
+                        result['peak_memory'])
+            finally:
+                os.unlink(path)
+    return {'python': sys.version.split()[0], 'platform': sys.platform,
+            'cpus': multiprocessing.cpu_count(), 'repeat': repeat,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': results}
+
+
+def compare_results(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """
+    Description:
+        Compare the seconds of the benchmark results with the ones of a
+        baseline, for the cases measured in both of them.
+
+    Input:
+        baseline: <dict> results of run_suite.
+        current: <dict> results of run_suite.
+        [threshold]: <float> slowdown ratio over the baseline seconds that
+                     is a regression, e.g. 0.1 for 10% slower.
+
+    Returns:
+        <list> of (distribution, size, method, baseline seconds, current
+               seconds, ratio, is regression) tuples.
+    """
+    def case_key(result):
+        """Key of the case of a result."""
+        return result['distribution'], result['size'], result['method']
+
+    base_seconds = dict((case_key(result), result['seconds'])
+                        for result in baseline['results']
+                        if 'seconds' in result)
+    compared = []
+    for result in current['results']:
+        key = case_key(result)
+        if 'seconds' not in result or key not in base_seconds:
+            continue
+        ratio = result['seconds'] / base_seconds[key]\
+            if base_seconds[key] > 0 else 1.0
+        compared.append(key + (base_seconds[key], result['seconds'], ratio,
+                               ratio > 1 + threshold))
+    return compared
+
+
+def report_comparison(compared):
+    """
+    Description:
+        Print the comparison of benchmark results with a baseline.
+
+    Input:
+        compared: <list> of the tuples of compare_results.
+
+    Returns:
+        <int> number of regressions.
+    """
+    print "%-12s %10s %-30s %10s %10s %8s" % (
+        'distribution', 'size', 'method', 'baseline', 'current', 'ratio')
+    for row in compared:
+        print "%-12s %10d %-30s %10.4f %10.4f %8.2f%s" %\
+            (row[:6] + (' REGRESSION' if row[6] else '',))
+    regressions = sum(1 for row in compared if row[6])
+    print "%d cases compared, %d regressions" % (len(compared), regressions)
+    return regressions
+
+
+def time_external_sort(path, itemslimit, workers=None):
+    """
+    Description:
+        Time the external sort of a file.
+
+    Input:
+        path: <string> path of the file to be sorted.
+        itemslimit: <int> limit of items loaded to memory.
+        [workers]: <int> number of worker processes.
+
+    Returns:
+        <float> wall clock seconds spent.
+    """
+    file_sort = FileSorter(input_file=path)
+    start = time.time()
+    file_sort.external_sort(itemslimit, workers=workers)
+    elapsed = time.time() - start
+    os.remove(file_sort.get_output_filename())
+    return elapsed
+
+
+def bench_workers(count, itemslimit, max_workers):
+    """
+    Description:
+        Report wall clock scaling of external sort from a single process
+        up to max_workers worker processes.
+
+    Input:
+        count: <int> number of integers in the generated file.
+        itemslimit: <int> limit of items loaded to memory.
+        max_workers: <int> maximum number of worker processes.
+    """
+    path = create_numbers_file(count)
+    try:
+        print "%-10s %12s %10s" % ('workers', 'seconds', 'speedup')
+        base = time_external_sort(path, itemslimit)
+        print "%-10s %12.2f %10.2f" % ('none', base, 1.0)
+        workers = 1
+        while workers <= max_workers:
+            elapsed = time_external_sort(path, itemslimit, workers)
+            print "%-10d %12.2f %10.2f" % (workers, elapsed, base/elapsed)
+            workers *= 2
+    finally:
+        os.unlink(path)
+
+
+def time_run_format(numbers, to_fileobj, from_fileobj):
+    """
+    Description:
+        Time the spilling of numbers to a temporary file and the reading
+        of them back.
+
+    Input:
+        numbers: <list> of sorted integers.
+        to_fileobj: <function> writing an iterator of ints to a file object.
+        from_fileobj: <function> getting an iterator of ints of a file object.
+
+    Returns:
+        <tuple> of write seconds, read seconds and file size in bytes.
+    """
+    fobj = tempfile.TemporaryFile()
+    start = time.time()
+    to_fileobj(fobj, iter(numbers))
+    written = time.time() - start
+    size = fobj.tell()
+    fobj.seek(0)
+    start = time.time()
+    for _ in from_fileobj(fobj):
+        pass
+    read = time.time() - start
+    fobj.close()
+    return written, read, size
+
+
+def bench_run_format(count, max_number=MAX_NUMBER):
+    """
+    Description:
+        Compare the text format of the temporary sorted files with the
+        binary run format, plain, delta encoded and compressed.
+
+    Input:
+        count: <int> number of integers in the sorted run.
+        [max_number]: <int> maximum of the random integers, the smaller
+                      it is the denser and more compressible the run is.
+    """
+    rand = random.Random(0)
+    numbers = sorted(rand.randint(0, max_number) for _ in xrange(count))
+    formats = [('text', FileSorter._ints_to_fileobj,
+                FileSorter._ints_from_fileobj)]
+    for name, codec in (('binary', None),
+                        ('delta', RunCodec(delta=True)),
+                        ('zlib', RunCodec('zlib')),
+                        ('zlib+delta', RunCodec('zlib', delta=True)),
+                        ('bz2+delta', RunCodec('bz2', delta=True))):
+        formats.append((name, partial(items_to_run, codec=codec),
+                        partial(items_from_run, codec=codec)))
+    print "%-10s %12s %12s %14s" % ('format', 'write sec', 'read sec',
+                                    'bytes')
+    for name, to_fileobj, from_fileobj in formats:
+        print "%-10s %12.2f %12.2f %14d" %\
+            ((name,) + time_run_format(numbers, to_fileobj, from_fileobj))
+
+
+def bench_load(count):
+    """
+    Description:
+        Compare loading the integers of a file line by line with loading
+        them from the memory mapped file.
+
+    Input:
+        count: <int> number of integers in the generated file.
+    """
+    path = create_numbers_file(count)
+    try:
+        print "%-10s %12s" % ('loader', 'seconds')
+        start = time.time()
+        with open(path, 'r') as fobj:
+            [i for i in FileSorter._ints_from_fileobj(fobj)]
+        print "%-10s %12.2f" % ('lines', time.time() - start)
+        start = time.time()
+        FileSorter._ints_from_mmap(path)
+        print "%-10s %12.2f" % ('mmap', time.time() - start)
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    # Description:
+    #    Script to benchmark the file sorting tools on generated files.
+    #      workers: external sort of a file with 100M integers by default,
+    #               sorted with up to one worker per available cpu.
+    #      runformat: text vs binary, delta encoded and compressed
+    #                 temporary sorted files, for a run of 10M integers
+    #                 up to 2**62 by default.
+    #      load: line by line vs memory mapped loading of a file with 10M
+    #            integers by default.
+    #      suite: every sorting function and FileSorter method on datasets
+    #             of every distribution and size, stored as JSON and
+    #             compared with a baseline.
+    #      compare: compare stored suite results with a baseline.
+    PARSER = argparse.ArgumentParser()
+    SUBPARSERS = PARSER.add_subparsers(dest='benchmark')
+    PARSER_WORKERS = SUBPARSERS.add_parser('workers')
+    PARSER_WORKERS.add_argument('count', nargs='?', type=int,
+                                default=100000000)
+    PARSER_WORKERS.add_argument('itemslimit', nargs='?', type=int,
+                                default=1000000)
+    PARSER_WORKERS.add_argument('max_workers', nargs='?', type=int,
+                                default=multiprocessing.cpu_count())
+    PARSER_RUNFORMAT = SUBPARSERS.add_parser('runformat')
+    PARSER_RUNFORMAT.add_argument('count', nargs='?', type=int,
+                                  default=10000000)
+    PARSER_RUNFORMAT.add_argument('max_number', nargs='?', type=int,
+                                  default=MAX_NUMBER)
+    PARSER_LOAD = SUBPARSERS.add_parser('load')
+    PARSER_LOAD.add_argument('count', nargs='?', type=int, default=10000000)
+    PARSER_SUITE = SUBPARSERS.add_parser('suite')
+    PARSER_SUITE.add_argument('--sizes', nargs='+', type=int,
+                              default=[1000, 10000, 100000])
+    PARSER_SUITE.add_argument('--distributions', nargs='+',
+                              choices=DISTRIBUTIONS, default=DISTRIBUTIONS)
+    PARSER_SUITE.add_argument('--methods', nargs='+',
+                              help='names of the methods, all by default')
+    PARSER_SUITE.add_argument('--repeat', type=int, default=3)
+    PARSER_SUITE.add_argument('--external-divisors', nargs='+', type=int,
+                              default=[10, 100], metavar='DIVISOR',
+                              help='external sort items limits as the '
+                                   'size divided by each divisor')
+    PARSER_SUITE.add_argument('--output', help='JSON file of the results')
+    PARSER_SUITE.add_argument('--baseline',
+                              help='JSON file of results to compare with')
+    PARSER_SUITE.add_argument('--threshold', type=float,
+                              default=REGRESSION_THRESHOLD)
+    PARSER_COMPARE = SUBPARSERS.add_parser('compare')
+    PARSER_COMPARE.add_argument('baseline', help='JSON file of results')
+    PARSER_COMPARE.add_argument('current', help='JSON file of results')
+    PARSER_COMPARE.add_argument('--threshold', type=float,
+                                default=REGRESSION_THRESHOLD)
+    ARGS = PARSER.parse_args()
+
+    EXITCODE = 0
+    if ARGS.benchmark == 'workers':
+        bench_workers(ARGS.count, ARGS.itemslimit, ARGS.max_workers)
+    elif ARGS.benchmark == 'runformat':
+        bench_run_format(ARGS.count, ARGS.max_number)
+    elif ARGS.benchmark == 'load':
+        bench_load(ARGS.count)
+    else:
+        if ARGS.benchmark == 'suite':
+            CURRENT = run_suite(ARGS.sizes, ARGS.distributions, ARGS.methods,
+                                ARGS.repeat, ARGS.external_divisors)
+            if ARGS.output:
+                with open(ARGS.output, 'w') as FOBJ:
+                    json.dump(CURRENT, FOBJ, indent=1, sort_keys=True)
+        else:
+            with open(ARGS.current, 'r') as FOBJ:
+                CURRENT = json.load(FOBJ)
+        if ARGS.baseline:
+            with open(ARGS.baseline, 'r') as FOBJ:
+                BASELINE = json.load(FOBJ)
+            print
+            if report_comparison(compare_results(BASELINE, CURRENT,
+                                                 ARGS.threshold)):
+                EXITCODE = 1
+    sys.exit(EXITCODE)
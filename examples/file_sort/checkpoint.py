@@ -0,0 +1,207 @@
+"""Module containing tools for checkpointing external sorts.
+
+A checkpointed external sort keeps its sorted runs in a work directory,
+along with a manifest describing its progress, so that it can be resumed
+after being interrupted instead of starting over:
+  1. While the runs are created, the manifest lists the completed runs
+     and the number of input items stored in them, which are skipped
+     when resuming.
+  2. After each merge pass, the manifest lists the runs created by the
+     pass, which are merged when resuming.
+The runs are synced to the disk before being listed, and the manifest is
+replaced atomically, so that it always describes a consistent state.
+"""
+
+import os
+import json
+
+# Name of the manifest file in the work directory.
+MANIFEST_NAME = 'manifest.json'
+
+# Version of the manifest format, manifests of other versions are invalid.
+MANIFEST_VERSION = 1
+
+
+class CheckpointError(Exception):
+    """Exception to be raised in case of an invalid checkpoint."""
+    pass
+
+
+def sync_file(path):
+    """
+    Description:
+        Flush the data of a file, or a directory, to the disk.
+
+    Input:
+        path: <string> path of the file or directory.
+    """
+    fdesc = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fdesc)
+    finally:
+        os.close(fdesc)
+
+
+class Checkpoint(object):
+    """
+    Description:
+        Object describing the progress of an external sort, as stored in
+        the manifest of its work directory.
+
+    Input:
+        work_dir: <string> path of the existing work directory.
+        settings: <dict> of JSON serializable values that the runs depend
+                  on, as the input file and their encoding. A manifest of
+                  other settings can not be resumed.
+
+    Raises:
+        CheckpointError: if the work directory does not exist.
+    """
+    def __init__(self, work_dir, settings):
+        if os.path.isdir(work_dir) is False:
+            raise CheckpointError('"%s" directory does not exist' %
+                                  (work_dir))
+        self.work_dir = work_dir
+        self.manifest_path = os.path.join(work_dir, MANIFEST_NAME)
+        # Compare the settings as they are loaded from the manifest.
+        self.settings = json.loads(json.dumps(settings))
+        self.runs = []
+        self.input_items = 0
+        self.input_runs = 0
+        self.runs_complete = False
+        self.merge_passes = 0
+
+    def load(self):
+        """
+        Description:
+            Load the progress of the manifest, if there is one.
+
+        Returns:
+            <boolean> True if the progress is loaded, False if there is no
+                      manifest.
+
+        Raises:
+            CheckpointError: on an invalid manifest, one of other settings,
+                             or if any of its runs is missing.
+        """
+        try:
+            with open(self.manifest_path, 'r') as fobj:
+                manifest = json.load(fobj)
+        except IOError:
+            if os.path.exists(self.manifest_path):
+                raise
+            return False
+        except ValueError as exc:
+            raise CheckpointError('Invalid manifest "%s": %s' %
+                                  (self.manifest_path, exc))
+        if not isinstance(manifest, dict) or\
+                manifest.get('version') != MANIFEST_VERSION:
+            raise CheckpointError('Invalid manifest "%s"' %
+                                  (self.manifest_path))
+        if manifest.get('settings') != self.settings:
+            raise CheckpointError('Manifest "%s" is of a different sort, '
+                                  'remove it to start over' %
+                                  (self.manifest_path))
+        try:
+            runs = [str(name) for name in manifest['runs']]
+            progress = (int(manifest['input_items']),
+                        int(manifest['input_runs']),
+                        bool(manifest['runs_complete']),
+                        int(manifest['merge_passes']))
+        except (KeyError, TypeError, ValueError) as exc:
+            raise CheckpointError('Invalid manifest "%s": %s' %
+                                  (self.manifest_path, exc))
+        for path in self._paths(runs):
+            if os.path.isfile(path) is False:
+                raise CheckpointError('Missing sorted file "%s"' % (path))
+        self.runs = runs
+        (self.input_items, self.input_runs, self.runs_complete,
+         self.merge_passes) = progress
+        return True
+
+    def save(self):
+        """
+        Description:
+            Write the manifest, by replacing the previous one atomically.
+        """
+        manifest = {'version': MANIFEST_VERSION, 'settings': self.settings,
+                    'runs': self.runs, 'input_items': self.input_items,
+                    'input_runs': self.input_runs,
+                    'runs_complete': self.runs_complete,
+                    'merge_passes': self.merge_passes}
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as fobj:
+            json.dump(manifest, fobj, sort_keys=True)
+            fobj.flush()
+            os.fsync(fobj.fileno())
+        os.rename(tmp_path, self.manifest_path)
+        sync_file(self.work_dir)
+
+    def clear(self):
+        """
+        Description:
+            Remove the manifest, when the sort is completed.
+        """
+        self.runs = []
+        if os.path.exists(self.manifest_path):
+            os.unlink(self.manifest_path)
+
+    def add_run(self, path, items):
+        """
+        Description:
+            Record a completed run created from the input.
+
+        Input:
+            path: <string> path of the run in the work directory.
+            items: <int> number of input items stored in the run.
+        """
+        sync_file(path)
+        self.runs.append(os.path.basename(path))
+        self.input_items += items
+        self.input_runs += 1
+        self.save()
+
+    def complete_runs(self, paths, items):
+        """
+        Description:
+            Record that all the runs are created from the input.
+
+        Input:
+            paths: <list> of the paths of the runs in the work directory.
+            items: <int> number of input items stored in the runs.
+        """
+        for path in paths:
+            sync_file(path)
+        self.runs = [os.path.basename(path) for path in paths]
+        self.input_items = items
+        self.input_runs = len(paths)
+        self.runs_complete = True
+        self.save()
+
+    def complete_pass(self, paths):
+        """
+        Description:
+            Record a completed merge pass.
+
+        Input:
+            paths: <list> of the paths of the runs created by the pass.
+        """
+        for path in paths:
+            sync_file(path)
+        self.runs = [os.path.basename(path) for path in paths]
+        self.merge_passes += 1
+        self.save()
+
+    def run_paths(self):
+        """
+        Description:
+            Get the paths of the recorded runs.
+
+        Returns:
+            <list> of paths in the work directory.
+        """
+        return self._paths(self.runs)
+
+    def _paths(self, names):
+        """Join names of runs to the work directory."""
+        return [os.path.join(self.work_dir, name) for name in names]
@@ -3,12 +3,82 @@
 
 import os
 import sys
+import mmap
+import json
+import time
 import heapq
+import argparse
 import tempfile
+import multiprocessing
 
-from sorting_methods import quicksort,\
+from contextlib import contextmanager
+from operator import itemgetter
+from collections import deque
+from itertools import chain,\
+                      cycle,\
+                      imap,\
+                      islice,\
+                      groupby
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+from functools import partial
+
+from sorting_methods import numpy,\
+                            auto_sort,\
+                            quicksort,\
                             merge_sort,\
-                            default_sort
+                            numpy_sort,\
+                            radix_sort,\
+                            default_sort,\
+                            integer_sort,\
+                            counting_sort,\
+                            NUMPY_SORT_KINDS
+from run_format import RunCodec,\
+                       COMPRESSIONS,\
+                       RUN_BLOCK_ITEMS,\
+                       RunFormatError,\
+                       items_to_run,\
+                       items_from_run
+from record_format import RecordFormat,\
+                          RecordFormatError
+from checkpoint import Checkpoint,\
+                       CheckpointError
+
+
+# Default maximum number of integers written at once to the output file.
+WRITE_BATCH_ITEMS = 4096
+NDARRAY_WRITE_BATCH_ITEMS = 65536
+
+# Minimum number of integers read at once from each merged sorted file.
+MIN_MERGE_BLOCK_ITEMS = 64
+
+# Default maximum number of temporary sorted files open at once.
+MAX_OPEN_FILES = 512
+
+# Suffix of the names of the temporary sorted files.
+RUN_SUFFIX = '.run'
+
+# Number of integers loaded for measuring their memory cost.
+MEMORY_SAMPLE_ITEMS = 1000
+
+# Number of bytes of a memory mapped input file parsed at once.
+LOAD_CHUNK_BYTES = 1 << 22
+
+# Path standing for the standard input or output.
+STDIO_PATH = '-'
+
+# Phases of the sorting that are timed in the sorting stats.
+STATS_PHASES = ('read', 'sort', 'spill', 'merge', 'write')
+
+# Part of the available memory used by auto sorting, and ratio of the
+# memory needed for sorting loaded items to their own memory, as sorting
+# algorithms use buffers or copies of them.
+AUTO_MEMORY_FRACTION = 0.5
+AUTO_MEMORY_OVERHEAD = 2
 
 
 class InitializeError(Exception):
@@ -28,23 +98,122 @@ class FileSorter(object):
         Object for sorting the contents of a given input file that contains
         numbers. Sorting can be done in various ways by selecting different
         sorting public method or providing custom sorting functions.
+        Input and output can also be streams, so that it can be used in
+        pipelines, in which case the input can be sorted only once.
+        Instead of numbers, the input can contain delimited records that
+        are sorted by key columns, as described by a record format.
 
     Input:
         input_file: <string> path of a file containing numbers(one if a row)
+                             or STDIO_PATH for the standard input.
+                    <file object> opened with read permissions.
+                    <iterable> of integers, or lines in records sorting.
+        [output]: <string> path of the output file, or STDIO_PATH for the
+                           standard output. Defaults to the input file's
+                           path with '.sorted' suffix, or to the standard
+                           output if the input is not a file path.
+                  <file object> or any object with a write method.
+        [record_format]: <RecordFormat> of the records to be sorted, in
+                          case that the input contains records.
 
     Raises:
         InitializeError: on invalid initialization process.
     """
-    def __init__(self, input_file):
-        if os.path.isfile(input_file) is False:
-            raise InitializeError('"%s" file does not exist' % (input_file))
+    def __init__(self, input_file, output=None, record_format=None):
+        # Input file is set only if that is a file path, otherwise the
+        # input object is set.
+        self._input_file = None
+        self._input = None
+        if isinstance(input_file, basestring) and input_file == STDIO_PATH:
+            self._input = sys.stdin
+        elif isinstance(input_file, basestring):
+            if os.path.isfile(input_file) is False:
+                raise InitializeError('"%s" file does not exist' %
+                                      (input_file))
+            self._input_file = input_file
+        elif hasattr(input_file, '__iter__'):
+            self._input = input_file
+        else:
+            raise InitializeError('Invalid input: "%s"' % (input_file,))
+
+        # Output path is set only if that is a file path, otherwise the
+        # output stream is set.
+        if output is None and self._input_file is not None:
+            output = '%s.sorted' % (self._input_file)
+        elif output is None or\
+                (isinstance(output, basestring) and output == STDIO_PATH):
+            output = sys.stdout
+        self._output_path = None
+        self._output = None
+        if isinstance(output, basestring):
+            self._output_path = output
+        elif hasattr(output, 'write'):
+            self._output = output
+        else:
+            raise InitializeError('Invalid output: "%s"' % (output,))
 
         # Output file should have a value other than None only if the
         # result contents are writen successfully.
         self._output_file = None
-        self._input_file = input_file
+        self._peak_memory = None
+        self._peak_memory_increase = None
+        self._record_format = record_format
+
+        # Encoding and directories of the temporary sorted files of the
+        # external sort, with the bytes of each one that exists.
+        self._run_codec = RunCodec()
+        self._tmp_dirs = cycle([None])
+        self._checkpoint = None
+        self._run_sizes = {}
+        self._disk_usage = 0
+        self._peak_disk_usage = 0
+        self._bytes_spilled = 0
+
+        # Stats of the last sort, which are reported to the progress
+        # function while sorting, if any.
+        self._start_stats(None)
+
+    @contextmanager
+    def _open_input(self):
+        """
+        Description:
+            Context manager for reading the input numbers, or records in
+            case of a record format.
+
+        Returns:
+            <iterator> yielding the input integers or records.
+        """
+        if self._record_format is not None:
+            from_lines = self._record_format.records
+        else:
+            from_lines = self._ints_from_fileobj
+        if self._input_file is not None:
+            with open(self._input_file, 'r') as fobj:
+                yield from_lines(fobj)
+        elif hasattr(self._input, 'read') or self._record_format is not None:
+            yield from_lines(self._input)
+        else:
+            yield iter(self._input)
 
-    def sort(self, sort_method=None):
+    @contextmanager
+    def _open_output(self):
+        """
+        Description:
+            Context manager for writing the sorted numbers.
+
+        Returns:
+            <file object> of the output file or stream.
+        """
+        if self._output_path is not None:
+            self._output_file = self._output_path
+            with open(self._output_path, 'w') as fobj:
+                yield fobj
+        else:
+            yield self._output
+            self._output.flush()
+            self._output_file = getattr(self._output, 'name', None)
+
+    def sort(self, sort_method=None, unique=False, progress=None):
         """
         Description:
             Method for sorting the contents of an input file and creates
@@ -52,24 +221,302 @@ class FileSorter(object):
 
         Input:
             [sort_method]: <function> sorting function to be used instead
-                            of default.
+                            of default. If that is numpy_sort, or a partial
+                            of it, the numbers are loaded into a numpy array.
+            [unique]: <boolean> write each distinct number once.
+            [progress]: <function> called with the stats of get_stats when
+                         the input is loaded, when it is sorted and at the
+                         end.
+
+        Raises:
+            SortingError: if numpy_sort is used on not 64-bit integers.
+            ImportError: if numpy_sort is used without numpy available.
         """
         if sort_method is None:
             sort_method = default_sort
 
+        if getattr(sort_method, 'func', sort_method) is numpy_sort:
+            if self._record_format is not None:
+                raise SortingError('Records can not be sorted by numpy')
+            if numpy is None:
+                raise ImportError('numpy is required by numpy_sort')
+            self._start_stats('sort', progress)
+            self._sort_ndarray(sort_method, unique)
+            self._finish_stats()
+            return
+
         # Create a list containing the integer numbers found in input file.
-        with open(self._input_file, 'r') as fobj:
-            itemslist = [i for i in self._ints_from_fileobj(fobj)]
+        self._start_stats('sort', progress)
+        with self._timed('read'):
+            itemslist = None
+            if self._input_file is not None and self._record_format is None:
+                itemslist = self._ints_from_mmap(self._input_file)
+            if itemslist is None:
+                with self._open_input() as int_loader:
+                    itemslist = [i for i in int_loader]
+        self._stats['items'] = len(itemslist)
+        self._report_progress()
 
         # Sort the list.
-        sort_method(itemslist)
+        with self._timed('sort'):
+            sort_method(itemslist)
+        self._report_progress()
 
         # Create the output file that contains sorted contents.
-        self._output_file = '%s.sorted' % (self._input_file)
-        with open(self._output_file, 'w') as fobj:
-            self._ints_to_fileobj(fobj, iter(itemslist))
+        int_iter = iter(itemslist)
+        if unique:
+            int_iter = self._unique_iter(int_iter)
+        with self._timed('write'):
+            with self._open_output() as fobj:
+                self._write_items(fobj, int_iter)
+        self._finish_stats()
+
+    def _sort_ndarray(self, sort_method, unique=False):
+        """
+        Description:
+            Same as sort, but the numbers are loaded, sorted and written as
+            a numpy int64 array.
+
+        Input:
+            sort_method: <function> sorting a numpy array in place.
+            [unique]: <boolean> write each distinct number once.
+
+        Raises:
+            SortingError: if the input contains not 64-bit integers.
+        """
+        with self._timed('read'):
+            if self._input_file is not None:
+                items = self._ndarray_from_mmap(self._input_file)
+            else:
+                with self._open_input() as int_loader:
+                    try:
+                        items = numpy.fromiter(int_loader,
+                                               dtype=numpy.int64)
+                    except (ValueError, OverflowError) as exc:
+                        raise SortingError('Not 64-bit integers input: %s' %
+                                           (exc))
+        self._stats['items'] = len(items)
+        self._report_progress()
+        with self._timed('sort'):
+            sort_method(items)
+        self._report_progress()
+        with self._timed('write'):
+            if unique and len(items):
+                items = items[numpy.concatenate(([True],
+                                                 items[1:] != items[:-1]))]
+            with self._open_output() as fobj:
+                self._ndarray_to_fileobj(fobj, items)
+
+    def auto_sort(self, memory_bytes=None, unique=False, progress=None):
+        """
+        Description:
+            Method for sorting the contents of an input file by choosing
+            between sorting them in memory and the external sort, by the
+            memory they need. The process that is being followed is:
+              1. Estimate the memory needed by an input file, by its size
+                 and the size and memory cost of its first items.
+              2. Sort the items in memory, by the sorting function that
+                 sorting_methods.auto_sort chooses by their profile, if
+                 they fit in the memory limit or if the limit is unknown.
+              3. Otherwise, or if the input is a stream of unknown size
+                 with a known memory limit, apply the external sort within
+                 the memory limit.
+
+        Input:
+            [memory_bytes]: <integer> limit of memory in bytes. Defaults to
+                             AUTO_MEMORY_FRACTION of the available memory,
+                             if that can be found in the current platform.
+            [unique]: <boolean> write each distinct number once.
+            [progress]: <function> called with the stats of get_stats, as
+                         described by sort and external_sort.
+
+        Raises:
+            SortingError: while doing sorting operations.
+            IOError: while doing file operations.
+        """
+        if memory_bytes is not None and\
+           (isinstance(memory_bytes, int) is False or memory_bytes < 1):
+            raise SortingError('Invalid memory_bytes param: "%s"' %
+                               (memory_bytes))
+        if memory_bytes is None:
+            available = self._available_memory()
+            if available is not None:
+                memory_bytes = int(available*AUTO_MEMORY_FRACTION)
+
+        needed = self._estimate_memory()
+        if memory_bytes is None or\
+           (needed is not None and
+                needed*AUTO_MEMORY_OVERHEAD <= memory_bytes):
+            self.sort(sort_method=auto_sort, unique=unique, progress=progress)
+        else:
+            self.external_sort(memory_bytes=max(1, memory_bytes /
+                                                AUTO_MEMORY_OVERHEAD),
+                               sort_method=default_sort, unique=unique,
+                               progress=progress)
+
+    def _estimate_memory(self):
+        """
+        Description:
+            Estimate the memory needed for loading the items of the input
+            file, by the size of the file and the average size and memory
+            cost of its first items.
+
+        Returns:
+            <float> bytes
+            <None> if the input is not a file.
+        """
+        if self._input_file is None:
+            return None
+        with open(self._input_file, 'r') as fobj:
+            lines = list(islice(fobj, MEMORY_SAMPLE_ITEMS))
+        if not lines:
+            return 0.0
+        if self._record_format is not None:
+            sample = list(self._record_format.records(lines))
+        else:
+            sample = list(self._ints_from_fileobj(lines))
+        line_bytes = sum(imap(len, lines)) / float(len(lines))
+        return os.path.getsize(self._input_file) / line_bytes *\
+            self._item_memory_cost(sample)
 
-    def external_sort(self, itemslimit, sort_method=None):
+    @staticmethod
+    def _available_memory():
+        """
+        Description:
+            Find the memory in bytes available for starting new processes
+            without swapping, or else the free memory.
+
+        Returns:
+            <int> bytes
+            <None> if it can not be found in the current platform.
+        """
+        try:
+            with open('/proc/meminfo', 'r') as fobj:
+                for line in fobj:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1])*1024
+        except (IOError, ValueError, IndexError):  # pragma: no cover
+            pass
+        try:  # pragma: no cover
+            return os.sysconf('SC_AVPHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')
+        except (AttributeError, ValueError, OSError):  # pragma: no cover
+            return None
+
+    def top_k(self, k):
+        """
+        Description:
+            Method for writing to the output file the k smallest numbers of
+            the input file in sorted order, by keeping in memory a bounded
+            heap of up to k numbers instead of sorting all of them.
+
+        Input:
+            k: <integer> number of smallest numbers.
+
+        Raises:
+            SortingError: on invalid k.
+        """
+        if isinstance(k, int) is False or k < 0:
+            raise SortingError('Invalid k param: "%s"' % (k))
+        with self._open_input() as int_loader:
+            itemslist = heapq.nsmallest(k, int_loader)
+        with self._open_output() as fobj:
+            self._write_items(fobj, iter(itemslist))
+
+    def merge_files(self, sorted_inputs=(), unique=False):
+        """
+        Description:
+            Method for merging the already sorted numbers of the input file
+            with the ones of other sorted inputs into the output file,
+            without creating intermediate sorted files.
+
+        Input:
+            [sorted_inputs]: <list> of inputs, in any of the forms accepted
+                              as FileSorter input, with sorted numbers.
+            [unique]: <boolean> write each distinct number once.
+
+        Raises:
+            InitializeError: on invalid sorted inputs.
+            SortingError: if an input is not sorted.
+        """
+        sorters = [self] + [FileSorter(sorted_input, output=self._output,
+                                       record_format=self._record_format)
+                            for sorted_input in sorted_inputs]
+        opened = []
+        try:
+            for idx, sorter in enumerate(sorters):
+                manager = sorter._open_input()
+                int_loader = self._check_sorted(manager.__enter__(), idx)
+                if self._record_format is not None:
+                    int_loader = self._tag_records(int_loader, idx)
+                opened.append((manager, int_loader))
+            int_iter = heapq.merge(*[int_loader for _, int_loader in opened])
+            if unique:
+                int_iter = self._unique_iter(int_iter)
+            with self._open_output() as fobj:
+                self._write_items(fobj, int_iter)
+        finally:
+            for manager, _ in opened:
+                manager.__exit__(None, None, None)
+
+    @staticmethod
+    def _check_sorted(items, idx):
+        """
+        Description:
+            Generator method for yielding the items of a sorted input and
+            checking that they are in order.
+
+        Input:
+            items: <iterator> of an input's numbers.
+            idx: <int> position of the input, used for reporting.
+
+        Raises:
+            SortingError: if the input is not sorted.
+        """
+        prev = None
+        for item in items:
+            if prev is not None and item < prev:
+                raise SortingError('Input %d is not sorted' % (idx))
+            prev = item
+            yield item
+
+    @staticmethod
+    def _tag_records(records, idx):
+        """
+        Description:
+            Generator method for yielding records with the position of
+            their input after their key, so that merging records of
+            multiple inputs with equal keys keeps the order of the inputs.
+
+        Input:
+            records: <iterator> of (key, sequence, line) records.
+            idx: <int> position of the input.
+        """
+        for record in records:
+            yield (record[0], idx) + record[1:]
+
+    def _unique_iter(self, items):
+        """
+        Description:
+            Get an iterator yielding once each one of sorted items, or the
+            first one of records with equal keys.
+
+        Input:
+            items: <iterator> of sorted items.
+
+        Returns:
+            <iterator> of the distinct items.
+        """
+        if self._record_format is not None:
+            return imap(next, imap(itemgetter(1),
+                                   groupby(items, itemgetter(0))))
+        return imap(itemgetter(0), groupby(items))
+
+    def external_sort(self, itemslimit=None, sort_method=None, workers=None,
+                      memory_bytes=None, replacement_selection=False,
+                      unique=False, compression=None, compress_level=None,
+                      delta_encoding=False, tmp_dir=None,
+                      max_open_files=MAX_OPEN_FILES, progress=None,
+                      work_dir=None):
         """
         Description:
             Method for sorting the contents of an input file and creates
@@ -78,114 +525,849 @@ class FileSorter(object):
             process that is being followed to achieve that is:
               1. Create intermediate files with size up to the memory limit.
               2. Sort these intermediate files.
-              3. Merge them into the output result file.
+              3. Merge them into the output result file, in multiple passes
+                 if they are too many to be merged at once.
+            The intermediate files are closed while they are not merged
+            and removed as soon as they are merged, or in case of an error.
+            In the checkpointed mode (work_dir argument) they are kept in
+            case of an error, so that the sort can be resumed.
 
         Input:
-            itemslimit: <integer> limit of items can be loaded to memory
-                         simultaneously.
+            [itemslimit]: <integer> limit of items can be loaded to memory
+                           simultaneously.
             [sort_method]: <function > sorting function to be used instead
                             of default. Must apply an in place sort and not
                             use any additional memory.
+            [workers]: <integer> number of processes used for sorting and
+                        spilling the intermediate files while the input
+                        file is still being read. Each worker holds up to
+                        itemslimit items, so memory usage grows with it.
+                        The sort_method must be picklable (module level).
+            [memory_bytes]: <integer> limit of memory in bytes to be used
+                             instead of itemslimit. The items limit is set
+                             by measuring the memory cost of the first input
+                             numbers, and it is shared by the workers.
+            [replacement_selection]: <boolean> create the intermediate files
+                                      by a heap of the items loaded to
+                                      memory, instead of sorting them with
+                                      sort_method. The files created are
+                                      about twice the memory limit on
+                                      random input and a single file on
+                                      sorted input. Can not be combined
+                                      with workers.
+            [unique]: <boolean> write each distinct number once, by
+                       removing duplicates while merging.
+            [compression]: <string> compress the intermediate files with
+                            one of the run_format.COMPRESSIONS (zlib, bz2
+                            or lzma if available), trading cpu time for
+                            less disk i/o. They are decompressed in parts
+                            while merging.
+            [compress_level]: <integer> level of the compression, the
+                               fastest one by default.
+            [delta_encoding]: <boolean> store the differences of the sorted
+                               numbers of the intermediate files instead of
+                               the numbers, which are compressed much better.
+            [tmp_dir]: <string> directory of the intermediate files, or
+                        <list> of directories, as on different disks, that
+                        are used in turn. Defaults to the tempfile one.
+            [max_open_files]: <integer> maximum number of intermediate
+                               files open at once, at least 3. Limits the
+                               files merged at once, including the one
+                               written by an intermediate merge pass.
+            [progress]: <function> called with the stats of get_stats after
+                         each intermediate file is created and at the end.
+            [work_dir]: <string> directory dedicated to the sort, where the
+                         intermediate files are kept along with a manifest
+                         of the progress, instead of tmp_dir. If the sort
+                         is interrupted, calling it again with the same
+                         input file and arguments skips the input items of
+                         the intermediate files that are created, or the
+                         merge passes that are done. Each merge pass keeps
+                         its input files until it is done, so it needs up
+                         to twice the disk space of the intermediate files.
 
         Raises:
-            SortingError: while doing sorting operations.
+            SortingError: while doing sorting operations, or in case of an
+                          invalid checkpoint in work_dir.
             IOError: while doing file operations.
         """
         if sort_method is None:
             sort_method = quicksort
-        if isinstance(itemslimit, int) is False or itemslimit < 1:
+        try:
+            run_codec = RunCodec(compression, compress_level, delta_encoding)
+        except RunFormatError as exc:
+            raise SortingError(str(exc))
+        if (itemslimit is None) == (memory_bytes is None):
+            raise SortingError('Exactly one of itemslimit and memory_bytes '
+                               'params is required')
+        if memory_bytes is not None and\
+           (isinstance(memory_bytes, int) is False or memory_bytes < 1):
+            raise SortingError('Invalid memory_bytes param: "%s"' %
+                               (memory_bytes))
+        if itemslimit is not None and\
+           (isinstance(itemslimit, int) is False or itemslimit < 1):
             raise SortingError('Invalid itemslimit param: "%s"' % (itemslimit))
+        if workers is not None and\
+           (isinstance(workers, int) is False or workers < 1):
+            raise SortingError('Invalid workers param: "%s"' % (workers))
+        if workers is not None and replacement_selection:
+            raise SortingError('Replacement selection can not be done by '
+                               'workers')
+        if isinstance(max_open_files, int) is False or max_open_files < 3:
+            raise SortingError('Invalid max_open_files param: "%s"' %
+                               (max_open_files,))
+        if work_dir is not None:
+            if tmp_dir is not None:
+                raise SortingError('Only one of tmp_dir and work_dir params '
+                                   'is allowed')
+            tmp_dir = work_dir
+        tmp_dirs = [tmp_dir] if tmp_dir is None or\
+            isinstance(tmp_dir, basestring) else list(tmp_dir)
+        if not tmp_dirs:
+            raise SortingError('At least one tmp_dir is required')
+        for directory in tmp_dirs:
+            if directory is not None and os.path.isdir(directory) is False:
+                raise SortingError('"%s" directory does not exist' %
+                                   (directory))
+        checkpoint = None
+        if work_dir is not None:
+            checkpoint = self._load_checkpoint(work_dir, run_codec, unique)
 
-        # Initialize the memory will be used to load the numbers by using
-        # int_loader as a generator that will be yielding them.
-        itemslist = []
-        in_fobj = open(self._input_file, 'r')
-        int_loader = self._ints_from_fileobj(in_fobj)
+        self._run_codec = run_codec
+        self._tmp_dirs = cycle(tmp_dirs)
+        self._start_stats('external_sort', progress)
+        self._checkpoint = checkpoint
 
-        # Store open file handles of temporary sorted files.
-        sorted_files_gens = []
-        loop = True
-        while loop:
-            try:
-                # Load next number from input file's generator method.
-                num = int_loader.next()
-                itemslist.append(num)
-            except StopIteration:
-                in_fobj.close()
-                loop = False
-
-            # If the memory list contains numbers just before exiting the loop
-            # or the memory list capacity reached our given limit,
-            # then create a sorted temporary file and store in a list a
-            # generator for retrieving the values later.
-            if (len(itemslist) == itemslimit) or (loop is False and itemslist):
+        # Store paths of temporary sorted files.
+        sorted_files = []
+        try:
+            if checkpoint is not None:
+                sorted_files = self._resume_checkpoint()
+            if checkpoint is None or checkpoint.runs_complete is False:
+                itemslimit = self._create_runs(sorted_files, itemslimit,
+                                               sort_method, workers,
+                                               memory_bytes,
+                                               replacement_selection)
+            elif memory_bytes is not None:
+                with self._open_input() as int_loader:
+                    itemslimit = self._memory_itemslimit(
+                        list(islice(int_loader, MEMORY_SAMPLE_ITEMS)),
+                        memory_bytes)
+
+            # If one or more temporary sorted files are being stored then
+            # merge them into result file.
+            if sorted_files:
+                self._merge_sorted_files(sorted_files, itemslimit, unique,
+                                         max_open_files)
+            elif checkpoint is not None:
+                checkpoint.clear()
+        finally:
+            # The files of the checkpoint, if any, are kept for resuming.
+            kept = set(checkpoint.run_paths() if checkpoint else ())
+            for path in self._run_sizes.keys():
+                if path in kept:
+                    self._disk_usage -= self._run_sizes.pop(path)
+                else:
+                    self._remove_run(path)
+            self._checkpoint = None
+        self._finish_stats()
+
+    def _create_runs(self, sorted_files, itemslimit, sort_method, workers,
+                     memory_bytes, replacement_selection):
+        """
+        Description:
+            Create the temporary sorted files of the external sort from the
+            input, after the input items of the checkpoint if any.
+
+        Input:
+            sorted_files: <list> to be extended with the paths of the
+                          sorted files.
+            The rest of the arguments as in external_sort.
+
+        Returns:
+            <integer> limit of items loaded to memory, as measured in case
+                      of memory_bytes.
+        """
+        with self._open_input() as int_loader:
+            if self._checkpoint is not None:
+                with self._timed('read'):
+                    skipped = self._checkpoint.input_items
+                    next(islice(int_loader, skipped, skipped), None)
+            run_items = itemslimit
+            if memory_bytes is not None:
+                sample = list(islice(int_loader, MEMORY_SAMPLE_ITEMS))
+                int_loader = chain(sample, int_loader)
+                itemslimit = self._memory_itemslimit(sample, memory_bytes)
+                run_items = max(1, itemslimit/((workers or 0)+1))
+            if replacement_selection:
+                self._create_sorted_files_replacement(int_loader, run_items,
+                                                      sorted_files)
+            elif workers is None:
+                self._create_sorted_files(int_loader, run_items,
+                                          sort_method, sorted_files)
+            else:
+                self._create_sorted_files_parallel(int_loader, run_items,
+                                                   sort_method, workers,
+                                                   sorted_files)
+        if self._checkpoint is not None:
+            self._checkpoint.complete_runs(sorted_files,
+                                           self._stats['items'])
+        return itemslimit
+
+    def _memory_itemslimit(self, sample, memory_bytes):
+        """
+        Description:
+            Limit of items loaded to memory for a limit of memory in bytes,
+            by the memory cost of a sample of the input items.
+
+        Input:
+            sample: <list> of input integers or records.
+            memory_bytes: <integer> limit of memory in bytes.
+
+        Returns:
+            <integer> number of items
+        """
+        return max(1, int(memory_bytes / self._item_memory_cost(sample)))
+
+    def _load_checkpoint(self, work_dir, run_codec, unique):
+        """
+        Description:
+            Load the checkpoint of the external sort in the work directory,
+            if any, and remove the temporary sorted files that it does not
+            contain, as the partial ones of an interrupted sort.
+
+        Input:
+            work_dir: <string> path of the work directory.
+            run_codec: <RunCodec> encoding of the sorted files.
+            unique: <boolean> duplicates are removed while merging.
+
+        Returns:
+            <Checkpoint> object
+
+        Raises:
+            SortingError: if the input is not a file or on an invalid
+                          checkpoint.
+        """
+        if self._input_file is None:
+            raise SortingError('Checkpointed sorting needs an input file')
+        record_format = self._record_format
+        input_stat = os.stat(self._input_file)
+        settings = {'input_file': os.path.abspath(self._input_file),
+                    'input_size': input_stat.st_size,
+                    'input_mtime': input_stat.st_mtime,
+                    'compression': run_codec.compression,
+                    'compress_level': run_codec.level,
+                    'delta_encoding': run_codec.delta,
+                    'unique': unique,
+                    'keys': record_format and record_format.keys,
+                    'delimiter': record_format and record_format.delimiter}
+        try:
+            checkpoint = Checkpoint(work_dir, settings)
+            checkpoint.load()
+        except CheckpointError as exc:
+            raise SortingError(str(exc))
+        kept = set(checkpoint.run_paths())
+        for name in os.listdir(work_dir):
+            path = os.path.join(work_dir, name)
+            if name.endswith(RUN_SUFFIX) and path not in kept:
+                os.unlink(path)
+        return checkpoint
+
+    def _resume_checkpoint(self):
+        """
+        Description:
+            Account the temporary sorted files and the progress of the
+            checkpoint in the stats, as if they were done by this sort.
+
+        Returns:
+            <list> of the paths of the sorted files of the checkpoint.
+        """
+        checkpoint = self._checkpoint
+        sorted_files = checkpoint.run_paths()
+        for path in sorted_files:
+            size = os.path.getsize(path)
+            self._run_sizes[path] = size
+            self._disk_usage += size
+        self._peak_disk_usage = self._disk_usage
+        self._stats['items'] = checkpoint.input_items
+        self._stats['runs'] = checkpoint.input_runs
+        self._stats['merge_passes'] = checkpoint.merge_passes
+        return sorted_files
+
+    @staticmethod
+    def _item_memory_cost(sample):
+        """
+        Description:
+            Measure the average memory cost in bytes of an integer, or of
+            a record, loaded to a list, including the list's reference to it.
+
+        Input:
+            sample: <list> of integers or records.
+
+        Returns:
+            <float> bytes
+        """
+        def deep_sizeof(item):
+            """Size of an item, including the items of a tuple."""
+            if isinstance(item, tuple):
+                return sys.getsizeof(item) + sum(imap(deep_sizeof, item))
+            return sys.getsizeof(item)
+
+        if not sample:
+            return float(sys.getsizeof([0]) - sys.getsizeof([]) +
+                         sys.getsizeof(0))
+        return (sys.getsizeof(sample) - sys.getsizeof([]) +
+                sum(imap(deep_sizeof, sample))) / float(len(sample))
+
+    def _start_stats(self, method, progress=None):
+        """
+        Description:
+            Reset the stats for a new sort.
+
+        Input:
+            method: <string> name of the sorting method.
+            [progress]: <function> to be called with the stats.
+        """
+        self._stats = {'method': method, 'items': 0, 'runs': 0,
+                       'merge_passes': 0, 'seconds': None,
+                       'phases': dict.fromkeys(STATS_PHASES, 0.0)}
+        self._stats_start = time.time()
+        self._start_memory = self._measure_peak_memory()\
+            if method is not None else None
+        self._progress = progress
+        self._disk_usage = 0
+        self._peak_disk_usage = 0
+        self._bytes_spilled = 0
+
+    def _finish_stats(self):
+        """
+        Description:
+            Complete the stats at the end of a sort and report them.
+        """
+        self._stats['seconds'] = time.time() - self._stats_start
+        self._peak_memory = self._measure_peak_memory()
+        if self._peak_memory is not None:
+            self._peak_memory_increase = self._peak_memory - \
+                self._start_memory
+        self._report_progress()
+
+    @contextmanager
+    def _timed(self, phase):
+        """
+        Description:
+            Context manager for adding the time spent in it to a phase of
+            the stats.
+
+        Input:
+            phase: <string> one of STATS_PHASES.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._stats['phases'][phase] += time.time() - start
+
+    def _report_progress(self):
+        """
+        Description:
+            Call the progress function, if any, with the current stats.
+        """
+        if self._progress is not None:
+            self._progress(self.get_stats())
+
+    @staticmethod
+    def _measure_peak_memory():
+        """
+        Description:
+            Measure the peak resident memory used by the current process or
+            any of the worker processes, since the process started. It is
+            the high-water mark of the process lifetime, so that it only
+            grows by a sort that uses more memory than anything before it.
+
+        Returns:
+            <int> bytes
+            <None> if it can not be measured in the current platform.
+        """
+        if resource is None:  # pragma: no cover
+            return None
+
+        # Linux reports kilobytes while OS X reports bytes.
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return scale*max(resource.getrusage(who).ru_maxrss
+                         for who in (resource.RUSAGE_SELF,
+                                     resource.RUSAGE_CHILDREN))
+
+    def _create_sorted_files(self, int_loader, itemslimit, sort_method,
+                             sorted_files):
+        """
+        Description:
+            Load chunks of up to itemslimit numbers, sort them in memory
+            and spill each one of them to a temporary file.
+
+        Input:
+            int_loader: <iterator> yielding the input numbers.
+            itemslimit: <integer> limit of items loaded to memory.
+            sort_method: <function> in place sorting function.
+            sorted_files: <list> to be extended with the paths of the
+                          sorted files.
+        """
+        while True:
+            with self._timed('read'):
+                itemslist = list(islice(int_loader, itemslimit))
+            if not itemslist:
+                break
+            self._stats['items'] += len(itemslist)
+            with self._timed('sort'):
                 sort_method(itemslist)
-                fobj = tempfile.TemporaryFile()
-                self._ints_to_fileobj(fobj, iter(itemslist))
+            with self._timed('spill'):
+                sorted_files.append(self._spill_run(iter(itemslist)))
+                self._checkpoint_run(sorted_files[-1], len(itemslist))
+            del itemslist
+            self._stats['runs'] += 1
+            self._report_progress()
 
-                # Store open file handler pointing the start of sorted file.
-                fobj.seek(0)
-                sorted_files_gens.append(self._ints_from_fileobj(fobj))
-                del itemslist[:]
+    def _create_sorted_files_replacement(self, int_loader, itemslimit,
+                                         sorted_files):
+        """
+        Description:
+            Create the temporary sorted files by replacement selection. A
+            heap of up to itemslimit numbers is kept in memory and its
+            smallest number is written to the current sorted file, being
+            replaced by the next input number. Input numbers smaller than
+            the last one written are kept aside for the next sorted file.
+            As reading, sorting and spilling are interleaved, their time is
+            accounted as spilling time.
+            The sorted files do not contain a known part of the input, so
+            they are checkpointed only after all of them are created.
+
+        Input:
+            int_loader: <iterator> yielding the input numbers.
+            itemslimit: <integer> limit of items loaded to memory.
+            sorted_files: <list> to be extended with the paths of the
+                          sorted files.
+        """
+        heap = list(islice(int_loader, itemslimit))
+        self._stats['items'] += len(heap)
+        heapq.heapify(heap)
+        while heap:
+            next_heap = []
+            with self._timed('spill'):
+                sorted_files.append(self._spill_run(
+                    self._replacement_run(heap, next_heap, int_loader)))
+            heap = next_heap
+            heapq.heapify(heap)
+            self._stats['runs'] += 1
+            self._report_progress()
+
+    def _replacement_run(self, heap, next_heap, int_loader):
+        """
+        Description:
+            Generator method for yielding the numbers of a sorted file that
+            is created by replacement selection, until the heap is empty.
+            The numbers read are counted in the stats.
+
+        Input:
+            heap: <list> heap of the numbers of the current sorted file.
+            next_heap: <list> to be extended with the numbers of the next
+                       sorted file.
+            int_loader: <iterator> yielding the input numbers.
+        """
+        read = 0
+        for read, num in enumerate(int_loader, 1):
+            smallest = heap[0]
+            yield smallest
+            if num >= smallest:
+                heapq.heapreplace(heap, num)
+            else:
+                heapq.heappop(heap)
+                next_heap.append(num)
+                if not heap:
+                    break
+
+        # Input is exhausted, so the rest of the heap is in order.
+        while heap:
+            yield heapq.heappop(heap)
+        self._stats['items'] += read
+
+    def _create_sorted_files_parallel(self, int_loader, itemslimit,
+                                      sort_method, workers,
+                                      sorted_files):
+        """
+        Description:
+            Same as _create_sorted_files but the sorting and spilling of
+            each chunk is done by a pool of worker processes, while the
+            current process continues reading the input. At most workers
+            chunks are pending at any time, to bound the memory in use.
+            The time waiting for the worker processes is accounted as
+            spilling time.
+
+        Input:
+            int_loader: <iterator> yielding the input numbers.
+            itemslimit: <integer> limit of items loaded to memory.
+            sort_method: <function> picklable in place sorting function.
+            workers: <integer> number of worker processes.
+            sorted_files: <list> to be extended with the paths of the
+                          sorted files.
+        """
+        pool = multiprocessing.Pool(workers)
+        pending = deque()
+        try:
+            while True:
+                with self._timed('read'):
+                    itemslist = list(islice(int_loader, itemslimit))
+                if itemslist:
+                    self._stats['items'] += len(itemslist)
+                    pending.append((len(itemslist), pool.apply_async(
+                        _sort_and_spill,
+                        (itemslist, sort_method, self._run_codec,
+                         next(self._tmp_dirs)))))
+                elif not pending:
+                    break
+
+                # Collect the oldest result when all workers are busy or
+                # when there is no more input to be read. Results are
+                # collected in the input order, so the checkpoint contains
+                # a part of the input.
+                if len(pending) >= workers or not itemslist:
+                    items, result = pending.popleft()
+                    with self._timed('spill'):
+                        path, size = result.get()
+                        self._track_run(path, size)
+                        self._checkpoint_run(path, items)
+                    sorted_files.append(path)
+                    self._stats['runs'] += 1
+                    self._report_progress()
+        finally:
+            # Let the pending chunks finish in order to remove their files
+            # in case of an error.
+            pool.close()
+            pool.join()
+            for _, result in pending:
+                if result.successful():
+                    os.unlink(result.get()[0])
+
+    def _spill_run(self, items, block_items=RUN_BLOCK_ITEMS):
+        """
+        Description:
+            Write sorted items to a new intermediate temporary sorted file,
+            in the next one of the temporary directories.
+
+        Input:
+            items: <iterator> yielding the sorted items.
+            [block_items]: <integer> maximum number of items in a block.
+
+        Returns:
+            <string> path of the sorted file.
+        """
+        fdesc, path = tempfile.mkstemp(suffix=RUN_SUFFIX,
+                                       dir=next(self._tmp_dirs))
+        self._track_run(path, 0)
+        with os.fdopen(fdesc, 'wb') as fobj:
+            self._track_run(path, items_to_run(fobj, items, block_items,
+                                               self._run_codec))
+        return path
+
+    def _track_run(self, path, size):
+        """
+        Description:
+            Account the bytes written to a temporary sorted file, which is
+            removed at the end of the external sort if it still exists.
+
+        Input:
+            path: <string> path of the temporary sorted file.
+            size: <integer> number of bytes written.
+        """
+        self._run_sizes[path] = self._run_sizes.get(path, 0) + size
+        self._bytes_spilled += size
+        self._disk_usage += size
+        self._peak_disk_usage = max(self._peak_disk_usage, self._disk_usage)
+
+    def _remove_run(self, path):
+        """
+        Description:
+            Remove a temporary sorted file.
+
+        Input:
+            path: <string> path of the temporary sorted file.
+        """
+        self._disk_usage -= self._run_sizes.pop(path)
+        os.unlink(path)
+
+    def _checkpoint_run(self, path, items):
+        """
+        Description:
+            Record a temporary sorted file created from the input in the
+            checkpoint, if the sort is checkpointed.
+
+        Input:
+            path: <string> path of the temporary sorted file.
+            items: <integer> number of input items stored in it.
+        """
+        if self._checkpoint is not None:
+            self._checkpoint.add_run(path, items)
+
+    @contextmanager
+    def _open_runs(self, sorted_files):
+        """
+        Description:
+            Context manager for reading temporary sorted files, which are
+            closed and removed at exit. Checkpointed files are kept, as
+            they are removed only after the merge pass is checkpointed.
+
+        Input:
+            sorted_files: <list> that contains paths to sorted files
+
+        Returns:
+            <list> of file objects pointing the start of the sorted files.
+        """
+        fobjs = []
+        try:
+            for path in sorted_files:
+                fobjs.append(open(path, 'rb'))
+            yield fobjs
+        finally:
+            for fobj in fobjs:
+                fobj.close()
+            if self._checkpoint is None:
+                for path in sorted_files:
+                    self._remove_run(path)
+
+    @staticmethod
+    def _merge_fan_in(itemslimit, max_open_files=MAX_OPEN_FILES):
+        """
+        Description:
+            Maximum number of sorted files merged at once. Each one of them
+            needs a block of at least MIN_MERGE_BLOCK_ITEMS numbers loaded
+            to memory, but at least two files are merged at once. Another
+            file is open for writing the merged numbers of intermediate
+            merge passes.
+
+        Input:
+            itemslimit: <integer> - max number of items loaded to memory.
+            [max_open_files]: <integer> max number of sorted files open.
 
-                # In case that memory limit is too low to handle the merge
-                # of the temporary files.
-                if len(sorted_files_gens) > itemslimit/2:
-                    raise SortingError('Merge %d temp files with limit %d' %
-                                       (len(sorted_files_gens), itemslimit))
-        if len(itemslist):
-            raise SortingError('Not all numbers saved in tmp files')
+        Returns:
+            <integer> number of sorted files.
+        """
+        return max(2, min(itemslimit/MIN_MERGE_BLOCK_ITEMS,
+                          max_open_files-1))
+
+    def _merge_sorted_files(self, sorted_files, itemslimit, unique=False,
+                            max_open_files=MAX_OPEN_FILES):
+        """
+        Description:
+            Merge the intermediate temporary sorted files into the output
+            file. The process that is being followed is:
+              1. While there are more sorted files than the merge fan-in,
+                 merge groups of them into new intermediate sorted files.
+              2. Read each sorted file in blocks, of an equal part of the
+                 numbers that can be loaded into memory.
+              3. Apply a k-way merge of the sorted files by using a heap
+                 that contains the next number of each one of them.
+              4. Write the merged numbers in batches to the output file.
+            The time of the last merge pass is accounted as writing time.
+            In a checkpointed sort, the input files of each merge pass are
+            removed after the pass is checkpointed.
+
+        Input:
+            sorted_files: <list> that contains paths to sorted files
+            itemslimit: <integer> - max number of items loaded to memory.
+            [unique]: <boolean> remove duplicate numbers while merging.
+            [max_open_files]: <integer> max number of sorted files open.
+        """
+        fan_in = self._merge_fan_in(itemslimit, max_open_files)
+        while len(sorted_files) > fan_in:
+            with self._timed('merge'):
+                # A single file left over by the grouping is passed on to
+                # the next pass unchanged.
+                merged_files = [self._merge_to_run(sorted_files[i:i+fan_in],
+                                                   itemslimit, unique)
+                                if len(sorted_files) - i > 1
+                                else sorted_files[i]
+                                for i in xrange(0, len(sorted_files), fan_in)]
+                self._checkpoint_pass(sorted_files, merged_files)
+            sorted_files = merged_files
+            self._stats['merge_passes'] += 1
+            self._report_progress()
 
-        # If one or more temporary sorted file generators are being stored
-        # then merge them into result file.
-        if sorted_files_gens:
-            self._merge_sorted_files(itemslist, sorted_files_gens, itemslimit)
+        with self._timed('write'):
+            with self._open_output() as fobj:
+                with self._open_runs(sorted_files) as run_fobjs:
+                    self._write_items(fobj, self._merge_iter(run_fobjs,
+                                                             itemslimit,
+                                                             unique))
+            self._checkpoint_pass(sorted_files, [])
+        self._stats['merge_passes'] += 1
 
-    def _merge_sorted_files(self, itemslist, sorted_files_gens, itemslimit):
+    def _checkpoint_pass(self, sorted_files, merged_files):
         """
         Description:
-            Merge a list that contains generators that will be yielding values
-            from the intermediate temporary sorted files. The process that is
-            being followed is:
-              1. Load into memory equal parts of numbers from the generators.
-              2. Dump a part of that size with the smallest numbers to the
-                 output file.
-              3. Load into memory numbers from the generators that was
-                 originally contained the numbers dumped in step 2.
+            Record a merge pass in the checkpoint, if the sort is
+            checkpointed, and remove its input files that are merged. The
+            checkpoint is removed after the last pass, which writes to the
+            output.
 
         Input:
-            itemslist: <list> with limitted number of items to simultaneously
-                               contain.
-            sorted_files_gens: <list> that contains generators to sorted files
-            itemslimit: <integer> - max number of items stored in itemslist.
+            sorted_files: <list> of paths of the input files of the pass.
+            merged_files: <list> of paths of the files created by the pass,
+                          empty for the last one.
+        """
+        if self._checkpoint is None:
+            return
+        if merged_files:
+            self._checkpoint.complete_pass(merged_files)
+        else:
+            self._checkpoint.clear()
+        for path in sorted_files:
+            if path not in merged_files:
+                self._remove_run(path)
+
+    def _merge_to_run(self, sorted_files, itemslimit, unique=False):
         """
+        Description:
+            Merge sorted files into a new intermediate temporary sorted file
+            and remove them.
 
-        # Set the number of ints to be stored in items list from each sorted
+        Input:
+            sorted_files: <list> that contains paths to sorted files
+            itemslimit: <integer> - max number of items loaded to memory.
+            [unique]: <boolean> remove duplicate numbers while merging.
+
+        Returns:
+            <string> path of the new sorted file.
+        """
+        # The block of the merged numbers that is written at once takes
+        # an equal part of the memory with the blocks of the sorted files.
+        with self._open_runs(sorted_files) as run_fobjs:
+            return self._spill_run(self._merge_iter(run_fobjs, itemslimit,
+                                                    unique),
+                                   max(1, itemslimit/(len(sorted_files)+1)))
+
+    def _merge_iter(self, sorted_files, itemslimit, unique=False):
+        """
+        Description:
+            Get an iterator applying a k-way merge of sorted files, by
+            using a heap that contains the next number of each one of them.
+
+        Input:
+            sorted_files: <list> that contains file objects to sorted files
+            itemslimit: <integer> - max number of items loaded to memory.
+            [unique]: <boolean> remove duplicate numbers while merging.
+
+        Returns:
+            <iterator> yielding the merged numbers.
+        """
+        # Set the number of ints to be read at once from each sorted
         # temporary source file.
-        ints_per_chunk = itemslimit/len(sorted_files_gens)
-        for int_gen in sorted_files_gens:
-            for _ in xrange(ints_per_chunk):
-                try:
-                    num = int_gen.next()
-                    itemslist.append((num, int_gen))
-                except StopIteration:
-                    continue
-
-        # Start writing into the output file as the smaller numbers are found
-        # by using a heap that contains tuple objects for storing the source
-        # generator object that is linked to it's generated value.
-        self._output_file = '%s.sorted' % (self._input_file)
-        with open(self._output_file, 'w') as fobj:
-            while len(itemslist):
-                heapq.heapify(itemslist)
-                for _ in xrange(min(len(itemslist), ints_per_chunk)):
-                    num, int_gen = heapq.heappop(itemslist)
-                    fobj.write('%d\n' % (num))
-                    try:
-                        num = int_gen.next()
-                        itemslist.append((num, int_gen))
-                    except StopIteration:
-                        pass
+        ints_per_chunk = max(1, itemslimit/(len(sorted_files)+1))
+        merged = heapq.merge(*[items_from_run(fobj, ints_per_chunk,
+                                              self._run_codec)
+                               for fobj in sorted_files])
+        if unique:
+            return self._unique_iter(merged)
+        return merged
+
+    @staticmethod
+    def _chunks_from_mmap(path, chunk_bytes=LOAD_CHUNK_BYTES):
+        """
+        Description:
+            Generator method for yielding chunks of whole lines of a file by
+            memory mapping it.
+
+        Input:
+            path: <string> path of a file containing numbers(one in a row)
+            [chunk_bytes]: <int> minimum number of bytes of a chunk.
+
+        Raises:
+            ValueError: if the file can not be memory mapped, as empty or
+                        not regular files.
+        """
+        with open(path, 'rb') as fobj:
+            try:
+                mapped = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+            except EnvironmentError as exc:
+                raise ValueError(str(exc))
+        try:
+            start = 0
+            size = mapped.size()
+            while start < size:
+                # Extend each chunk up to the end of its last line.
+                end = mapped.find('\n', min(start+chunk_bytes, size)-1)
+                end = size if end == -1 else end+1
+                yield mapped[start:end]
+                start = end
+        finally:
+            mapped.close()
+
+    @staticmethod
+    def _chunk_lines(chunk):
+        """
+        Description:
+            Split a chunk of whole lines to its lines, so that blank lines
+            or lines of many numbers are parsed, and fail, as lines.
+
+        Input:
+            chunk: <string> yielded by _chunks_from_mmap.
+
+        Returns:
+            <list> of the lines, without their new line characters.
+        """
+        lines = chunk.split('\n')
+        if lines[-1] == '':
+            lines.pop()
+        return lines
+
+    @staticmethod
+    def _ints_from_mmap(path, chunk_bytes=LOAD_CHUNK_BYTES):
+        """
+        Description:
+            Method for loading the integers of a file by memory mapping it
+            and parsing whole chunks of it at once, instead of line by line.
+
+        Input:
+            path: <string> path of a file containing numbers(one in a row)
+            [chunk_bytes]: <int> number of bytes parsed at once.
+
+        Returns:
+            <list> of the integers.
+            <None> if the file can not be memory mapped or parsed, so that
+                   it has to be loaded line by line.
+        """
+        itemslist = []
+        try:
+            for chunk in FileSorter._chunks_from_mmap(path, chunk_bytes):
+                itemslist.extend(map(int, FileSorter._chunk_lines(chunk)))
+        except ValueError:
+            return None
+        return itemslist
+
+    @staticmethod
+    def _ndarray_from_mmap(path, chunk_bytes=LOAD_CHUNK_BYTES):
+        """
+        Description:
+            Method for loading the integers of a file into a numpy int64
+            array, by parsing whole chunks of the memory mapped file.
+
+        Input:
+            path: <string> path of a file containing numbers(one in a row)
+            [chunk_bytes]: <int> number of bytes parsed at once.
+
+        Returns:
+            <numpy.ndarray> of the integers.
+
+        Raises:
+            SortingError: if the file contains numbers that are not 64-bit
+                          integers.
+        """
+        if os.path.getsize(path) == 0:
+            return numpy.zeros(0, dtype=numpy.int64)
+        try:
+            return numpy.concatenate([
+                numpy.array(FileSorter._chunk_lines(chunk),
+                            dtype=numpy.int64)
+                for chunk in FileSorter._chunks_from_mmap(path, chunk_bytes)])
+        except (ValueError, OverflowError) as exc:
+            raise SortingError('Not 64-bit integers input: %s' % (exc))
 
     @staticmethod
     def _ints_from_fileobj(fobj):
@@ -199,18 +1381,176 @@ class FileSorter(object):
         for line in fobj:
             yield int(line.strip('\n'))
 
+    def _write_items(self, fobj, items):
+        """
+        Description:
+            Method for writing the sorted integers, or the lines of the
+            sorted records in case of a record format, to a file.
+
+        Input:
+            fobj: <file object> by a file opened with write permissions.
+            items: <iterator> to be used for retrieving the desired items.
+        """
+        if self._record_format is not None:
+            self._records_to_fileobj(fobj, items)
+        else:
+            self._ints_to_fileobj(fobj, items)
+
     @staticmethod
-    def _ints_to_fileobj(fobj, items):
+    def _records_to_fileobj(fobj, records, batch=WRITE_BATCH_ITEMS):
+        """
+        Description:
+            Method for writing the lines of records to a file, in batches.
+
+        Input:
+            fobj: <file object> by a file opened with write permissions.
+            records: <iterator> of records, having their line last.
+            [batch]: <int> maximum number of records written at once.
+        """
+        while True:
+            chunk = list(islice(records, batch))
+            if not chunk:
+                break
+            fobj.write('\n'.join([record[-1] for record in chunk]))
+            fobj.write('\n')
+
+    @staticmethod
+    def _ints_to_fileobj(fobj, items, batch=WRITE_BATCH_ITEMS):
         """
         Description:
             Method for writing integers to a file by using it's file object.
+            Integers are formatted and written in batches.
 
         Input:
             fobj: <file object> by a file opened with write permissions.
             items: <iterator> to be used for retrieving the desired ints.
+            [batch]: <int> maximum number of integers written at once.
         """
-        for item in items:
-            fobj.write('%d\n' % (item,))
+        while True:
+            chunk = tuple(islice(items, batch))
+            if not chunk:
+                break
+            fobj.write('%d\n' * len(chunk) % chunk)
+
+    @staticmethod
+    def _ndarray_to_fileobj(fobj, items, batch=NDARRAY_WRITE_BATCH_ITEMS):
+        """
+        Description:
+            Method for writing the integers of a numpy array to a file, by
+            formatting whole slices of the array at once.
+
+        Input:
+            fobj: <file object> by a file opened with write permissions.
+            items: <numpy.ndarray> of integers.
+            [batch]: <int> maximum number of integers written at once.
+        """
+        for start in xrange(0, len(items), batch):
+            chunk = tuple(items[start:start+batch].tolist())
+            fobj.write('%d\n' * len(chunk) % chunk)
+
+    def get_peak_memory(self):
+        """
+        Description:
+            Method for retrieving the peak resident memory in bytes of the
+            process, or any of the worker processes, measured when the last
+            sort or external sort was done. It is the high-water mark of the
+            whole process lifetime, including the memory of the interpreter
+            itself and of anything done before the sort, as reported by
+            getrusage. How much the sort raised it is reported by
+            get_peak_memory_increase.
+
+        Returns:
+            peak_memory: <int> bytes
+                         <None> if no sort is done.
+        """
+        return self._peak_memory
+
+    def get_peak_memory_increase(self):
+        """
+        Description:
+            Method for retrieving the bytes that the last sort or external
+            sort raised the peak resident memory of the process by, over
+            the peak measured when it started. It is 0 if the sort used no
+            more memory than the process did earlier, so that it is a lower
+            bound of the memory used by the sort.
+
+        Returns:
+            peak_memory_increase: <int> bytes
+                                  <None> if no sort is done.
+        """
+        return self._peak_memory_increase
+
+    def get_stats(self):
+        """
+        Description:
+            Method for retrieving the stats of the last sort or external
+            sort, or of the current one while it is done. Phases that are
+            interleaved are accounted as the one driving them, as described
+            by the sorting methods.
+
+        Returns:
+            stats: <dict> containing:
+                     method: <string> sort or external_sort
+                     items: <int> number of input items read
+                     runs: <int> number of temporary sorted files created
+                           from the input
+                     merge_passes: <int> number of merge passes, including
+                                   the last one writing to the output
+                     bytes_spilled: <int> bytes of the temporary files
+                     peak_disk_usage: <int> bytes of the temporary files
+                                      that existed at once
+                     peak_memory: <int> bytes of the process lifetime
+                                  peak, <None> until it is done or if it
+                                  can not be measured
+                     peak_memory_increase: <int> bytes that the sort
+                                           raised the peak by, <None> as
+                                           the peak_memory
+                     seconds: <float> wall clock time, until now if it is
+                              not done
+                     items_per_second: <float> items read by second
+                     phases: <dict> of wall clock seconds of the read,
+                             sort, spill, merge and write phases
+                   <None> if no sort is done.
+        """
+        if self._stats['method'] is None:
+            return None
+        stats = dict(self._stats)
+        stats['phases'] = dict(stats['phases'])
+        if stats['seconds'] is None:
+            stats['seconds'] = time.time() - self._stats_start
+            stats['peak_memory'] = None
+            stats['peak_memory_increase'] = None
+        else:
+            stats['peak_memory'] = self._peak_memory
+            stats['peak_memory_increase'] = self._peak_memory_increase
+        stats['bytes_spilled'] = self._bytes_spilled
+        stats['peak_disk_usage'] = self._peak_disk_usage
+        stats['items_per_second'] = stats['items'] / stats['seconds']\
+            if stats['seconds'] > 0 else None
+        return stats
+
+    def get_bytes_spilled(self):
+        """
+        Description:
+            Method for retrieving the bytes written to the temporary sorted
+            files by the last external sort, in every merge pass.
+
+        Returns:
+            bytes_spilled: <int> bytes
+        """
+        return self._bytes_spilled
+
+    def get_peak_disk_usage(self):
+        """
+        Description:
+            Method for retrieving the maximum bytes of the temporary sorted
+            files that existed at once while the last external sort was
+            done.
+
+        Returns:
+            peak_disk_usage: <int> bytes
+        """
+        return self._peak_disk_usage
 
     def get_output_filename(self):
         """
@@ -219,52 +1559,140 @@ class FileSorter(object):
             created.
 
         Returns:
-            output_file: <string> representing the path
-                         <None> if output file is not created.
+            output_file: <string> representing the path, or the name of
+                                  the output stream.
+                         <None> if output file is not created or the output
+                                stream has no name.
         """
         return self._output_file
 
 
+def _sort_and_spill(itemslist, sort_method, run_codec, tmp_dir):
+    """
+    Description:
+        Sort a chunk of numbers and spill it to a named temporary file.
+        Runs in the worker processes of FileSorter.external_sort, so it is
+        defined at module level to be picklable.
+
+    Input:
+        itemslist: <list> of integer numbers.
+        sort_method: <function> in place sorting function.
+        run_codec: <RunCodec> encoding of the sorted file.
+        tmp_dir: <string> directory of the sorted file, or None for the
+                 default temporary directory.
+
+    Returns:
+        <tuple> of the path of the temporary sorted file and its size.
+    """
+    sort_method(itemslist)
+    fdesc, path = tempfile.mkstemp(suffix=RUN_SUFFIX, dir=tmp_dir)
+    with os.fdopen(fdesc, 'wb') as fobj:
+        size = items_to_run(fobj, iter(itemslist), codec=run_codec)
+    return path, size
+
+
 if __name__ == '__main__':  # pragma: no cover
     # Description:
     #    Script to read command line arguments and based on that sorts
     #    the contents of a given input file that contains integers.
+    SORT_METHODS = {'mergesort': merge_sort,
+                    'quicksort': quicksort,
+                    'radix': radix_sort,
+                    'counting': counting_sort,
+                    'integer': integer_sort}
+    SORT_TYPES = ('default', 'auto') + tuple(sorted(SORT_METHODS)) +\
+        ('external',) + tuple('numpy-%s' % kind for kind in NUMPY_SORT_KINDS)
 
-    class InputArgsError(Exception):
-        """Exception to be raised in case of wrong input arguments usage"""
+    PARSER = argparse.ArgumentParser(add_help=False)
+    PARSER.add_argument('-h', '-help', '--help', action='help',
+                        help='show this help message and exit')
+    PARSER.add_argument('input_file', help='input file or - for stdin')
+    PARSER.add_argument('sort_type', nargs='?', default='default',
+                        choices=SORT_TYPES, metavar='sort_type',
+                        help='one of: %s' % ', '.join(SORT_TYPES))
+    PARSER.add_argument('output', nargs='?',
+                        help='output file or - for stdout')
+    PARSER.add_argument('--unique', action='store_true',
+                        help='write each distinct number once')
+    PARSER.add_argument('--top-k', type=int, metavar='K',
+                        help='write only the K smallest numbers')
+    PARSER.add_argument('--merge', nargs='+', default=[], metavar='FILE',
+                        help='merge already sorted input and files')
+    PARSER.add_argument('--key', metavar='COLUMN:TYPE[,...]',
+                        help='sort delimited records by the key columns, '
+                             'with zero based index and int, float or str '
+                             'type, e.g. 2:int,0:str')
+    PARSER.add_argument('--delimiter', default=',',
+                        help='delimiter of the records columns, '
+                             'backslash escapes allowed (default: ,)')
+    PARSER.add_argument('--compress', choices=sorted(COMPRESSIONS),
+                        help='compress the temporary files of the '
+                             'external sort')
+    PARSER.add_argument('--compress-level', type=int, metavar='LEVEL',
+                        help='level of the compression (default: fastest)')
+    PARSER.add_argument('--delta', action='store_true',
+                        help='delta encode the temporary files of the '
+                             'external sort')
+    PARSER.add_argument('--tmp-dir', action='append', metavar='DIR',
+                        help='directory of the temporary files of the '
+                             'external sort, repeated to use them in turn')
+    PARSER.add_argument('--max-open-files', type=int, default=MAX_OPEN_FILES,
+                        metavar='N',
+                        help='maximum number of temporary files open at '
+                             'once (default: %d)' % (MAX_OPEN_FILES))
+    PARSER.add_argument('--work-dir', metavar='DIR',
+                        help='checkpoint the external sort in the '
+                             'directory, to resume it if it is interrupted')
+    PARSER.add_argument('--stats', action='store_true',
+                        help='print the sorting stats as JSON to stderr')
+    ARGS = PARSER.parse_args()
 
     EXITCODE = 0
     try:
-        SORT_TYPES = ('mergesort', 'quicksort', 'external')
-        SORT_TYPE = None
-        if ('-help' in sys.argv) or len(sys.argv) not in (2, 3):
-            raise InputArgsError()
-        if len(sys.argv) == 3 and sys.argv[2] not in SORT_TYPES:
-            print "Available sort types:\n\t%s" % '\n\t'.join(SORT_TYPES)
-            raise InputArgsError(sys.argv[2])
-        elif len(sys.argv) == 3:
-            SORT_TYPE = sys.argv[2]
+        RECORD_FORMAT = None
+        if ARGS.key is not None:
+            RECORD_FORMAT = RecordFormat.from_string(
+                ARGS.key, ARGS.delimiter.decode('string_escape'))
 
         # Create an object that will be used to sort the file.
-        FILESORTER = FileSorter(input_file=sys.argv[1])
+        FILESORTER = FileSorter(input_file=ARGS.input_file,
+                                output=ARGS.output,
+                                record_format=RECORD_FORMAT)
 
         # Sort the files based on input arguments.
-        if SORT_TYPE is None:
-            FILESORTER.sort()
-        elif SORT_TYPE == 'mergesort':
-            FILESORTER.sort(sort_method=merge_sort)
-        elif SORT_TYPE == 'quicksort':
-            FILESORTER.sort(sort_method=quicksort)
-        elif SORT_TYPE == 'external':
-            FILESORTER.external_sort(1000)
-
-        # Display the output file.
-        print "Result file: %s" % (FILESORTER.get_output_filename())
-    except (IOError, InitializeError, SortingError) as exc:
-        print "{} - {}".format(exc.__class__.__name__, exc)
-        EXITCODE = 1
-    except InputArgsError:
-        print "USAGE: <executable> <input file> [<sort type>]"
+        if ARGS.top_k is not None:
+            FILESORTER.top_k(ARGS.top_k)
+        elif ARGS.merge:
+            FILESORTER.merge_files(ARGS.merge, unique=ARGS.unique)
+        elif ARGS.sort_type == 'default':
+            FILESORTER.sort(unique=ARGS.unique)
+        elif ARGS.sort_type == 'auto':
+            FILESORTER.auto_sort(unique=ARGS.unique)
+        elif ARGS.sort_type in SORT_METHODS:
+            FILESORTER.sort(sort_method=SORT_METHODS[ARGS.sort_type],
+                            unique=ARGS.unique)
+        elif ARGS.sort_type == 'external':
+            FILESORTER.external_sort(1000, unique=ARGS.unique,
+                                     compression=ARGS.compress,
+                                     compress_level=ARGS.compress_level,
+                                     delta_encoding=ARGS.delta,
+                                     tmp_dir=ARGS.tmp_dir,
+                                     max_open_files=ARGS.max_open_files,
+                                     work_dir=ARGS.work_dir)
+        elif ARGS.sort_type.startswith('numpy-'):
+            FILESORTER.sort(sort_method=partial(numpy_sort,
+                                                kind=ARGS.sort_type[6:]),
+                            unique=ARGS.unique)
+
+        # Display the output file, unless that is the standard output.
+        if FILESORTER.get_output_filename() != sys.stdout.name:
+            print "Result file: %s" % (FILESORTER.get_output_filename())
+        if ARGS.stats and FILESORTER.get_stats() is not None:
+            print >> sys.stderr, json.dumps(FILESORTER.get_stats(),
+                                            sort_keys=True)
+    except (IOError, ImportError, InitializeError, SortingError,
+            RecordFormatError, RunFormatError, CheckpointError) as exc:
+        print >> sys.stderr, "{} - {}".format(exc.__class__.__name__, exc)
         EXITCODE = 1
 
     sys.exit(EXITCODE)
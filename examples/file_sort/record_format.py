@@ -0,0 +1,119 @@
+"""Module containing tools for sorting delimited records by key columns.
+
+Each line of a delimited (as CSV or TSV) file is a record, which is sorted
+by the values of one or more of its columns. To avoid parsing the key
+columns at each comparison, every record is loaded once as a tuple of:
+  1. The key, a tuple of the typed values of the key columns.
+  2. The sequence number of the record in its input, that makes sorting
+     stable and avoids comparing the lines of records with equal keys.
+  3. The original line, without its line separator, to be written.
+Quoted delimiters, as in CSV files with quoted fields, are not supported.
+"""
+
+# Types of the key columns by their names.
+KEY_TYPES = {'int': int, 'float': float, 'str': str}
+
+
+class RecordFormatError(Exception):
+    """Exception to be raised in case of an invalid record or format."""
+    pass
+
+
+class RecordFormat(object):
+    """
+    Description:
+        Object describing the format of delimited records and their keys.
+
+    Input:
+        keys: <list> of (column, type) tuples, with the zero based column
+              index and the name of the type in KEY_TYPES, in the order
+              that records are sorted by.
+        [delimiter]: <string> separating the columns of a record.
+
+    Raises:
+        RecordFormatError: on invalid keys or delimiter.
+    """
+    __slots__ = ['keys', 'delimiter', '_columns', '_maxsplit']
+
+    def __init__(self, keys, delimiter=','):
+        if not keys:
+            raise RecordFormatError('At least one key column is required')
+        if not delimiter:
+            raise RecordFormatError('Invalid delimiter: "%s"' % (delimiter))
+        columns = []
+        for column, type_name in keys:
+            if isinstance(column, int) is False or column < 0:
+                raise RecordFormatError('Invalid key column: "%s"' %
+                                        (column,))
+            if type_name not in KEY_TYPES:
+                raise RecordFormatError('Invalid key type: "%s"' %
+                                        (type_name,))
+            columns.append((column, KEY_TYPES[type_name]))
+        self.keys = tuple(keys)
+        self.delimiter = delimiter
+        self._columns = tuple(columns)
+        self._maxsplit = max(column for column, _ in columns) + 1
+
+    @classmethod
+    def from_string(cls, keys, delimiter=','):
+        """
+        Description:
+            Create a record format by keys in a comma separated string.
+
+        Input:
+            keys: <string> of comma separated <column>:<type> keys,
+                  e.g. "2:int,0:str". Type defaults to str.
+            [delimiter]: <string> separating the columns of a record.
+
+        Returns:
+            <RecordFormat> object
+
+        Raises:
+            RecordFormatError: on invalid keys or delimiter.
+        """
+        parsed = []
+        for key in keys.split(','):
+            column, _, type_name = key.partition(':')
+            try:
+                parsed.append((int(column), type_name or 'str'))
+            except ValueError:
+                raise RecordFormatError('Invalid key: "%s"' % (key))
+        return cls(parsed, delimiter)
+
+    def get_key(self, line):
+        """
+        Description:
+            Compute the key of a record.
+
+        Input:
+            line: <string> record without its line separator.
+
+        Returns:
+            <tuple> of the typed values of the key columns.
+
+        Raises:
+            RecordFormatError: on missing or invalid key columns.
+        """
+        fields = line.split(self.delimiter, self._maxsplit)
+        try:
+            return tuple([key_type(fields[column])
+                          for column, key_type in self._columns])
+        except (IndexError, ValueError) as exc:
+            raise RecordFormatError('Invalid record "%s": %s' % (line, exc))
+
+    def records(self, lines):
+        """
+        Description:
+            Generator method for yielding the records of lines, as tuples
+            of the key, the sequence number and the line.
+
+        Input:
+            lines: <iterable> of strings, with or without line separators.
+
+        Raises:
+            RecordFormatError: on missing or invalid key columns.
+        """
+        get_key = self.get_key
+        for seq, line in enumerate(lines):
+            line = line.rstrip('\r\n')
+            yield (get_key(line), seq, line)
@@ -0,0 +1,448 @@
+"""Module containing tools for writing and reading sorted runs.
+
+Sorted runs are the intermediate temporary files created by the external
+sorting. Instead of one number in a text row, they are stored in blocks
+of packed binary numbers that are written and read in bulk:
+  1. Every block starts with a header containing a type tag, the number
+     of items and the size in bytes of its payload.
+  2. Blocks tagged INT64_TAG contain native 64-bit signed integers.
+  3. Blocks containing numbers that do not fit in 64 bits, or other items
+     than integers (as the records of record sorting), are tagged
+     MARSHAL_TAG and contain the marshalled list of the items. They are
+     read at once, so they hold at most MARSHAL_BLOCK_ITEMS items.
+  4. Optionally, blocks of 64-bit integers are delta encoded, tagged
+     DELTA_TAG and contain the first number followed by the differences
+     of each number from the previous one, with their bytes shuffled:
+     first the lowest byte of every number, then the next one and so on.
+     The differences of sorted numbers are small, so their high bytes
+     are runs of zeros that are compressed much better.
+Optionally, the whole run is compressed as a single stream that is
+decompressed incrementally while reading it (see RunCodec). Compressions
+whose decompressors can not limit their output, as bz2 and lzma, compress
+the run in consecutive streams of up to STREAM_BYTES instead, which are
+decompressed one at a time.
+"""
+
+import bz2
+import zlib
+import struct
+import marshal
+
+from array import array
+from operator import sub
+from functools import partial
+from itertools import chain,\
+                      islice
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+def _int64_typecode():
+    """
+    Description:
+        Find the array typecode of the native 64-bit signed integers.
+
+    Returns:
+        <string> array typecode
+    """
+    for typecode in ('q', 'l'):
+        try:
+            if array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            continue
+    raise ImportError('No 64-bit integer array typecode available')
+
+
+INT64_TYPECODE = _int64_typecode()
+INT64_TAG = 'q'
+DELTA_TAG = 'd'
+MARSHAL_TAG = 'm'
+HEADER = struct.Struct('<cII')
+
+# Default maximum number of items written in a block.
+RUN_BLOCK_ITEMS = 65536
+
+# Maximum number of items of a delta encoded block, which is read at once.
+DELTA_BLOCK_ITEMS = 1024
+
+# Maximum number of items of a marshalled block, which is read at once. It
+# is as small as the smallest blocks of a merge, so that merging runs of
+# them keeps to the limit of items loaded to memory.
+MARSHAL_BLOCK_ITEMS = 64
+
+# Compressed bytes of a run that are decompressed at once while reading it.
+READ_CHUNK_BYTES = 1 << 16
+
+# Uncompressed bytes of each stream of a run compressed by a compression
+# other than zlib, which is the most that is decompressed at once.
+STREAM_BYTES = 1 << 16
+
+# Compressor and decompressor factories by the name of the compression,
+# with the range and the default of the compression level. The default
+# levels are the fastest ones, as runs are written and read only once.
+COMPRESSIONS = {
+    'zlib': (zlib.compressobj, zlib.decompressobj, 0, 9, 1),
+    'bz2': (bz2.BZ2Compressor, bz2.BZ2Decompressor, 1, 9, 1),
+}
+COMPRESSION_ERRORS = (zlib.error, IOError, EOFError)
+if lzma is not None:  # pragma: no cover
+    COMPRESSIONS['lzma'] = (lambda level: lzma.LZMACompressor(preset=level),
+                            lzma.LZMADecompressor, 0, 9, 0)
+    COMPRESSION_ERRORS += (lzma.LZMAError,)
+
+
+class RunFormatError(Exception):
+    """Exception to be raised in case of a corrupted sorted run file."""
+    pass
+
+
+class RunCodec(object):
+    """
+    Description:
+        Object describing the optional encoding of sorted run files. It
+        holds only names and numbers, so that it can be passed to worker
+        processes.
+
+    Input:
+        [compression]: <string> name of the compression in COMPRESSIONS,
+                       or None for uncompressed runs.
+        [level]: <int> compression level, defaults to the fastest one.
+        [delta]: <boolean> delta encode the blocks of 64-bit integers.
+
+    Raises:
+        RunFormatError: on an unknown compression or invalid level.
+    """
+    def __init__(self, compression=None, level=None, delta=False):
+        if compression is None:
+            if level is not None:
+                raise RunFormatError('Compression level without compression')
+        elif compression not in COMPRESSIONS:
+            raise RunFormatError('Unknown compression: "%s"' % (compression))
+        else:
+            _, _, min_level, max_level, default_level = \
+                COMPRESSIONS[compression]
+            if level is None:
+                level = default_level
+            if isinstance(level, int) is False or\
+               not min_level <= level <= max_level:
+                raise RunFormatError('Invalid %s compression level: "%s"' %
+                                     (compression, level))
+        self.compression = compression
+        self.level = level
+        self.delta = delta
+
+    def writer(self, fobj):
+        """
+        Description:
+            Get a file object writing the encoded run to fobj.
+
+        Input:
+            fobj: <file object> opened with binary write permissions.
+
+        Returns:
+            <file object> fobj itself if runs are not compressed.
+            <_CompressedWriter> object which must be finished.
+        """
+        if self.compression is None:
+            return fobj
+        return _CompressedWriter(fobj,
+                                 partial(COMPRESSIONS[self.compression][0],
+                                         self.level),
+                                 None if self.compression == 'zlib' else
+                                 STREAM_BYTES)
+
+    def reader(self, fobj):
+        """
+        Description:
+            Get a file object reading the encoded run from fobj.
+
+        Input:
+            fobj: <file object> opened with binary read permissions.
+
+        Returns:
+            <file object> fobj itself if runs are not compressed.
+            <_DecompressedReader> object otherwise.
+        """
+        if self.compression is None:
+            return fobj
+        return _DecompressedReader(fobj, COMPRESSIONS[self.compression][1])
+
+
+class _CompressedWriter(object):
+    """
+    Description:
+        File like object compressing the data written to a file object,
+        in a single stream or in consecutive streams of up to stream_bytes.
+
+    Input:
+        fobj: <file object> opened with binary write permissions.
+        compressor_factory: <function> returning an object with compress
+                            and flush methods.
+        [stream_bytes]: <int> uncompressed bytes of each stream, or None
+                        for a single stream.
+    """
+    def __init__(self, fobj, compressor_factory, stream_bytes=None):
+        self._fobj = fobj
+        self._factory = compressor_factory
+        self._compressor = compressor_factory()
+        self._stream_bytes = stream_bytes
+        self._stream_left = stream_bytes
+        self.written = 0
+
+    def write(self, data):
+        """Compress data and write the compressed bytes available."""
+        if self._stream_bytes is not None:
+            while len(data) > self._stream_left:
+                self._compress(data[:self._stream_left])
+                data = data[self._stream_left:]
+                self._write(self._compressor.flush())
+                self._compressor = self._factory()
+                self._stream_left = self._stream_bytes
+            self._stream_left -= len(data)
+        self._compress(data)
+
+    def finish(self):
+        """Write the rest of the compressed stream."""
+        self._write(self._compressor.flush())
+
+    def _compress(self, data):
+        """Compress data to the current stream."""
+        self._write(self._compressor.compress(data))
+
+    def _write(self, data):
+        """Write compressed bytes, if any."""
+        if data:
+            self._fobj.write(data)
+            self.written += len(data)
+
+
+class _DecompressedReader(object):
+    """
+    Description:
+        File like object reading the decompressed data of a file object,
+        by decompressing up to READ_CHUNK_BYTES of it at a time, or up to
+        the end of the stream for decompressors that can not limit their
+        output.
+
+    Input:
+        fobj: <file object> opened with binary read permissions.
+        decompressor_factory: <function> returning an object with a
+                              decompress method.
+    """
+    def __init__(self, fobj, decompressor_factory):
+        self._fobj = fobj
+        self._factory = decompressor_factory
+        self._decompressor = decompressor_factory()
+        self._input = ''
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def read(self, size):
+        """
+        Description:
+            Read up to size decompressed bytes, less only at the end.
+
+        Raises:
+            RunFormatError: on corrupted compressed data.
+        """
+        while len(self._buffer) - self._pos < size and not self._eof:
+            try:
+                data = self._decompress(size)
+            except COMPRESSION_ERRORS as exc:
+                raise RunFormatError('Corrupted compressed run: %s' % (exc))
+            if data:
+                self._buffer = self._buffer[self._pos:] + data
+                self._pos = 0
+        data = self._buffer[self._pos:self._pos+size]
+        self._pos += len(data)
+        return data
+
+    def _decompress(self, max_length):
+        """
+        Description:
+            Decompress the next part of the compressed data. The output
+            of zlib is limited to max_length, keeping the rest of its
+            input for the next call. Other decompressors stop at the end
+            of each stream, keeping the input of the next streams.
+        """
+        tail = getattr(self._decompressor, 'unconsumed_tail', None)
+        if tail:
+            return self._decompressor.decompress(tail, max_length)
+        data = self._input or self._fobj.read(READ_CHUNK_BYTES)
+        self._input = ''
+        if not data:
+            self._eof = True
+            if tail is not None:
+                return self._decompressor.flush()
+            return ''
+        if tail is not None:
+            return self._decompressor.decompress(data, max_length)
+        try:
+            data = self._decompressor.decompress(data)
+        except EOFError:
+            # The previous stream ended with the last input read.
+            self._decompressor = self._factory()
+            data = self._decompressor.decompress(data)
+        if self._decompressor.unused_data:
+            self._input = self._decompressor.unused_data
+            self._decompressor = self._factory()
+        return data
+
+
+def _pack_blocks(chunk, delta=False):
+    """
+    Description:
+        Pack the items of a chunk, in the most compact format they fit,
+        which is a single block unless they are marshalled.
+
+    Input:
+        chunk: <list> of items.
+        [delta]: <boolean> delta encode 64-bit integers.
+
+    Returns:
+        <list> of tuples of the block tag, its number of items and its
+        payload string.
+    """
+    if delta:
+        try:
+            deltas = array(INT64_TYPECODE,
+                           chunk[:1] + map(sub, chunk[1:], chunk[:-1]))
+        except (OverflowError, TypeError):
+            pass
+        else:
+            data = deltas.tostring()
+            return [(DELTA_TAG, len(chunk),
+                     ''.join([data[idx::deltas.itemsize]
+                              for idx in xrange(deltas.itemsize)]))]
+    try:
+        return [(INT64_TAG, len(chunk),
+                 array(INT64_TYPECODE, chunk).tostring())]
+    except (OverflowError, TypeError):
+        return [(MARSHAL_TAG, len(part), marshal.dumps(part))
+                for part in (chunk[start:start+MARSHAL_BLOCK_ITEMS]
+                             for start in xrange(0, len(chunk),
+                                                 MARSHAL_BLOCK_ITEMS))]
+
+
+def items_to_run(fobj, items, block_items=RUN_BLOCK_ITEMS, codec=None):
+    """
+    Description:
+        Write items to a sorted run file in blocks of packed numbers, or
+        of marshalled items if they are not all 64-bit integers.
+
+    Input:
+        fobj: <file object> opened with binary write permissions.
+        items: <iterator> to be used for retrieving the desired ints, or
+                          other marshallable items.
+        [block_items]: <int> maximum number of items in a block.
+        [codec]: <RunCodec> encoding of the run, plain if None.
+
+    Returns:
+        <int> number of bytes written to fobj.
+    """
+    writer = fobj if codec is None else codec.writer(fobj)
+    delta = codec is not None and codec.delta
+    if delta:
+        block_items = min(block_items, DELTA_BLOCK_ITEMS)
+    written = 0
+    while True:
+        chunk = list(islice(items, block_items))
+        if not chunk:
+            break
+        for tag, count, payload in _pack_blocks(chunk, delta):
+            writer.write(HEADER.pack(tag, count, len(payload)))
+            writer.write(payload)
+            written += HEADER.size + len(payload)
+    if writer is not fobj:
+        writer.finish()
+        return writer.written
+    return written
+
+
+def _read_numbers(fobj, count, shuffled=False):
+    """
+    Description:
+        Read count packed 64-bit integers.
+
+    Input:
+        fobj: <file object> opened with binary read permissions.
+        count: <int> number of integers.
+        [shuffled]: <boolean> the bytes of the integers are shuffled.
+
+    Returns:
+        <list> of integers.
+
+    Raises:
+        RunFormatError: on a truncated payload.
+    """
+    numbers = array(INT64_TYPECODE)
+    payload = fobj.read(count*numbers.itemsize)
+    if len(payload) != count*numbers.itemsize:
+        raise RunFormatError('Truncated block payload')
+    if shuffled:
+        data = bytearray(len(payload))
+        for idx in xrange(numbers.itemsize):
+            data[idx::numbers.itemsize] = payload[idx*count:(idx+1)*count]
+        payload = str(data)
+    numbers.fromstring(payload)
+    return numbers.tolist()
+
+
+def blocks_from_run(fobj, block_items=RUN_BLOCK_ITEMS):
+    """
+    Description:
+        Generator method for yielding lists of the items stored in a
+        sorted run file. Blocks of 64-bit numbers are read in parts of at
+        most block_items, while delta encoded and marshalled blocks, of at
+        most DELTA_BLOCK_ITEMS and MARSHAL_BLOCK_ITEMS, are read at once.
+
+    Input:
+        fobj: <file object> opened with binary read permissions.
+        [block_items]: <int> maximum number of 64-bit items read at once.
+
+    Raises:
+        RunFormatError: on a truncated or unknown block.
+    """
+    while True:
+        header = fobj.read(HEADER.size)
+        if not header:
+            break
+        if len(header) != HEADER.size:
+            raise RunFormatError('Truncated block header')
+        tag, count, size = HEADER.unpack(header)
+        if tag == INT64_TAG:
+            while count > 0:
+                part = min(count, block_items)
+                count -= part
+                yield _read_numbers(fobj, part)
+        elif tag == DELTA_TAG:
+            numbers = _read_numbers(fobj, count, shuffled=True)
+            for idx in xrange(1, count):
+                numbers[idx] += numbers[idx-1]
+            yield numbers
+        elif tag == MARSHAL_TAG:
+            payload = fobj.read(size)
+            if len(payload) != size:
+                raise RunFormatError('Truncated block payload')
+            yield marshal.loads(payload)
+        else:
+            raise RunFormatError('Unknown block tag: "%s"' % (tag))
+
+
+def items_from_run(fobj, block_items=RUN_BLOCK_ITEMS, codec=None):
+    """
+    Description:
+        Get an iterator yielding the items of a sorted run file.
+
+    Input:
+        fobj: <file object> opened with binary read permissions.
+        [block_items]: <int> maximum number of 64-bit items read at once.
+        [codec]: <RunCodec> encoding of the run, plain if None.
+    """
+    if codec is not None:
+        fobj = codec.reader(fobj)
+    return chain.from_iterable(blocks_from_run(fobj, block_items))
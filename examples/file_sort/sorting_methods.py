@@ -1,5 +1,40 @@
 """Module that contains a collection of sorting functions"""
 
+from array import array
+from functools import partial
+from itertools import chain,\
+                      repeat
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+# Sorting algorithms available by numpy. The stable kind is a radix sort
+# for integers up to 16 bits and a timsort for bigger ones.
+NUMPY_SORT_KINDS = ('quicksort', 'mergesort', 'heapsort', 'stable')
+
+# Maximum number of items of a part that quicksort sorts by insertion sort.
+INSERTION_SORT_ITEMS = 16
+
+# Maximum ratio of the range of values to the number of items, for which
+# integer_sort uses counting sort instead of radix sort.
+COUNTING_SORT_RANGE_RATIO = 2
+
+# Number of neighbour pairs sampled by auto_sort for the presortedness and
+# number of items under which it always uses the built in sort.
+AUTO_SAMPLE_ITEMS = 1024
+AUTO_MIN_ITEMS = 256
+
+# Maximum ratio of the sampled pairs that are out of order, or in order,
+# for which the items are considered presorted, or reverse presorted.
+AUTO_PRESORTED_RATIO = 0.1
+
+# Maximum ratio of the range of values to the number of items, for which
+# auto_sort uses counting sort. Measured to be faster than the built in
+# sort from ranges of about half the number of items and below.
+AUTO_COUNTING_RANGE_RATIO = 0.5
+
 
 def default_sort(items):
     """
@@ -12,36 +47,116 @@ def default_sort(items):
     items.sort()
 
 
-def quicksort_phase_two(items, low, high):
+def insertion_sort(items, low=0, high=None):
+    """
+    Description:
+        Insertion sort in place sorting algorithm, efficient for small or
+        nearly sorted objects.
+
+    Input:
+        items: <list> or similar object that supports access by index.
+        low: <int> lower bound index
+        high: <int> higher bound index
+    """
+    if high is None:
+        high = len(items)-1
+    for i in xrange(low+1, high+1):
+        item = items[i]
+        j = i - 1
+        while j >= low and items[j] > item:
+            items[j+1] = items[j]
+            j -= 1
+        items[j+1] = item
+
+
+def heapsort(items, low=0, high=None):
     """
     Description:
-        Quicksort's function for choosing a pivot number that is placed into
-        the input object in a place that has all smaller items left to it and
-        all bigger items at the right.
+        Heapsort in place sorting algorithm, with guaranteed O(n log n)
+        running time.
 
     Input:
         items: <list> or similar object that supports access by index.
         low: <int> lower bound index
         high: <int> higher bound index
     """
+    if high is None:
+        high = len(items)-1
+    length = high - low + 1
+
+    def sift_down(root, end):
+        """Move down a root item of the max heap ending before end."""
+        item = items[low+root]
+        child = 2*root + 1
+        while child < end:
+            if child+1 < end and items[low+child] < items[low+child+1]:
+                child += 1
+            if items[low+child] <= item:
+                break
+            items[low+root] = items[low+child]
+            root = child
+            child = 2*root + 1
+        items[low+root] = item
+
+    for root in xrange(length/2 - 1, -1, -1):
+        sift_down(root, length)
+    for end in xrange(length-1, 0, -1):
+        items[low], items[low+end] = items[low+end], items[low]
+        sift_down(0, end)
+
+
+def quicksort_partition(items, low, high):
+    """
+    Description:
+        Quicksort's function for partitioning the items around a pivot,
+        chosen as the median of the first, middle and last items. Items
+        are partitioned in three parts (Dutch national flag), the smaller
+        items, the items equal to the pivot and the bigger items, so that
+        duplicates are placed once.
+
+    Input:
+        items: <list> or similar object that supports access by index.
+        low: <int> lower bound index
+        high: <int> higher bound index
 
-    # Choose the middle item to be the pivot and swap it with the one
-    # in the high position until the final position is being found.
+    Returns:
+        <tuple> of the lower and higher index of the items equal to pivot.
+    """
     mid = (low + high)/2
-    items[high], items[mid] = items[mid], items[high]
-    next_change = low
-    for i in xrange(low, high):
-        if items[i] < items[high]:
-            items[i], items[next_change] = items[next_change], items[i]
-            next_change += 1
-    items[next_change], items[high] = items[high], items[next_change]
-    return next_change
+    if items[mid] < items[low]:
+        items[low], items[mid] = items[mid], items[low]
+    if items[high] < items[low]:
+        items[low], items[high] = items[high], items[low]
+    if items[high] < items[mid]:
+        items[mid], items[high] = items[high], items[mid]
+    pivot = items[mid]
+
+    less = low
+    i = low
+    greater = high
+    while i <= greater:
+        item = items[i]
+        if item < pivot:
+            items[less], items[i] = item, items[less]
+            less += 1
+            i += 1
+        elif item > pivot:
+            items[greater], items[i] = item, items[greater]
+            greater -= 1
+        else:
+            i += 1
+    return less, greater
 
 
 def quicksort(items, low=0, high=None):
     """
     Description:
-        Quicksort in place sorting algorithm.
+        Quicksort in place sorting algorithm (introsort). Applied without
+        recursion, by using an explicit stack of the parts to be sorted
+        and continuing with the smaller part of each partition, so that
+        the stack holds up to log(n) parts. Small parts are sorted by
+        insertion sort and, in case of too many partitions, parts are
+        sorted by heapsort to avoid the quadratic worst case.
 
     Input:
         items: <list> or similar object that supports access by index.
@@ -50,53 +165,373 @@ def quicksort(items, low=0, high=None):
     """
     if high is None:
         high = len(items)-1
-    if low < high:
-        pivot = quicksort_phase_two(items, low, high)
-        quicksort(items, low=low, high=pivot-1)
-        quicksort(items, low=pivot+1, high=high)
+    stack = [(low, high, 2*max(1, high-low+1).bit_length())]
+    while stack:
+        low, high, depth = stack.pop()
+        while high - low >= INSERTION_SORT_ITEMS:
+            if depth == 0:
+                heapsort(items, low, high)
+                break
+            depth -= 1
+            less, greater = quicksort_partition(items, low, high)
+
+            # Continue with the smaller part and store the bigger one.
+            if less - low < high - greater:
+                stack.append((greater+1, high, depth))
+                high = less - 1
+            else:
+                stack.append((low, less-1, depth))
+                low = greater + 1
+        else:
+            insertion_sort(items, low, high)
 
 
-def merge_sort(items):
+def merge_sort(items, key=None):
     """
     Description:
-        Merge sort algorithm for applying a stable but not in place sort
+        Merge sort algorithm for applying a stable but not in place sort.
+        Applied bottom up, by finding the already sorted runs of items and
+        merging pairs of adjacent runs at each pass, from the object to a
+        single auxiliary buffer of the same size and back.
 
     Input:
         items: <list> - or any other similar object that also supports
                          slice operation.
+        [key]: <function> computing once for each item the value that it is
+                          compared by.
     """
+    if key is not None:
+        # Sort by (key, index, item) triples, which is stable and never
+        # compares the items as indexes are unique, and write the items
+        # back without another copy of them.
+        decorated = [(key(item), idx, item)
+                     for idx, item in enumerate(items)]
+        merge_sort(decorated)
+        for idx, triple in enumerate(decorated):
+            items[idx] = triple[2]
+        return
+
     length = len(items)
-    if length > 1:
-        mid = length/2
-        left = items[:mid]
-        right = items[mid:]
-
-        # Recursively sort left and right halfs of the object.
-        merge_sort(left)
-        merge_sort(right)
-
-        i_idx = 0
-        l_idx = 0
-        r_idx = 0
-        llength = mid
-        rlength = length - llength
-
-        # Merge the left and right parts into the original one.
-        while l_idx < llength and r_idx < rlength:
-            if left[l_idx] <= right[r_idx]:
-                items[i_idx] = left[l_idx]
-                l_idx += 1
+    if length < 2:
+        return
+
+    # Find the bounds of the runs that are already sorted.
+    bounds = [0]
+    for idx in xrange(1, length):
+        if items[idx] < items[idx-1]:
+            bounds.append(idx)
+    bounds.append(length)
+
+    source = items
+    target = items[:]
+    while len(bounds) > 2:
+        merged_bounds = [0]
+        for idx in xrange(0, len(bounds)-1, 2):
+            low = bounds[idx]
+            if idx+2 < len(bounds):
+                mid = bounds[idx+1]
+                high = bounds[idx+2]
+                merge_runs(source, target, low, mid, high)
             else:
-                items[i_idx] = right[r_idx]
-                r_idx += 1
-            i_idx += 1
+                high = bounds[idx+1]
+                target[low:high] = source[low:high]
+            merged_bounds.append(high)
+        bounds = merged_bounds
+        source, target = target, source
 
-        while l_idx < llength:
-            items[i_idx] = left[l_idx]
-            l_idx += 1
-            i_idx += 1
+    # Copy back the result in case that is in the auxiliary buffer.
+    if source is not items:
+        items[:] = source
+
+
+def merge_runs(source, target, low, mid, high):
+    """
+    Description:
+        Merge sort's function for merging two adjacent sorted runs of the
+        source object into the same positions of the target object. Items
+        of the left run are placed first in case of equal items.
 
-        while r_idx < rlength:
-            items[i_idx] = right[r_idx]
+    Input:
+        source: <list> or similar object that supports access by index.
+        target: <list> or similar object of the same size as source.
+        low: <int> start index of the left run
+        mid: <int> start index of the right run
+        high: <int> end index (exclusive) of the right run
+    """
+    l_idx = low
+    r_idx = mid
+    i_idx = low
+    while l_idx < mid and r_idx < high:
+        if source[r_idx] < source[l_idx]:
+            target[i_idx] = source[r_idx]
             r_idx += 1
-            i_idx += 1
+        else:
+            target[i_idx] = source[l_idx]
+            l_idx += 1
+        i_idx += 1
+    if l_idx < mid:
+        target[i_idx:high] = source[l_idx:mid]
+    else:
+        target[i_idx:high] = source[r_idx:high]
+
+
+def numpy_sort(items, kind='quicksort'):
+    """
+    Description:
+        Vectorised sort by using numpy. A numpy array is sorted in place,
+        while any other object is converted to an int64 numpy array and
+        its contents are replaced by the sorted ones.
+
+    Input:
+        items: <numpy.ndarray> or <list> of 64-bit integers.
+        [kind]: <string> one of NUMPY_SORT_KINDS sorting algorithms.
+
+    Raises:
+        ImportError: if numpy is not available.
+        ValueError: on unknown sorting algorithm kind.
+    """
+    if numpy is None:
+        raise ImportError('numpy is required by numpy_sort')
+    if kind not in NUMPY_SORT_KINDS:
+        raise ValueError('Unknown numpy sort kind: "%s"' % (kind))
+    if isinstance(items, numpy.ndarray):
+        items.sort(kind=kind)
+    else:
+        ndarray = numpy.array(items, dtype=numpy.int64)
+        ndarray.sort(kind=kind)
+        items[:] = ndarray.tolist()
+
+
+def _replace_items(items, values):
+    """
+    Description:
+        Replace the contents of a list or an array by the given values.
+
+    Input:
+        items: <list> or <array.array> to be replaced.
+        values: <list> of the new contents.
+    """
+    if isinstance(items, array):
+        items[:] = array(items.typecode, values)
+    else:
+        items[:] = values
+
+
+def counting_sort(items, low=None, high=None):
+    """
+    Description:
+        Counting sort algorithm for integers in a bounded range. Takes
+        linear time to the number of items plus the range of their values.
+
+    Input:
+        items: <list> or <array.array> of integers.
+        [low]: <int> lower bound of the values, found if not given.
+        [high]: <int> higher bound of the values, found if not given.
+    """
+    if not items:
+        return
+    if low is None:
+        low = min(items)
+    if high is None:
+        high = max(items)
+    counts = [0]*(high-low+1)
+    for num in items:
+        counts[num-low] += 1
+    _replace_items(items, list(chain.from_iterable(
+        repeat(low+offset, count)
+        for offset, count in enumerate(counts) if count)))
+
+
+def radix_sort(items, bits=None):
+    """
+    Description:
+        LSD radix sort algorithm for integers. The items are distributed
+        to buckets by each digit of the given bits, starting from the least
+        significant one, for as many digits as the range of their values.
+        Negative numbers are sorted by their offset from the minimum one.
+
+    Input:
+        items: <list> or <array.array> of integers.
+        [bits]: <int> width of a digit. If not given it is chosen so that
+                there are no more buckets than items, from 4 up to 16 bits.
+    """
+    if not items:
+        return
+    low = min(items)
+    span = max(items) - low
+    if bits is None:
+        bits = max(4, min(16, len(items).bit_length()-1))
+    mask = (1 << bits) - 1
+    values = [num-low for num in items] if low else list(items)
+    shift = 0
+    while span >> shift:
+        buckets = [[] for _ in xrange(1 << bits)]
+        appends = [bucket.append for bucket in buckets]
+        for num in values:
+            appends[(num >> shift) & mask](num)
+        values = list(chain.from_iterable(buckets))
+        shift += bits
+    if low:
+        values = [num+low for num in values]
+    _replace_items(items, values)
+
+
+def integer_sort(items):
+    """
+    Description:
+        Linear time sort for integers. The range of the values is detected
+        by a pass over them, and counting sort is used if that is up to
+        COUNTING_SORT_RANGE_RATIO times the number of items, otherwise
+        radix sort.
+
+    Input:
+        items: <list> or <array.array> of integers.
+    """
+    if not items:
+        return
+    low = min(items)
+    high = max(items)
+    if high-low < COUNTING_SORT_RANGE_RATIO*len(items):
+        counting_sort(items, low, high)
+    else:
+        radix_sort(items)
+
+
+def profile_items(items):
+    """
+    Description:
+        Measure the properties of the items that the choice of a sorting
+        algorithm depends on. They are measured on a sample, except the
+        range of the values, which is found by a pass over them only if
+        they are integers that are not presorted.
+
+    Input:
+        items: <list> or <array.array> of items.
+
+    Returns:
+        <dict> containing:
+                 items: <int> number of items
+                 integers: <boolean> the sampled items and the range bounds
+                           are integers
+                 low, high: range bounds of the values, None if not
+                            integers or presorted
+                 out_of_order: <float> ratio of the sampled neighbour pairs
+                               that are out of order
+                 duplicates: <float> ratio of the sampled items that are
+                             duplicates of other sampled items
+    """
+    count = len(items)
+    step = max(1, (count-1) / AUTO_SAMPLE_ITEMS)
+    positions = xrange(0, count-1, step)
+    sample = [items[idx] for idx in positions]
+    out_of_order = sum(1 for idx in positions if items[idx] > items[idx+1])
+    out_of_order /= float(len(positions) or 1)
+    low = high = None
+    integers = all(isinstance(item, (int, long)) for item in sample)
+    if integers and count and not _presorted(out_of_order):
+        low, high = min(items), max(items)
+        integers = isinstance(low, (int, long)) and\
+            isinstance(high, (int, long))
+        if integers is False:
+            low = high = None
+    return {'items': count, 'integers': integers, 'low': low, 'high': high,
+            'out_of_order': out_of_order,
+            'duplicates': 1 - len(set(sample)) / float(len(sample))
+                          if sample else 0.0}
+
+
+def _presorted(out_of_order):
+    """
+    Description:
+        Find if items are presorted, or reverse presorted, by the ratio of
+        their sampled neighbour pairs that are out of order.
+
+    Returns:
+        <boolean>
+    """
+    return not AUTO_PRESORTED_RATIO < out_of_order < 1-AUTO_PRESORTED_RATIO
+
+
+def choose_sort(profile):
+    """
+    Description:
+        Choose the fastest sorting function for items, by their profile:
+          1. The built in sort for few items, not integers, or presorted
+             (or reverse presorted) items, as its merging of runs takes
+             close to linear time for them.
+          2. Counting sort for integers in a small range, as the ones with
+             many duplicates.
+          3. numpy sort for 64-bit integers, if numpy is available.
+          4. The built in sort otherwise.
+        The pure python radix sort is not chosen, as it is measured to be
+        slower than the built in sort in every case.
+
+    Input:
+        profile: <dict> of the items, as returned by profile_items.
+
+    Returns:
+        <function> sorting the items in place.
+    """
+    if profile['items'] < AUTO_MIN_ITEMS or not profile['integers'] or\
+            _presorted(profile['out_of_order']):
+        return default_sort
+    if profile['high'] - profile['low'] <=\
+            AUTO_COUNTING_RANGE_RATIO*profile['items']:
+        return partial(counting_sort, low=profile['low'],
+                       high=profile['high'])
+    if numpy is not None and -2**63 <= profile['low'] and\
+            profile['high'] < 2**63:
+        return _numpy_int_sort
+    return default_sort
+
+
+def _numpy_int_sort(items):
+    """
+    Description:
+        Sort a list or an array of integers by numpy, or by the built in
+        sort if they are not all 64-bit integers.
+
+    Input:
+        items: <list> or <array.array> of items.
+    """
+    ndarray = numpy.array(items)
+    if ndarray.dtype != numpy.int64:
+        _builtin_sort(items)
+        return
+    ndarray.sort()
+    _replace_items(items, ndarray.tolist())
+
+
+def auto_sort(items):
+    """
+    Description:
+        Sort items by the sorting function that is chosen by their
+        profile, as described by choose_sort.
+
+    Input:
+        items: <list> or <array.array> of items.
+    """
+    sort_method = choose_sort(profile_items(items))
+    if sort_method is default_sort:
+        _builtin_sort(items)
+        return
+    try:
+        sort_method(items)
+    except TypeError:
+        # Not sampled items are not integers, which is found before any of
+        # the items is replaced.
+        _builtin_sort(items)
+
+
+def _builtin_sort(items):
+    """
+    Description:
+        Sort a list or an array by the built in sort.
+
+    Input:
+        items: <list> or <array.array> of items.
+    """
+    if isinstance(items, array):
+        _replace_items(items, sorted(items))
+    else:
+        default_sort(items)
@@ -2,18 +2,57 @@
 Unit test containing testcases for the sorting modules
 """
 import os
+import json
 import random
 import tempfile
 import unittest
 
-from sorting_methods import quicksort,\
+from StringIO import StringIO
+from functools import partial
+from itertools import chain,\
+                      groupby
+
+from array import array
+from sorting_methods import numpy,\
+                            heapsort,\
+                            auto_sort,\
+                            quicksort,\
+                            choose_sort,\
+                            profile_items,\
                             merge_sort,\
-                            default_sort
+                            numpy_sort,\
+                            radix_sort,\
+                            default_sort,\
+                            integer_sort,\
+                            counting_sort,\
+                            insertion_sort,\
+                            NUMPY_SORT_KINDS
 
 from file_sort import FileSorter,\
+                      STATS_PHASES,\
                       SortingError,\
                       InitializeError
 
+from record_format import RecordFormat,\
+                          RecordFormatError
+
+from benchmark import DISTRIBUTIONS,\
+                      FEW_UNIQUE_NUMBERS,\
+                      measure_case,\
+                      compare_results,\
+                      generate_numbers
+
+from checkpoint import MANIFEST_NAME
+
+from run_format import RunCodec,\
+                       COMPRESSIONS,\
+                       RunFormatError,\
+                       STREAM_BYTES,\
+                       MARSHAL_BLOCK_ITEMS,\
+                       items_to_run,\
+                       items_from_run,\
+                       blocks_from_run
+
 
 def get_all_perms(int_array, idx=None):
     """
@@ -103,7 +142,8 @@ class FileSortTestcase(SortingTestsBase):
         fobj.close()
         return fobj
 
-    def file_sort_common(self, sort_method=None, itemslimit=False):
+    def file_sort_common(self, sort_method=None, itemslimit=False,
+                         workers=None):
         """
         Description:
             Basic common testing function to test sort methods of the
@@ -121,7 +161,7 @@ class FileSortTestcase(SortingTestsBase):
             else:
                 limit = max(1, len(alist)/10)
                 try:
-                    file_sort.external_sort(limit)
+                    file_sort.external_sort(limit, workers=workers)
                 except SortingError:
                     os.unlink(fobj.name)
                     continue
@@ -155,10 +195,576 @@ class FileSortTestcase(SortingTestsBase):
         """File sorting with the merge sort implementation"""
         self.file_sort_common(sort_method=merge_sort)
 
+    @unittest.skipIf(numpy is None, 'numpy is not available')
+    def test_file_numpy_sort(self):
+        """File sorting with the numpy sorting implementation"""
+        for kind in NUMPY_SORT_KINDS:
+            self.file_sort_common(sort_method=partial(numpy_sort, kind=kind))
+
+    @unittest.skipIf(numpy is None, 'numpy is not available')
+    def test_file_numpy_sort_contents(self):
+        """Test that numpy file sorting keeps all the numbers"""
+        alist = self.lists[-1] + [2**63-1, -2**63]
+        fobj = self._create_temporary_input_file(alist)
+        file_sort = FileSorter(input_file=fobj.name)
+        file_sort.sort(sort_method=numpy_sort)
+        os.unlink(fobj.name)
+        with open(file_sort.get_output_filename(), 'r') as out_fobj:
+            numbers = [int(line) for line in out_fobj]
+        os.remove(file_sort.get_output_filename())
+        self.assertEqual(numbers, sorted(alist))
+
+    @unittest.skipIf(numpy is None, 'numpy is not available')
+    def test_stream_numpy_sort(self):
+        """Test numpy sorting of an iterable into a stream"""
+        output = StringIO()
+        FileSorter(iter(self.lists[-1]), output).sort(sort_method=numpy_sort)
+        self.assertEqual([int(line) for line in
+                          output.getvalue().splitlines()],
+                         sorted(self.lists[-1]))
+        with self.assertRaises(SortingError):
+            FileSorter(iter([2**64]), StringIO()).sort(sort_method=numpy_sort)
+
+    @unittest.skipIf(numpy is None, 'numpy is not available')
+    def test_file_numpy_sort_big_numbers(self):
+        """Test numpy file sorting of numbers that do not fit in 64 bits, or
+        of malformed lines"""
+        fobj = self._create_temporary_input_file([1, 2**64])
+        with self.assertRaises(SortingError):
+            FileSorter(input_file=fobj.name).sort(sort_method=numpy_sort)
+        os.unlink(fobj.name)
+        for contents in ('3\n\n1\n', '3\n1\n2 5\n'):
+            fobj = tempfile.NamedTemporaryFile()
+            fobj.write(contents)
+            fobj.flush()
+            with self.assertRaises(SortingError):
+                FileSorter(fobj.name, StringIO()).sort(sort_method=numpy_sort)
+
+    def test_file_integer_sort(self):
+        """File sorting with the linear time integer sort implementations"""
+        for sort_method in (radix_sort, counting_sort, integer_sort):
+            self.file_sort_common(sort_method=sort_method)
+            self.external_sort_contents(self.lists[-1], 1000,
+                                        sort_method=sort_method)
+
     def test_file_external_sort(self):
         """File sorting with the external sorting implementation"""
         self.file_sort_common(itemslimit=True)
 
+    def test_file_external_sort_workers(self):
+        """File sorting with the external sorting done by worker processes"""
+        self.file_sort_common(itemslimit=True, workers=2)
+
+    def external_sort_contents(self, alist, itemslimit, **kwargs):
+        """
+        Description:
+            Test that external sorting of a list with the given arguments
+            outputs exactly the sorted numbers of the list.
+        """
+        fobj = self._create_temporary_input_file(alist)
+        file_sort = FileSorter(input_file=fobj.name)
+        file_sort.external_sort(itemslimit, **kwargs)
+        os.unlink(fobj.name)
+        with open(file_sort.get_output_filename(), 'r') as out_fobj:
+            numbers = [int(line) for line in out_fobj]
+        os.remove(file_sort.get_output_filename())
+        self.assertEqual(numbers, sorted(alist))
+
+    def test_external_sort_contents(self):
+        """Test that external sorting keeps all the numbers"""
+        self.external_sort_contents(self.lists[-1], 500)
+        self.external_sort_contents([2**64, -2**64, 3, 2, 1, 0], 4)
+
+    def test_external_sort_multi_pass(self):
+        """Test external sorting with too many temp files to merge at once"""
+        for itemslimit in (1, 2, 3, 130):
+            self.external_sort_contents(self.lists[-1][:3000], itemslimit)
+
+    def test_external_sort_workers_contents(self):
+        """Test that parallel external sorting keeps all the numbers"""
+        self.external_sort_contents(self.lists[-1], 1000, workers=3)
+
+    def test_external_sort_memory_bytes(self):
+        """Test external sorting with a memory limit in bytes"""
+        for memory_bytes in (1, 1000, 50000, 10**9):
+            self.external_sort_contents(self.lists[-1][:1000], None,
+                                        memory_bytes=memory_bytes)
+        self.external_sort_contents(self.lists[-1], None, workers=2,
+                                    memory_bytes=200000)
+
+    def test_external_sort_peak_memory(self):
+        """Test reporting of the peak memory used by the external sort"""
+        fobj = tempfile.NamedTemporaryFile()
+        file_sort = FileSorter(fobj.name)
+        self.assertIsNone(file_sort.get_peak_memory())
+        self.assertIsNone(file_sort.get_peak_memory_increase())
+        file_sort.external_sort(memory_bytes=10**6)
+        self.assertGreater(file_sort.get_peak_memory(), 0)
+        self.assertGreaterEqual(file_sort.get_peak_memory_increase(), 0)
+        self.assertLessEqual(file_sort.get_peak_memory_increase(),
+                             file_sort.get_peak_memory())
+
+    def test_invalid_memory_bytes(self):
+        """Test the case of invalid memory limit in bytes asked"""
+        fobj = tempfile.NamedTemporaryFile()
+        for kwargs in ({}, {'memory_bytes': 0},
+                       {'itemslimit': 10, 'memory_bytes': 10}):
+            with self.assertRaises(SortingError):
+                FileSorter(fobj.name).external_sort(**kwargs)
+
+    def test_external_sort_replacement(self):
+        """Test external sorting with replacement selection"""
+        for itemslimit in (1, 2, 50, 20000):
+            self.external_sort_contents(self.lists[-1][:1000], itemslimit,
+                                        replacement_selection=True)
+        self.external_sort_contents(self.lists[-1][:1000], None,
+                                    memory_bytes=10000,
+                                    replacement_selection=True)
+
+    def test_replacement_selection_runs(self):
+        """Test the number of temp files created by replacement selection"""
+        file_sort = FileSorter(__file__)
+        for alist, itemslimit, max_files in (
+                (range(10000), 100, 1),
+                (range(10000, 0, -1), 100, 100),
+                (self.lists[-1], 500, 12)):
+            sorted_files = []
+            file_sort._create_sorted_files_replacement(iter(alist),
+                                                       itemslimit,
+                                                       sorted_files)
+            self.assertLessEqual(len(sorted_files), max_files)
+            for path in sorted_files:
+                file_sort._remove_run(path)
+
+    def test_external_sort_compression(self):
+        """Test external sorting with compressed and delta encoded runs"""
+        alist = self.lists[-1][:3000] + [2**64, -2**64]
+        for compression in sorted(COMPRESSIONS):
+            for itemslimit in (3, 130):
+                self.external_sort_contents(alist, itemslimit,
+                                            compression=compression,
+                                            delta_encoding=True)
+        self.external_sort_contents(alist, 500, workers=2,
+                                    compression='zlib', compress_level=9)
+        self.external_sort_contents(alist, 50, replacement_selection=True,
+                                    delta_encoding=True)
+
+    def test_external_sort_tmp_dirs(self):
+        """Test spilling the temporary files to directories in turn"""
+        tmp_dirs = [tempfile.mkdtemp() for _ in xrange(3)]
+        created = dict((tmp_dir, set()) for tmp_dir in tmp_dirs)
+        file_sort = FileSorter(iter(self.lists[-1][:1000]), StringIO())
+        spill_run = file_sort._spill_run
+
+        def spill_and_record(*args):
+            """Record the temporary files that are created."""
+            path = spill_run(*args)
+            created[os.path.dirname(path)].add(path)
+            return path
+
+        file_sort._spill_run = spill_and_record
+        try:
+            file_sort.external_sort(100, tmp_dir=tmp_dirs)
+            for tmp_dir in tmp_dirs:
+                self.assertGreaterEqual(len(created[tmp_dir]), 3)
+                self.assertEqual(os.listdir(tmp_dir), [])
+        finally:
+            for tmp_dir in tmp_dirs:
+                os.rmdir(tmp_dir)
+
+    def test_external_sort_spilled_bytes(self):
+        """Test accounting of the bytes of the temporary files"""
+        file_sort = FileSorter(iter(range(10000)), StringIO())
+        self.assertEqual(file_sort.get_bytes_spilled(), 0)
+        file_sort.external_sort(1000)
+        one_pass = file_sort.get_bytes_spilled()
+        self.assertGreaterEqual(one_pass, 80000)
+        self.assertEqual(file_sort.get_peak_disk_usage(), one_pass)
+
+        # More passes rewrite all the numbers to new temporary files,
+        # while the merged ones are removed.
+        file_sort = FileSorter(iter(range(10000)), StringIO())
+        file_sort.external_sort(1000, max_open_files=3)
+        self.assertGreater(file_sort.get_bytes_spilled(), 2*one_pass)
+        self.assertLess(file_sort.get_peak_disk_usage(), 2*one_pass)
+
+        # A single file left over by the grouping of a pass is not
+        # rewritten.
+        file_sort = FileSorter(iter(range(10000)), StringIO())
+        file_sort.external_sort(4000)
+        one_pass = file_sort.get_bytes_spilled()
+        file_sort = FileSorter(iter(range(10000)), StringIO())
+        file_sort.external_sort(4000, max_open_files=3)
+        self.assertEqual(file_sort.get_stats()['merge_passes'], 2)
+        self.assertLess(file_sort.get_bytes_spilled(), 1.9*one_pass)
+
+    def test_external_sort_max_open_files(self):
+        """Test limiting the temporary files open at once"""
+        file_sort = FileSorter(iter([]), StringIO())
+        self.assertEqual(file_sort._merge_fan_in(10**6, 3), 2)
+        self.assertEqual(file_sort._merge_fan_in(10**6, 100), 99)
+        self.assertEqual(file_sort._merge_fan_in(640, 100), 10)
+        for max_open_files in (3, 4, 7):
+            self.external_sort_contents(self.lists[-1][:3000], 1000,
+                                        max_open_files=max_open_files)
+
+    def test_external_sort_error_cleanup(self):
+        """Test removing the temporary files in case of an error"""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for kwargs in ({}, {'workers': 2},
+                           {'replacement_selection': True}):
+                file_sort = FileSorter(iter(range(1000) + ['x']), StringIO())
+                with self.assertRaises(TypeError):
+                    file_sort.external_sort(100, tmp_dir=tmp_dir, **kwargs)
+                self.assertEqual(os.listdir(tmp_dir), [])
+        finally:
+            os.rmdir(tmp_dir)
+
+    def test_invalid_tmp_dir(self):
+        """Test the case of invalid temporary directories asked"""
+        fobj = tempfile.NamedTemporaryFile()
+        for kwargs in ({'tmp_dir': []}, {'tmp_dir': fobj.name},
+                       {'tmp_dir': [tempfile.gettempdir(), '/not/a/dir']},
+                       {'max_open_files': 2}, {'max_open_files': None}):
+            with self.assertRaises(SortingError):
+                FileSorter(fobj.name).external_sort(10, **kwargs)
+
+    def interrupted_external_sort(self, input_file, stop, itemslimit,
+                                  **kwargs):
+        """
+        Description:
+            Run a checkpointed external sort, interrupting it when the stop
+            function returns True for its stats, as the process was killed.
+
+        Returns:
+            <boolean> True if the sort is interrupted.
+        """
+        class Interrupted(Exception):
+            """Exception interrupting the sort."""
+            pass
+
+        def progress(stats):
+            """Interrupt the sort when it is time to stop."""
+            if stats['seconds'] is not None and stop(stats):
+                raise Interrupted()
+
+        try:
+            FileSorter(input_file, StringIO()).external_sort(
+                itemslimit, progress=progress, **kwargs)
+        except Interrupted:
+            return True
+        return False
+
+    def test_external_sort_checkpoint(self):
+        """Test resuming an interrupted checkpointed external sort"""
+        alist = self.lists[-1][:5000]
+        fobj = self._create_temporary_input_file(alist)
+        work_dir = tempfile.mkdtemp()
+        stops = [(lambda stats: stats['runs'] == 4, {}),
+                 (lambda stats: stats['runs'] == 4, {'workers': 2}),
+                 (lambda stats: stats['merge_passes'] == 1,
+                  {'replacement_selection': True, 'delta_encoding': True,
+                   'max_open_files': 3}),
+                 (lambda stats: stats['merge_passes'] == 1,
+                  {'max_open_files': 3, 'compression': 'zlib'}),
+                 (lambda stats: stats['merge_passes'] == 2,
+                  {'max_open_files': 3, 'unique': True})]
+        try:
+            for stop, kwargs in stops:
+                output = StringIO()
+                expected = FileSorter(fobj.name, output)
+                expected.external_sort(500, **kwargs)
+                expected = expected.get_stats()
+                self.assertTrue(self.interrupted_external_sort(
+                    fobj.name, stop, 500, work_dir=work_dir, **kwargs))
+                self.assertIn(MANIFEST_NAME, os.listdir(work_dir))
+
+                resumed = StringIO()
+                file_sort = FileSorter(fobj.name, resumed)
+                file_sort.external_sort(500, work_dir=work_dir, **kwargs)
+                self.assertEqual(resumed.getvalue(), output.getvalue())
+                self.assertEqual(os.listdir(work_dir), [])
+                stats = file_sort.get_stats()
+                for key in ('items', 'runs', 'merge_passes'):
+                    self.assertEqual(stats[key], expected[key])
+                self.assertLess(stats['bytes_spilled'],
+                                expected['bytes_spilled'])
+        finally:
+            os.unlink(fobj.name)
+            for name in os.listdir(work_dir):
+                os.unlink(os.path.join(work_dir, name))
+            os.rmdir(work_dir)
+
+    def test_external_sort_checkpoint_invalid(self):
+        """Test the cases of checkpoints that can not be resumed"""
+        fobj = self._create_temporary_input_file(self.lists[-1][:2000])
+        work_dir = tempfile.mkdtemp()
+        try:
+            with self.assertRaises(SortingError):
+                FileSorter(iter([1]), StringIO()).external_sort(
+                    10, work_dir=work_dir)
+            with self.assertRaises(SortingError):
+                FileSorter(fobj.name).external_sort(
+                    10, work_dir=work_dir, tmp_dir=work_dir)
+            with self.assertRaises(SortingError):
+                FileSorter(fobj.name).external_sort(10, work_dir='/not/dir')
+
+            # Partial files that are not checkpointed are removed.
+            stale = os.path.join(work_dir, 'stale.run')
+            open(stale, 'w').close()
+            self.assertTrue(self.interrupted_external_sort(
+                fobj.name, lambda stats: stats['runs'] == 2, 500,
+                work_dir=work_dir))
+            self.assertEqual(len(os.listdir(work_dir)), 3)
+            for kwargs in ({'unique': True}, {'compression': 'zlib'}):
+                with self.assertRaises(SortingError):
+                    FileSorter(fobj.name, StringIO()).external_sort(
+                        500, work_dir=work_dir, **kwargs)
+            with open(os.path.join(work_dir, MANIFEST_NAME), 'w') as mfobj:
+                mfobj.write('{')
+            with self.assertRaises(SortingError):
+                FileSorter(fobj.name, StringIO()).external_sort(
+                    500, work_dir=work_dir)
+        finally:
+            os.unlink(fobj.name)
+            for name in os.listdir(work_dir):
+                os.unlink(os.path.join(work_dir, name))
+            os.rmdir(work_dir)
+
+    def test_invalid_compression(self):
+        """Test the case of invalid compression of runs asked"""
+        fobj = tempfile.NamedTemporaryFile()
+        for kwargs in ({'compression': 'rar'}, {'compress_level': 1},
+                       {'compression': 'zlib', 'compress_level': 10},
+                       {'compression': 'bz2', 'compress_level': 0}):
+            with self.assertRaises(SortingError):
+                FileSorter(fobj.name).external_sort(10, **kwargs)
+
+    def test_invalid_workers(self):
+        """Test the case of invalid number of workers asked"""
+        with self.assertRaises(SortingError):
+            fobj = tempfile.NamedTemporaryFile()
+            FileSorter(fobj.name).external_sort(10, workers=0)
+        with self.assertRaises(SortingError):
+            FileSorter(fobj.name).external_sort(10, workers=2,
+                                                replacement_selection=True)
+
+    def test_ints_from_mmap(self):
+        """Test loading the integers of a memory mapped file"""
+        alist = self.lists[-1] + [2**70, -2**70]
+        fobj = self._create_temporary_input_file(alist)
+        for chunk_bytes in (1, 2, 7, 1000, 10**6):
+            self.assertEqual(FileSorter._ints_from_mmap(fobj.name,
+                                                        chunk_bytes),
+                             alist)
+        os.unlink(fobj.name)
+
+    def test_ints_from_mmap_fallback(self):
+        """Test loading files that can not be memory mapped or parsed"""
+        for contents in ('', '1\n2.5\n', '3\n\n1\n', '1\n2 5\n'):
+            fobj = tempfile.NamedTemporaryFile()
+            fobj.write(contents)
+            fobj.flush()
+            self.assertIsNone(FileSorter._ints_from_mmap(fobj.name))
+
+    def test_sort_malformed_lines(self):
+        """Test that blank lines or lines of many numbers are not sorted"""
+        for contents in ('3\n\n1\n', '3\n1\n2 5\n'):
+            fobj = tempfile.NamedTemporaryFile()
+            fobj.write(contents)
+            fobj.flush()
+            with self.assertRaises(ValueError):
+                FileSorter(fobj.name, StringIO()).sort()
+            with self.assertRaises(ValueError):
+                FileSorter(fobj.name, StringIO()).external_sort(10)
+
+    def test_stream_sort(self):
+        """Test sorting iterables and file objects into streams"""
+        alist = self.lists[-1]
+        for sort_args in ({}, {'sort_method': quicksort}):
+            output = StringIO()
+            file_sort = FileSorter(input_file=iter(alist), output=output)
+            file_sort.sort(**sort_args)
+            self.assertIsNone(file_sort.get_output_filename())
+            self.assertEqual([int(line) for line in
+                              output.getvalue().splitlines()], sorted(alist))
+        output = StringIO()
+        FileSorter(StringIO(''.join('%d\n' % num for num in alist)),
+                   output=output).sort()
+        self.assertEqual([int(line) for line in
+                          output.getvalue().splitlines()], sorted(alist))
+
+    def test_stream_external_sort(self):
+        """Test external sorting of an unseekable input into a stream"""
+        alist = self.lists[-1]
+        for sort_args in ({'itemslimit': 500},
+                          {'memory_bytes': 20000, 'workers': 2},
+                          {'itemslimit': 500, 'replacement_selection': True}):
+            output = StringIO()
+            FileSorter((num for num in alist),
+                       output=output).external_sort(**sort_args)
+            self.assertEqual([int(line) for line in
+                              output.getvalue().splitlines()], sorted(alist))
+
+    @staticmethod
+    def output_ints(output):
+        """
+        Description:
+            Get the integers written to a StringIO output.
+        """
+        return [int(line) for line in output.getvalue().splitlines()]
+
+    def test_unique(self):
+        """Test sorting with duplicates removal"""
+        alist = self.lists[-1]
+        for method, kwargs in ((FileSorter.sort, {}),
+                               (FileSorter.sort, {'sort_method': merge_sort}),
+                               (FileSorter.external_sort, {'itemslimit': 1}),
+                               (FileSorter.external_sort,
+                                {'itemslimit': 300})):
+            output = StringIO()
+            method(FileSorter(iter(alist), output), unique=True, **kwargs)
+            self.assertEqual(self.output_ints(output), sorted(set(alist)))
+
+    @unittest.skipIf(numpy is None, 'numpy is not available')
+    def test_unique_numpy(self):
+        """Test numpy sorting with duplicates removal"""
+        for alist in ([], [1, 1], self.lists[-1]):
+            output = StringIO()
+            FileSorter(iter(alist), output).sort(sort_method=numpy_sort,
+                                                 unique=True)
+            self.assertEqual(self.output_ints(output), sorted(set(alist)))
+
+    def check_stats(self, stats, method, items):
+        """
+        Description:
+            Test the stats of a sort, which must be JSON serializable.
+        """
+        self.assertEqual(json.loads(json.dumps(stats))['method'], method)
+        self.assertEqual(stats['items'], items)
+        self.assertEqual(sorted(stats['phases']), sorted(STATS_PHASES))
+        self.assertGreaterEqual(stats['seconds'],
+                                sum(stats['phases'].values()))
+        self.assertGreater(stats['items_per_second'], 0)
+        self.assertGreater(stats['peak_memory'], 0)
+        self.assertGreaterEqual(stats['peak_memory_increase'], 0)
+
+    def test_sort_stats(self):
+        """Test the stats of in memory sorting"""
+        file_sort = FileSorter(iter(self.lists[-1]), StringIO())
+        self.assertIsNone(file_sort.get_stats())
+        reported = []
+        file_sort.sort(progress=reported.append)
+        self.check_stats(file_sort.get_stats(), 'sort', len(self.lists[-1]))
+        self.assertEqual(file_sort.get_stats()['runs'], 0)
+        self.assertEqual(len(reported), 3)
+        self.assertEqual(reported[-1], file_sort.get_stats())
+        self.assertIsNone(reported[0]['peak_memory'])
+        self.assertIsNone(reported[0]['peak_memory_increase'])
+
+    @unittest.skipIf(numpy is None, 'numpy is not available')
+    def test_sort_stats_numpy(self):
+        """Test the stats of numpy sorting"""
+        file_sort = FileSorter(iter(self.lists[-1]), StringIO())
+        file_sort.sort(sort_method=numpy_sort)
+        self.check_stats(file_sort.get_stats(), 'sort', len(self.lists[-1]))
+
+    def test_external_sort_stats(self):
+        """Test the stats and progress reports of external sorting"""
+        alist = self.lists[-1][:1000]
+        for kwargs, runs in (({}, 10), ({'workers': 2}, 10),
+                             ({'replacement_selection': True}, 6)):
+            file_sort = FileSorter(iter(alist), StringIO())
+            reported = []
+            file_sort.external_sort(100, max_open_files=3,
+                                    progress=reported.append, **kwargs)
+            stats = file_sort.get_stats()
+            self.check_stats(stats, 'external_sort', len(alist))
+            self.assertLessEqual(stats['runs'], runs)
+            self.assertEqual(stats['merge_passes'],
+                             len(bin(stats['runs']-1))-2)
+            self.assertEqual(stats['bytes_spilled'],
+                             file_sort.get_bytes_spilled())
+            self.assertEqual(len(reported),
+                             stats['runs'] + stats['merge_passes'])
+            self.assertEqual([report['runs'] for report in reported],
+                             sorted(report['runs'] for report in reported))
+
+    def test_auto_sort(self):
+        """Test choosing between in memory and external sorting"""
+        alist = self.lists[-1]
+        fobj = self._create_temporary_input_file(alist)
+        try:
+            for memory_bytes, method in ((None, 'sort'), (10**9, 'sort'),
+                                         (10**5, 'external_sort')):
+                output = StringIO()
+                file_sort = FileSorter(fobj.name, output)
+                file_sort.auto_sort(memory_bytes=memory_bytes, unique=True)
+                self.assertEqual(file_sort.get_stats()['method'], method)
+                self.assertEqual(self.output_ints(output),
+                                 sorted(set(alist)))
+        finally:
+            os.unlink(fobj.name)
+        output = StringIO()
+        file_sort = FileSorter(iter(alist), output)
+        file_sort.auto_sort(memory_bytes=10**9)
+        self.assertEqual(file_sort.get_stats()['method'], 'external_sort')
+        self.assertEqual(self.output_ints(output), sorted(alist))
+        with self.assertRaises(SortingError):
+            file_sort.auto_sort(memory_bytes=0)
+
+    def test_top_k(self):
+        """Test writing only the k smallest numbers"""
+        alist = self.lists[-1]
+        for k in (0, 1, 10, len(alist), len(alist)+10):
+            output = StringIO()
+            FileSorter(iter(alist), output).top_k(k)
+            self.assertEqual(self.output_ints(output), sorted(alist)[:k])
+        with self.assertRaises(SortingError):
+            FileSorter([1]).top_k(-1)
+
+    def test_merge_files(self):
+        """Test merging already sorted inputs"""
+        lists = [sorted(self.lists[-1][:3000]), [], range(0, 9000, 3),
+                 [-1, 2**70]]
+        fobj = self._create_temporary_input_file(lists[2])
+        output = StringIO()
+        FileSorter(lists[0], output).merge_files([lists[1], fobj.name,
+                                                  StringIO('-1\n%d\n' %
+                                                           2**70)])
+        self.assertEqual(self.output_ints(output), sorted(sum(lists, [])))
+        output = StringIO()
+        FileSorter(lists[0], output).merge_files([fobj.name, fobj.name],
+                                                 unique=True)
+        self.assertEqual(self.output_ints(output),
+                         sorted(set(lists[0] + lists[2])))
+        os.unlink(fobj.name)
+
+    def test_merge_files_not_sorted(self):
+        """Test merging inputs that are not sorted"""
+        with self.assertRaises(SortingError):
+            FileSorter([1, 2], StringIO()).merge_files([[3, 2]])
+        with self.assertRaises(InitializeError):
+            FileSorter([1, 2], StringIO()).merge_files(['/Not/Exists'])
+
+    def test_output_path(self):
+        """Test sorting a file into a given output file"""
+        fobj = self._create_temporary_input_file([3, 1, 2])
+        out_fobj = tempfile.NamedTemporaryFile()
+        file_sort = FileSorter(fobj.name, output=out_fobj.name)
+        file_sort.sort()
+        os.unlink(fobj.name)
+        self.assertEqual(file_sort.get_output_filename(), out_fobj.name)
+        self.assertEqual(out_fobj.read(), '1\n2\n3\n')
+
+    def test_invalid_stream(self):
+        """Test the case of invalid input or output objects"""
+        with self.assertRaises(InitializeError):
+            FileSorter(1)
+        with self.assertRaises(InitializeError):
+            FileSorter([1], output=1)
+
     def test_invalid_input_file(self):
         """Test the case of a non existing input file"""
         with self.assertRaises(InitializeError):
@@ -186,6 +792,48 @@ class SortingFunctionsTests(SortingTestsBase):
         """Test the quicksort algorithm implementation"""
         self.run_on_lists(quicksort)
 
+    def test_quicksort_big_lists(self):
+        """Test the quicksort implementation on big worst case lists"""
+        for alist in ([7]*50000, range(50000), range(50000, 0, -1),
+                      [i % 3 for i in xrange(50000)],
+                      random.sample(xrange(50000), 50000)):
+            copy = alist[:]
+            quicksort(copy)
+            self.assertEqual(copy, sorted(alist))
+        copy = range(100, 0, -1)
+        quicksort(copy, low=10, high=89)
+        self.assertEqual(copy, range(100, 90, -1) + range(11, 91) +
+                         range(10, 0, -1))
+
+    def test_merge_sort_key(self):
+        """Test the merge sort implementation with a key and its stability"""
+        self.run_on_lists(partial(merge_sort, key=lambda item: item))
+        pairs = [(random.randint(0, 20), idx) for idx in xrange(3000)]
+        copy = pairs[:]
+        merge_sort(copy, key=lambda pair: pair[0])
+        self.assertEqual(copy, sorted(pairs, key=lambda pair: pair[0]))
+
+        # Items are not compared, as complex numbers can not be.
+        complexes = [complex(0, idx % 7) for idx in xrange(100)]
+        copy = complexes[:]
+        merge_sort(copy, key=abs)
+        self.assertEqual(copy, sorted(complexes, key=abs))
+        numbers = array('l', range(500, 0, -1) + range(500))
+        merge_sort(numbers)
+        self.assertEqual(numbers.tolist(), sorted(numbers.tolist()))
+
+    def test_heapsort(self):
+        """Test the heapsort algorithm implementation"""
+        self.run_on_lists(heapsort)
+        copy = range(100, 0, -1)
+        heapsort(copy, low=10, high=89)
+        self.assertEqual(copy, range(100, 90, -1) + range(11, 91) +
+                         range(10, 0, -1))
+
+    def test_insertion_sort(self):
+        """Test the insertion sort algorithm implementation"""
+        self.run_on_lists(insertion_sort)
+
     def test_merge_sort(self):
         """Test the merge sort algorithm implementation"""
         self.run_on_lists(merge_sort)
@@ -194,6 +842,87 @@ class SortingFunctionsTests(SortingTestsBase):
         """Test the default sorting algorithm implementation"""
         self.run_on_lists(default_sort)
 
+    def test_radix_sort(self):
+        """Test the radix sort algorithm implementation"""
+        self.run_on_lists(radix_sort)
+        for bits in (1, 3, 8):
+            self.run_on_lists(partial(radix_sort, bits=bits))
+        self.run_on_integer_lists(radix_sort)
+
+    def test_counting_sort(self):
+        """Test the counting sort algorithm implementation"""
+        self.run_on_lists(counting_sort)
+        self.run_on_integer_lists(counting_sort, bounded=True)
+
+    def test_integer_sort(self):
+        """Test the integer sort implementation"""
+        self.run_on_lists(integer_sort)
+        self.run_on_integer_lists(integer_sort)
+
+    def test_auto_sort(self):
+        """Test the sort implementation chosen by the items"""
+        self.run_on_lists(auto_sort)
+        self.run_on_integer_lists(auto_sort)
+        for distribution in DISTRIBUTIONS:
+            numbers = generate_numbers(distribution, 5000)
+            copy = numbers[:]
+            auto_sort(copy)
+            self.assertEqual(copy, sorted(numbers))
+        numbers = generate_numbers('random', 3000)
+        for items in (numbers + [2**64], numbers + [0.5],
+                      [(num, str(num)) for num in numbers],
+                      [num % 100 for num in numbers] + [0.5],
+                      array('l', numbers[:1000]),
+                      array('l', [num % 10 for num in numbers])):
+            copy = items[:]
+            auto_sort(copy)
+            self.assertEqual(list(copy), sorted(items))
+
+    def test_choose_sort(self):
+        """Test the choice of the sort implementation by the profile"""
+        def chosen(items):
+            """Sorting function chosen for the items."""
+            sort_function = choose_sort(profile_items(items))
+            return getattr(sort_function, 'func', sort_function)
+
+        numbers = generate_numbers('random', 5000)
+        self.assertIs(chosen(numbers[:100]), default_sort)
+        self.assertIs(chosen(sorted(numbers)), default_sort)
+        self.assertIs(chosen(sorted(numbers, reverse=True)), default_sort)
+        self.assertIs(chosen([float(num) for num in numbers]), default_sort)
+        self.assertIs(chosen([num % 1000 for num in numbers]), counting_sort)
+        self.assertIs(chosen(numbers + [2**64]), default_sort)
+        if numpy is not None:
+            self.assertIsNot(chosen(numbers), default_sort)
+        profile = profile_items([num % 10 for num in numbers])
+        self.assertEqual((profile['low'], profile['high']), (0, 9))
+        self.assertGreater(profile['duplicates'], 0.9)
+        self.assertLess(profile_items(numbers)['duplicates'], 0.1)
+
+    def run_on_integer_lists(self, sort_function, bounded=False):
+        """
+        Description:
+            Test the input given integer sorting function with negative and
+            big numbers, in lists and arrays.
+        """
+        alist = [5, -3, 0, 7, 7, -3, 1]
+        if bounded is False:
+            alist += [2**70, -2**65]
+        copy = alist[:]
+        sort_function(copy)
+        self.assertEqual(copy, sorted(alist))
+        numbers = array('l', [9, -1, 4, 4, 0, -8, 1000])
+        sort_function(numbers)
+        self.assertEqual(numbers.tolist(), sorted(numbers.tolist()))
+
+    @unittest.skipIf(numpy is None, 'numpy is not available')
+    def test_numpy_sort(self):
+        """Test the numpy sorting implementation"""
+        for kind in NUMPY_SORT_KINDS:
+            self.run_on_lists(partial(numpy_sort, kind=kind))
+        with self.assertRaises(ValueError):
+            numpy_sort([2, 1], kind='unknown')
+
     def run_on_lists(self, sort_function):
         """
         Description:
@@ -207,5 +936,278 @@ class SortingFunctionsTests(SortingTestsBase):
             SortingFunctionsTests.lists_tested += 1
 
 
+class RecordSortTests(unittest.TestCase):
+    """
+    Description:
+        Class containing tests for sorting delimited records by key columns.
+    """
+    @classmethod
+    def setUpClass(cls):
+        rand = random.Random(0)
+        cls.lines = ['%s\t%d\t%.1f' % (rand.choice('abcde'), idx,
+                                         rand.randint(0, 50)/10.0)
+                     for idx in xrange(3000)]
+        cls.record_format = RecordFormat([(2, 'float'), (0, 'str')], '\t')
+
+    def expected_lines(self, lines, unique=False):
+        """
+        Description:
+            Get the lines sorted stably by the key columns of the records.
+        """
+        def get_key(line):
+            """Key columns of a line."""
+            fields = line.split('\t')
+            return float(fields[2]), fields[0]
+        expected = sorted(lines, key=get_key)
+        if unique:
+            expected = [next(group) for _, group in
+                        groupby(expected, key=get_key)]
+        return expected
+
+    def sort_lines(self, method, lines, **kwargs):
+        """
+        Description:
+            Sort the lines as records with the given FileSorter method and
+            get the output lines.
+        """
+        output = StringIO()
+        method(FileSorter(iter(lines), output,
+                          record_format=self.record_format), **kwargs)
+        return output.getvalue().splitlines()
+
+    def test_sort(self):
+        """Test stable in memory sorting of records"""
+        for sort_method in (None, quicksort, merge_sort):
+            self.assertEqual(self.sort_lines(FileSorter.sort, self.lines,
+                                             sort_method=sort_method),
+                             self.expected_lines(self.lines))
+        self.assertEqual(self.sort_lines(FileSorter.sort, self.lines,
+                                         unique=True),
+                         self.expected_lines(self.lines, unique=True))
+
+    def test_external_sort(self):
+        """Test stable external sorting of records"""
+        for kwargs in ({'itemslimit': 100}, {'itemslimit': 3},
+                       {'memory_bytes': 50000},
+                       {'itemslimit': 200, 'workers': 2},
+                       {'itemslimit': 100, 'replacement_selection': True}):
+            self.assertEqual(self.sort_lines(FileSorter.external_sort,
+                                             self.lines, **kwargs),
+                             self.expected_lines(self.lines))
+        self.assertEqual(self.sort_lines(FileSorter.external_sort,
+                                         self.lines, itemslimit=100,
+                                         unique=True),
+                         self.expected_lines(self.lines, unique=True))
+
+    def test_top_k(self):
+        """Test writing the records with the k smallest keys"""
+        self.assertEqual(self.sort_lines(FileSorter.top_k, self.lines, k=50),
+                         self.expected_lines(self.lines)[:50])
+
+    def test_merge_files(self):
+        """Test stable merging of already sorted records"""
+        first = self.expected_lines(self.lines[:1000])
+        second = self.expected_lines(self.lines[1000:])
+        self.assertEqual(self.sort_lines(FileSorter.merge_files, first,
+                                         sorted_inputs=[second]),
+                         self.expected_lines(self.lines))
+
+    def test_record_file(self):
+        """Test sorting a file of records with line separators"""
+        fobj = tempfile.NamedTemporaryFile()
+        fobj.write('b,2\r\na,10\nc,1')
+        fobj.flush()
+        output = StringIO()
+        FileSorter(fobj.name, output, RecordFormat([(1, 'int')])).sort()
+        self.assertEqual(output.getvalue(), 'c,1\nb,2\na,10\n')
+
+    def test_invalid_records(self):
+        """Test the case of records with missing or invalid keys"""
+        for lines in (['a\t1\t2', 'b\t2'], ['a\t1\tx']):
+            with self.assertRaises(RecordFormatError):
+                self.sort_lines(FileSorter.sort, lines)
+        with self.assertRaises(SortingError):
+            self.sort_lines(FileSorter.sort, self.lines,
+                            sort_method=numpy_sort)
+
+    def test_invalid_format(self):
+        """Test the case of invalid record formats"""
+        for keys, delimiter in (([], ','), ([(0, 'int')], ''),
+                                ([(-1, 'int')], ','), ([(0, 'list')], ',')):
+            with self.assertRaises(RecordFormatError):
+                RecordFormat(keys, delimiter)
+        self.assertEqual(RecordFormat.from_string('2:int,0').keys,
+                         ((2, 'int'), (0, 'str')))
+        with self.assertRaises(RecordFormatError):
+            RecordFormat.from_string('x:int')
+
+
+class RunFormatTests(unittest.TestCase):
+    """
+    Description:
+        Class containing tests for the sorted run files format.
+    """
+    codecs = [None, RunCodec(delta=True)] +\
+        [RunCodec(compression, delta=delta)
+         for compression in sorted(COMPRESSIONS) for delta in (False, True)]
+
+    def run_round_trip(self, numbers, block_items, codec=None):
+        """
+        Description:
+            Write numbers to a sorted run file and read them back.
+        """
+        fobj = tempfile.TemporaryFile()
+        written = items_to_run(fobj, iter(numbers), block_items, codec)
+        self.assertEqual(fobj.tell(), written)
+        fobj.seek(0)
+        return list(items_from_run(fobj, block_items, codec))
+
+    def test_round_trip(self):
+        """Test reading back the numbers of a sorted run file"""
+        numbers = range(-500, 500)
+        for codec in self.codecs:
+            for block_items in (1, 7, 1000, 5000):
+                self.assertEqual(self.run_round_trip(numbers, block_items,
+                                                     codec),
+                                 numbers)
+
+    def test_round_trip_big_numbers(self):
+        """Test numbers that do not fit in 64 bits"""
+        numbers = [-2**70, -2**63, -1, 0, 2**63-1, 2**63, 2**100]
+        for codec in self.codecs:
+            for block_items in (1, 2, 3, 100):
+                self.assertEqual(self.run_round_trip(numbers, block_items,
+                                                     codec),
+                                 numbers)
+
+    def test_delta_overflow(self):
+        """Test delta encoding of differences that do not fit in 64 bits"""
+        numbers = [-2**63, 0, 2**63-1, 5, 5]
+        for codec in self.codecs:
+            self.assertEqual(self.run_round_trip(numbers, 3, codec), numbers)
+
+    def test_round_trip_records(self):
+        """Test reading back records of a sorted run file"""
+        records = [((1.5, 'a'), 0, 'a,1.5'), ((2.0, 'b'), 1, 'b,2')]
+        for codec in self.codecs:
+            self.assertEqual(self.run_round_trip(records, 1, codec), records)
+
+    def test_marshal_blocks(self):
+        """Test that marshalled items are read in small blocks"""
+        for items in ([(num, str(num)) for num in xrange(1000)],
+                      range(2**64, 2**64+1000)):
+            fobj = tempfile.TemporaryFile()
+            items_to_run(fobj, iter(items))
+            fobj.seek(0)
+            blocks = list(blocks_from_run(fobj))
+            self.assertEqual(max(len(block) for block in blocks),
+                             MARSHAL_BLOCK_ITEMS)
+            self.assertEqual(list(chain.from_iterable(blocks)), items)
+
+    def test_compressed_smaller(self):
+        """Test that delta encoding shrinks compressed sorted runs"""
+        rand = random.Random(0)
+        numbers = sorted(rand.randint(0, 10**6) for _ in xrange(50000))
+        sizes = []
+        for codec in (None, RunCodec('zlib'), RunCodec('zlib', delta=True)):
+            sizes.append(items_to_run(tempfile.TemporaryFile(),
+                                      iter(numbers), codec=codec))
+        self.assertLess(sizes[1], sizes[0])
+        self.assertLess(sizes[2]*5, sizes[0])
+        self.assertLess(sizes[2], sizes[1])
+
+    def test_compressed_streams(self):
+        """Test that runs are decompressed in parts of bounded size"""
+        numbers = range(3*10**5)
+        for compression in sorted(COMPRESSIONS):
+            codec = RunCodec(compression, delta=True)
+            fobj = tempfile.TemporaryFile()
+            items_to_run(fobj, iter(numbers), codec=codec)
+            fobj.seek(0)
+            reader = codec.reader(fobj)
+            data = reader.read(16)
+            while data:
+                self.assertLessEqual(len(reader._buffer), 2*STREAM_BYTES)
+                data = reader.read(4096)
+            fobj.seek(0)
+            self.assertEqual(list(items_from_run(fobj, codec=codec)),
+                             numbers)
+
+    def test_corrupted_compressed_run(self):
+        """Test the case of a corrupted compressed sorted run file"""
+        for compression in sorted(COMPRESSIONS):
+            codec = RunCodec(compression)
+            fobj = tempfile.TemporaryFile()
+            items_to_run(fobj, iter(range(1000)), codec=codec)
+            fobj.seek(20)
+            fobj.write('corrupted')
+            fobj.seek(0)
+            with self.assertRaises(RunFormatError):
+                list(items_from_run(fobj, codec=codec))
+
+    def test_smaller_than_text(self):
+        """Test that runs of big numbers are smaller than in text"""
+        fobj = tempfile.TemporaryFile()
+        numbers = range(10**12, 10**12+1000)
+        self.assertLess(items_to_run(fobj, iter(numbers)),
+                        len(''.join('%d\n' % num for num in numbers)))
+
+    def test_truncated_run(self):
+        """Test the case of a truncated sorted run file"""
+        fobj = tempfile.TemporaryFile()
+        items_to_run(fobj, iter(range(100)))
+        fobj.truncate(fobj.tell()-1)
+        fobj.seek(0)
+        with self.assertRaises(RunFormatError):
+            list(items_from_run(fobj))
+
+
+
+class BenchmarkTests(unittest.TestCase):
+    """
+    Description:
+        Class containing tests for the benchmark suite tools.
+    """
+    def test_generate_numbers(self):
+        """Test the distributions of the generated datasets"""
+        for distribution in DISTRIBUTIONS:
+            numbers = generate_numbers(distribution, 2000)
+            self.assertEqual(len(numbers), 2000)
+            self.assertEqual(numbers, generate_numbers(distribution, 2000))
+        numbers = generate_numbers('sorted', 1000)
+        self.assertEqual(numbers, sorted(numbers))
+        numbers = generate_numbers('reverse', 1000)
+        self.assertEqual(numbers, sorted(numbers, reverse=True))
+        self.assertLessEqual(len(set(generate_numbers('few_unique', 1000))),
+                             FEW_UNIQUE_NUMBERS)
+        numbers = generate_numbers('zipf', 1000)
+        self.assertEqual(min(numbers), 1)
+        self.assertGreater(numbers.count(1), numbers.count(2))
+        self.assertGreater(numbers.count(2), numbers.count(10))
+        with self.assertRaises(ValueError):
+            generate_numbers('normal', 10)
+
+    def test_measure_case(self):
+        """Test measuring a case in a child process"""
+        result = measure_case(lambda: 0.5, repeat=2)
+        self.assertEqual(result['seconds'], 0.5)
+        self.assertIn('peak_memory', result)
+        self.assertIn('ZeroDivisionError', measure_case(lambda: 1/0)['error'])
+
+    def test_compare_results(self):
+        """Test finding regressions over a baseline"""
+        def results(*seconds):
+            """Results of cases with the given seconds."""
+            return {'results': [{'distribution': 'random', 'size': 10,
+                                 'method': str(idx), 'seconds': value}
+                                for idx, value in enumerate(seconds)]}
+        compared = compare_results(results(1.0, 1.0, 1.0, 1.0),
+                                   results(0.5, 1.05, 1.2, 1.0), 0.1)
+        self.assertEqual([row[-1] for row in compared],
+                         [False, False, True, False])
+        self.assertEqual(compare_results(results(1.0), results(1.0, 2.0)),
+                         compare_results(results(1.0), results(1.0)))
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -2,24 +2,52 @@
 """Get quotes for loans.
 
 Module containing tools for getting quotes for loans after processing
-input lenders offers which are stored in a minheap for real time access.
+input lenders offers which are stored in an order book for real time
+access.
 Methodology:
   1. Read lenders csv data file
-  2. Store lender Offer objects in min heap. A minimum element has either
-     smaller rate value or equal rate value but greater available amount
-     compared to another element.
+  2. Store lender Offer objects in an order book by rate level. A minimum
+     element has either smaller rate value or equal rate value but greater
+     available amount compared to another element.
   3. Get a quote by using min Offers first.
   4. Print the quote or inform user on an error case.
+For a long running service, a QuoteEngine keeps the offers in memory and
+serves concurrent quote requests, reserving the offers of each quote until
+the user commits it, or releases it and the offers are back in the book.
+Its offers are held by an OrderBook, which aggregates them by rate level,
+so that a quote touches only the levels it consumes, and previews quotes
+without taking any offers by prefix sums of its levels. Many requests are
+priced at once by price_quotes, over numpy arrays if numpy is available.
 """
 
 import sys
+import time
 import heapq
+import threading
 
+from operator import mul,\
+                     attrgetter
+from collections import OrderedDict
 from itertools import imap,\
                       izip,\
+                      count,\
                       starmap,\
                       repeat
 
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+# Seconds that the offers of a quote are reserved before being released.
+RESERVATION_TIMEOUT = 60.0
+
+# Default number of months for repayment.
+MONTHS_REPAY = 36
+
+# Numbers of months whose preview prefix sums are kept by an order book.
+PREVIEW_MONTHS_CACHED = 8
+
 
 class Offer(object):
     """Object representing lenders loan offer
@@ -95,9 +123,39 @@ class Quote(object):
         Returns:
             <float> monthly repayment
         """
-        avail = offer.avail
-        rate = offer.rate
-        return avail*(rate/12)/(1-(1+rate/12)**-months)
+        return offer.avail*Quote.get_monthly_factor(offer.rate, months)
+
+    @staticmethod
+    def get_monthly_factor(rate, months):
+        """Calculates monthly repayment for each unit of amount loaned
+
+        Args:
+            rate: <float> loan's rate value
+            months: <int> number of months for repayment
+
+        Returns:
+            <float> monthly repayment of a unit of amount
+        """
+        return (rate/12)/(1-(1+rate/12)**-months)
+
+
+class QuotePreview(Quote):
+    """Object representing a quote computed without taking any offers
+
+    Args:
+        request: <int> loan request amount
+        rate: <float> average rate of the quote
+        monthly: <float> monthly repayment amount
+        months: <int> numbers of months for repayment
+    """
+    __slots__ = []
+
+    def __init__(self, request, rate, monthly, months):
+        self.request = request
+        self.offers = ()
+        self.rate = rate
+        self.monthly = monthly
+        self.total = monthly * months
 
 
 class QuoteException(Exception):
@@ -105,17 +163,492 @@ class QuoteException(Exception):
     pass
 
 
+class PriceLevel(object):
+    """Object representing the offers of lenders at the same rate
+
+    Args:
+        rate: <float> loan's rate value of the offers
+    """
+    __slots__ = ['rate', 'avail', 'offers', 'lenders']
+
+    def __init__(self, rate):
+        self.rate = rate
+        # Total available amount, and Offer objects in ascending order of
+        # available amount, so that the one with the greater amount is
+        # taken first from the end, with the one of each lender.
+        self.avail = 0
+        self.offers = []
+        self.lenders = {}
+
+    def insert(self, offer):
+        """Insert an offer in its position by available amount
+
+        Args:
+            offer: <Offer> lenders offer object
+        """
+        self.offers.insert(self._find(offer.avail), offer)
+
+    def remove(self, offer):
+        """Remove an offer of the level
+
+        Args:
+            offer: <Offer> lenders offer object
+        """
+        idx = self._find(offer.avail)
+        while self.offers[idx] is not offer:
+            idx += 1
+        del self.offers[idx]
+
+    def _find(self, avail):
+        """Index of the first offer with available amount not less than
+        avail"""
+        offers = self.offers
+        low, high = 0, len(offers)
+        while low < high:
+            mid = (low+high)//2
+            if offers[mid].avail < avail:
+                low = mid+1
+            else:
+                high = mid
+        return low
+
+
+class PrefixSums(object):
+    """Prefix sums of values that are updated in place (Fenwick tree)
+
+    Both updating a value and getting the sum of the values before an
+    index take logarithmic time.
+
+    Args:
+        values: <list> of numbers
+    """
+    __slots__ = ['_tree']
+
+    def __init__(self, values):
+        tree = [0] + list(values)
+        for idx in xrange(1, len(tree)):
+            parent = idx + (idx & -idx)
+            if parent < len(tree):
+                tree[parent] += tree[idx]
+        self._tree = tree
+
+    def __len__(self):
+        return len(self._tree) - 1
+
+    def add(self, index, delta):
+        """Add delta to the value at index
+
+        Args:
+            index: <int> zero based index of the value
+            delta: <number> to be added
+        """
+        tree = self._tree
+        index += 1
+        while index < len(tree):
+            tree[index] += delta
+            index += index & -index
+
+    def prefix(self, count):
+        """Sum of the first count values
+
+        Args:
+            count: <int> number of values
+
+        Returns:
+            <number> sum
+        """
+        tree = self._tree
+        total = 0
+        while count > 0:
+            total += tree[count]
+            count -= count & -count
+        return total
+
+    def search(self, total):
+        """Binary search of the index where the prefix sums reach total,
+        for values that are not negative
+
+        Args:
+            total: <number> sum to be reached
+
+        Returns:
+            <int> number of the first values whose sum is less than total
+        """
+        tree = self._tree
+        index = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            if index+step < len(tree) and tree[index+step] < total:
+                index += step
+                total -= tree[index]
+            step >>= 1
+        return index
+
+
+class OrderBook(object):
+    """Lenders offers aggregated by rate level
+
+    Rate levels are kept in a min heap of their rates, each one with the
+    total amount available at it, so that a quote takes whole levels at
+    once and offers one by one only from the last level it consumes. An
+    offer partially used by a quote keeps the rest of its amount in place.
+    Offers of a level with greater amount available are taken first, as
+    by the order of the Offer objects.
+    Quotes are previewed by prefix sums over the levels in rate order, of
+    their available amount, of their rate times it and, for each of up to
+    PREVIEW_MONTHS_CACHED numbers of months previewed, of their monthly
+    repayment. They are built by the first preview and updated in
+    place by every change of a level, unless a new rate level is added,
+    which rebuilds them.
+    Each lender has a single offer at a level, which amounts added back
+    to it, as by released quotes, are merged into.
+
+    Args:
+        offers: <iterable> of lender <Offer> objects
+    """
+    def __init__(self, offers=()):
+        self._levels = {}
+        self._rates = []
+        self._count = 0
+        self.avail = 0
+
+        # Preview prefix sums, with the rates they are indexed by.
+        self._preview_rates = None
+        self._preview_index = None
+        self._preview_sums = None
+        for offer in offers:
+            level = self._get_level(offer.rate)
+            level.avail += offer.avail
+            self.avail += offer.avail
+
+            # Offers of a lender at the same rate are merged into a new
+            # one, so that the offers given are not changed.
+            merged = level.lenders.get(offer.lender)
+            if merged is not None:
+                offer = Offer(offer.lender, offer.rate,
+                              merged.avail+offer.avail)
+            level.lenders[offer.lender] = offer
+        for level in self._levels.itervalues():
+            level.offers = sorted(level.lenders.itervalues(),
+                                  key=attrgetter('avail'))
+            self._count += len(level.offers)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """Iterate over the offers, by rate level"""
+        for rate in sorted(self._rates):
+            for offer in reversed(self._levels[rate].offers):
+                yield offer
+
+    def levels(self):
+        """Get the rate levels in ascending rate order
+
+        Returns:
+            <list> of tuples of the rate and the total amount available
+        """
+        return [(rate, self._levels[rate].avail)
+                for rate in sorted(self._rates)]
+
+    def add(self, offer):
+        """Add an offer to its rate level, merged into the offer of its
+        lender at the level if there is one
+
+        Args:
+            offer: <Offer> lenders offer object
+        """
+        level = self._get_level(offer.rate)
+        merged = level.lenders.get(offer.lender)
+        if merged is not None:
+            level.remove(merged)
+            merged.avail += offer.avail
+            level.insert(merged)
+        else:
+            level.lenders[offer.lender] = offer
+            level.insert(offer)
+            self._count += 1
+        level.avail += offer.avail
+        self.avail += offer.avail
+        self._update_preview(offer.rate, offer.avail)
+
+    def take(self, amount):
+        """Take offers of an amount, with the minimum rates first
+
+        Args:
+            amount: <int> amount to be taken
+
+        Returns:
+            <list> of <Offer> objects of the amount taken, those of partly
+            used offers created for the part taken
+
+        Raises:
+            QuoteException: if the amount is bigger than the total offers,
+                in which case the book is left unchanged
+        """
+        if amount > self.avail:
+            raise QuoteException('Request amount bigger than total offers')
+        offers = []
+        while amount > 0:
+            level = self._levels[self._rates[0]]
+            if level.avail > amount:
+                self._take_from_level(level, amount, offers)
+                break
+
+            # All the offers of the level are taken.
+            heapq.heappop(self._rates)
+            del self._levels[level.rate]
+            offers.extend(level.offers)
+            amount -= level.avail
+            self.avail -= level.avail
+            self._count -= len(level.offers)
+            self._update_preview(level.rate, -level.avail)
+        return offers
+
+    def _take_from_level(self, level, amount, offers):
+        """Take an amount less than the total of a level, one by one of
+        its offers with the greater amount available first"""
+        level.avail -= amount
+        self.avail -= amount
+        self._update_preview(level.rate, -amount)
+        while amount > 0:
+            offer = level.offers.pop()
+            if offer.avail > amount:
+                offers.append(Offer(offer.lender, offer.rate, amount))
+                offer.avail -= amount
+                level.insert(offer)
+                break
+            offers.append(offer)
+            amount -= offer.avail
+            del level.lenders[offer.lender]
+            self._count -= 1
+
+    def _get_level(self, rate):
+        """Get the level of a rate, which is created if missing"""
+        level = self._levels.get(rate)
+        if level is None:
+            level = self._levels[rate] = PriceLevel(rate)
+            heapq.heappush(self._rates, rate)
+            if self._preview_index is not None and\
+                    rate not in self._preview_index:
+                self._preview_index = None
+        return level
+
+    def preview(self, amount, months):
+        """Preview the quote of an amount, without taking any offers
+
+        Args:
+            amount: <int> amount of loan request
+            months: <int> number of months for repayment
+
+        Returns:
+            <QuotePreview> object with the rate and repayments of the quote
+
+        Raises:
+            QuoteException: if the amount is not positive or bigger than
+                the total offers, or the months are not positive
+        """
+        _check_request(amount, months, self.avail)
+        if self._preview_index is None:
+            self._build_preview()
+        avail_sums, rate_sums = self._preview_sums[:2]
+        monthly_sums = self._get_monthly_sums(months)
+
+        # Levels before the one reached are taken whole, and the rest of
+        # the amount from the one reached.
+        count = avail_sums.search(amount)
+        rate = self._preview_rates[count]
+        rest = amount - avail_sums.prefix(count)
+        return QuotePreview(amount,
+                            (rate_sums.prefix(count) + rate*rest)/amount,
+                            monthly_sums.prefix(count) +
+                            rest*Quote.get_monthly_factor(rate, months),
+                            months)
+
+    def _build_preview(self):
+        """Build the preview prefix sums over the current levels"""
+        rates = sorted(self._rates)
+        avails = [self._levels[rate].avail for rate in rates]
+        self._preview_rates = rates
+        self._preview_index = dict((rate, idx)
+                                   for idx, rate in enumerate(rates))
+        self._preview_sums = [PrefixSums(avails),
+                              PrefixSums(imap(mul, rates, avails)),
+                              OrderedDict()]
+
+    def _get_monthly_sums(self, months):
+        """Get the preview prefix sums of monthly repayments, which are
+        built at the first preview for the number of months, dropping
+        the earliest built ones beyond the cached"""
+        cached = self._preview_sums[2]
+        monthly_sums = cached.get(months)
+        if monthly_sums is None:
+            if len(cached) >= PREVIEW_MONTHS_CACHED:
+                cached.popitem(last=False)
+            monthly_sums = cached[months] = PrefixSums(
+                self._levels[rate].avail *
+                Quote.get_monthly_factor(rate, months)
+                if rate in self._levels else 0
+                for rate in self._preview_rates)
+        return monthly_sums
+
+    def _update_preview(self, rate, delta):
+        """Update the preview prefix sums by a change of the amount of
+        the level of rate, if they are built"""
+        if self._preview_index is None:
+            return
+        idx = self._preview_index[rate]
+        avail_sums, rate_sums, monthly_sums = self._preview_sums
+        avail_sums.add(idx, delta)
+        rate_sums.add(idx, rate*delta)
+        for months, sums in monthly_sums.iteritems():
+            sums.add(idx, delta*Quote.get_monthly_factor(rate, months))
+
+
+def _check_request(amount, months, avail=None):
+    """Check that a request can be quoted by offers of avail amount
+
+    Args:
+        amount: <int> amount of loan request
+        months: <int> number of months for repayment
+        avail: <int> total amount of the offers, None if it is not known
+
+    Raises:
+        QuoteException: if the amount is not positive or bigger than
+            avail, or the months are not positive
+    """
+    if amount <= 0:
+        raise QuoteException('Invalid request amount: %s' % (amount,))
+    if months <= 0:
+        raise QuoteException('Invalid repayment months: %s' % (months,))
+    if avail is not None and amount > avail:
+        raise QuoteException('Request amount bigger than total offers')
+
+
+def price_quotes(lenders_data, requests, use_numpy=None):
+    """Price many loan requests at once, without taking any offers
+
+    Every request is priced as previewed by an order book, by the prefix
+    sums of the rate levels of the offers. With numpy, they are computed
+    over arrays of all the requests, with the monthly repayments computed
+    once for each number of months, otherwise one request at a time.
+
+    Args:
+        lenders_data: <OrderBook> or <iterable> of lender <Offer> objects
+        requests: <list> of tuples of the amount of loan request and the
+            number of months for repayment
+        use_numpy: <bool> price by numpy arrays, by default if numpy is
+            available
+
+    Returns:
+        <list> containing for each request either a <QuotePreview> object
+        or the <QuoteException> of an unavailable quote
+
+    Raises:
+        ImportError: if numpy is asked but not available
+    """
+    if not isinstance(lenders_data, OrderBook):
+        lenders_data = OrderBook(lenders_data)
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    elif use_numpy and numpy is None:
+        raise ImportError('numpy is required by price_quotes')
+    if use_numpy and requests and len(lenders_data):
+        return _price_quotes_numpy(lenders_data.levels(), requests)
+    # Requests are previewed grouped by their months, so that the prefix
+    # sums of each number of months are built once.
+    results = [None] * len(requests)
+    for idx in sorted(xrange(len(requests)), key=lambda idx: requests[idx][1]):
+        try:
+            results[idx] = lenders_data.preview(*requests[idx])
+        except QuoteException as exc:
+            results[idx] = exc
+    return results
+
+
+def _price_quotes_numpy(levels, requests):
+    """Price loan requests by numpy arrays of prefix sums of rate levels
+
+    Args:
+        levels: <list> of tuples of the rate and the amount available of
+            each level, in ascending rate order
+        requests: <list> of tuples of the amount of loan request and the
+            number of months for repayment
+
+    Returns:
+        <list> as returned by price_quotes
+    """
+    rates = numpy.array([rate for rate, _ in levels], dtype=numpy.float64)
+    avails = numpy.array([avail for _, avail in levels], dtype=numpy.int64)
+    avail_sums = numpy.cumsum(avails)
+
+    # Requests are checked by their given values, as by the preview of an
+    # order book, so that each one has either a quote or an exception.
+    errors = []
+    for amount, months in requests:
+        try:
+            _check_request(amount, months, avail_sums[-1])
+            errors.append(None)
+        except QuoteException as exc:
+            errors.append(exc)
+    valid = numpy.array([exc is None for exc in errors], dtype=bool)
+    amounts = numpy.array([amount for amount, _ in requests],
+                          dtype=numpy.float64)
+    terms = numpy.array([months for _, months in requests],
+                        dtype=numpy.float64)
+
+    # Levels before the one reached are taken whole, and the rest of the
+    # amount from the one reached.
+    reached = numpy.searchsorted(avail_sums, amounts)
+    reached[~valid] = 0
+    before = avail_sums[reached] - avails[reached]
+    rest = amounts - before
+    rate_sums = numpy.cumsum(rates*avails) - rates*avails
+    quote_rates = (rate_sums[reached] + rates[reached]*rest) /\
+        numpy.where(valid, amounts, 1)
+    monthly = numpy.zeros(len(requests))
+    for months in numpy.unique(terms[valid]):
+        factors = (rates/12)/(1-(1+rates/12)**-months)
+        monthly_sums = numpy.cumsum(avails*factors) - avails*factors
+        mask = valid & (terms == months)
+        monthly[mask] = monthly_sums[reached[mask]] +\
+            rest[mask]*factors[reached[mask]]
+
+    return [QuotePreview(request[0], rate, pay, request[1])
+            if exc is None else exc
+            for request, rate, pay, exc in izip(requests,
+                                                quote_rates.tolist(),
+                                                monthly.tolist(), errors)]
+
+
 def get_quote(lenders_data, request, months):
     """Get a quote for a loan request.
 
     Args:
         lenders_data: <list> min heap with lender <Offer> objects
+                      <OrderBook> of lender offers
         request: <int> amount of loan request
         months: <int> number of months for repayment
 
     Returns:
         <Quote> object containing quote information for the given request
+
+    Raises:
+        QuoteException: if the request amount or months are not positive,
+            or the amount is bigger than the total offers, in which case
+            the lenders data are left unchanged. The offers taken are put
+            back on any other failure of the quote too.
     """
+    if isinstance(lenders_data, OrderBook):
+        _check_request(request, months, lenders_data.avail)
+        offers = lenders_data.take(request)
+        try:
+            return Quote(request, offers, months)
+        except Exception:
+            for offer in offers:
+                lenders_data.add(offer)
+            raise
+    _check_request(request, months)
     amount_remain = request
     offers = []
     while True:
@@ -134,29 +667,275 @@ def get_quote(lenders_data, request, months):
                 offer.avail = amount_remain
             amount_remain -= offer.avail
         except IndexError:
-            # All heap items are processed without gathering amount needed
+            # All heap items are processed without gathering amount needed,
+            # so the offers popped are pushed back.
+            lenders_data.extend(offers)
+            heapq.heapify(lenders_data)
             raise QuoteException('Request amount bigger than total offers')
         if amount_remain == 0:
             break
-    return Quote(request, offers, months)
+    try:
+        return Quote(request, offers, months)
+    except Exception:
+        lenders_data.extend(offers)
+        heapq.heapify(lenders_data)
+        raise
 
 
-def get_lenders_data(lenders_file):
-    """Get lenders offers
+class Reservation(object):
+    """Object representing a quote whose offers are reserved for a user
+
+    Args:
+        reservation_id: <int> identifier of the reservation
+        quote: <Quote> object holding the reserved offers
+        expires: <float> time that the reservation is released at
+    """
+    __slots__ = ['reservation_id', 'quote', 'expires']
+
+    def __init__(self, reservation_id, quote, expires):
+        self.reservation_id = reservation_id
+        self.quote = quote
+        self.expires = expires
+
+
+class QuoteEngine(object):
+    """Thread safe quote service on an in memory lenders order book
+
+    Every quote reserves the offers it is composed of, by removing them
+    from the order book, until it is committed or released. Reservations
+    that are not committed in time are released by any later call.
+
+    Args:
+        lenders_data: <OrderBook> or <iterable> of lender <Offer> objects
+        timeout: <float> seconds that a reservation is held
+        clock: <function> returning the current time in seconds
+    """
+    def __init__(self, lenders_data, timeout=RESERVATION_TIMEOUT,
+                 clock=time.time):
+        if not isinstance(lenders_data, OrderBook):
+            lenders_data = OrderBook(lenders_data)
+        self._lenders_data = lenders_data
+        self._timeout = timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._ids = count(1)
+
+        # Reservations by identifier, and a min heap of their expiry times
+        # which may contain ones already committed or released.
+        self._reservations = {}
+        self._expiries = []
+
+    @classmethod
+    def from_file(cls, lenders_file, **kwargs):
+        """Create an engine on the offers of a lenders csv file
+
+        Args:
+            lenders_file: <string> path of the lenders csv file
+            kwargs: keyword arguments of the QuoteEngine
+
+        Returns:
+            <QuoteEngine> object
+        """
+        return cls(get_order_book(lenders_file), **kwargs)
+
+    def quote(self, request, months):
+        """Get a quote for a loan request and reserve its offers
+
+        Args:
+            request: <int> amount of loan request
+            months: <int> number of months for repayment
+
+        Returns:
+            <Reservation> object holding the quote
+
+        Raises:
+            QuoteException: if the request amount or months are not
+                positive, or the amount is bigger than the total offers
+                that are not reserved
+        """
+        result = self.quote_many([(request, months)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def quote_many(self, requests):
+        """Get quotes for many loan requests at once, in their order
+
+        The requests are served in a single pass over the order book,
+        holding the lock and releasing the expired reservations once.
+
+        Args:
+            requests: <list> of tuples of the amount of loan request and
+                the number of months for repayment
+
+        Returns:
+            <list> containing for each request either a <Reservation>
+            object holding its quote or the exception raised for it, as
+            the <QuoteException> of an invalid request or an unavailable
+            quote, in which cases no offers are taken
+        """
+        results = []
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            for request, months in requests:
+                try:
+                    _check_request(request, months, self._lenders_data.avail)
+                    quote = get_quote(self._lenders_data, request, months)
+                except Exception as exc:  # pylint: disable=broad-except
+                    # A failed request does not fail the rest of them.
+                    results.append(exc)
+                    continue
+                reservation = Reservation(next(self._ids), quote,
+                                          now+self._timeout)
+                self._reservations[reservation.reservation_id] = reservation
+                heapq.heappush(self._expiries, (reservation.expires,
+                                                reservation.reservation_id))
+                results.append(reservation)
+        return results
+
+    def preview(self, request, months):
+        """Preview the quote of a loan request, without reserving offers
+
+        Args:
+            request: <int> amount of loan request
+            months: <int> number of months for repayment
+
+        Returns:
+            <QuotePreview> object with the rate and repayments of the quote
+
+        Raises:
+            QuoteException: if the request amount is not positive or bigger
+                than the total offers that are not reserved
+        """
+        with self._lock:
+            self._expire(self._clock())
+            return self._lenders_data.preview(request, months)
+
+    def commit(self, reservation_id):
+        """Commit a reserved quote, so that its offers are loaned
+
+        Args:
+            reservation_id: <int> identifier of the reservation
+
+        Returns:
+            <Quote> object that is committed
+
+        Raises:
+            QuoteException: if the reservation is unknown, expired or
+                already committed or released
+        """
+        with self._lock:
+            self._expire(self._clock())
+            return self._pop_reservation(reservation_id).quote
+
+    def release(self, reservation_id):
+        """Release a reserved quote, so that its offers are back in the book
+
+        Args:
+            reservation_id: <int> identifier of the reservation
+
+        Raises:
+            QuoteException: if the reservation is unknown, expired or
+                already committed or released
+        """
+        with self._lock:
+            self._expire(self._clock())
+            self._restore(self._pop_reservation(reservation_id))
+
+    def expire(self):
+        """Release the reservations that are expired
+
+        Returns:
+            <int> number of reservations released
+        """
+        with self._lock:
+            return self._expire(self._clock())
+
+    def available(self):
+        """Total amount of the offers that are not reserved
+
+        Returns:
+            <int> amount
+        """
+        with self._lock:
+            self._expire(self._clock())
+            return self._lenders_data.avail
+
+    def reserved(self):
+        """Number of reservations that are held
+
+        Returns:
+            <int> number of reservations
+        """
+        with self._lock:
+            self._expire(self._clock())
+            return len(self._reservations)
+
+    def _pop_reservation(self, reservation_id):
+        """Remove a reservation that is held, while the lock is held"""
+        try:
+            return self._reservations.pop(reservation_id)
+        except KeyError:
+            raise QuoteException('No reservation %s is held' %
+                                 (reservation_id,))
+
+    def _restore(self, reservation):
+        """Add the offers of a reservation back to the order book, merged
+        into the remaining offers of their lenders"""
+        for offer in reservation.quote.offers:
+            self._lenders_data.add(offer)
+
+    def _expire(self, now):
+        """Release the reservations expired at now, while the lock is held"""
+        released = 0
+        while self._expiries and self._expiries[0][0] <= now:
+            _, reservation_id = heapq.heappop(self._expiries)
+            reservation = self._reservations.pop(reservation_id, None)
+            if reservation is not None:
+                self._restore(reservation)
+                released += 1
+        return released
+
+
+def read_offers(lenders_file):
+    """Read lenders offers
+
+    Args:
+        lenders_file: <string> path of the lenders csv file
 
     Returns:
-        <list> min heap containing lender <Offer> objects
+        <list> containing lender <Offer> objects
     """
-    lenders_data = []
+    offers = []
     with open(lenders_file, 'r') as fobj:
         fobj.readline()
         for line in fobj:
             line = line.strip().split(',')
-            lenders_data.append(Offer(line[0], line[1], line[2]))
+            offers.append(Offer(line[0], line[1], line[2]))
+    return offers
+
+
+def get_lenders_data(lenders_file):
+    """Get lenders offers
+
+    Returns:
+        <list> min heap containing lender <Offer> objects
+    """
+    lenders_data = read_offers(lenders_file)
     heapq.heapify(lenders_data)
     return lenders_data
 
 
+def get_order_book(lenders_file):
+    """Get lenders offers aggregated by rate level
+
+    Returns:
+        <OrderBook> containing lender <Offer> objects
+    """
+    return OrderBook(read_offers(lenders_file))
+
+
 if __name__ == '__main__':  # pragma: no cover
     class InputArgsException(Exception):
         """In case of wrong user input arguments"""
@@ -164,22 +943,25 @@ if __name__ == '__main__':  # pragma: no cover
 
     EXITCODE = 0
     try:
-        if len(sys.argv) != 3:
+        if len(sys.argv) not in (3, 4):
             raise InputArgsException('Wrong arguments number')
         LENDERSFILE = sys.argv[1]
         LOAN = int(sys.argv[2])
         if (1000 <= LOAN <= 15000) is False or\
            LOAN % 100 != 0:
             raise InputArgsException('Invalid loan amount request')
+        MONTHSREPAY = int(sys.argv[3]) if len(sys.argv) == 4 else\
+            MONTHS_REPAY
+        if MONTHSREPAY < 1:
+            raise InputArgsException('Invalid repayment months')
 
         # Get quote and print quote message for requested loan amount.
-        MONTHSREPAY = 36
-        QUOTE = get_quote(get_lenders_data(LENDERSFILE), LOAN, MONTHSREPAY)
+        QUOTE = get_quote(get_order_book(LENDERSFILE), LOAN, MONTHSREPAY)
         print QUOTE.get_message()
 
     except InputArgsException as exc:
         print exc
-        print "USAGE: <exe> <lenders file> <loan amount>"
+        print "USAGE: <exe> <lenders file> <loan amount> [<months>]"
         EXITCODE = 1
 
     except (IOError, ValueError) as exc:
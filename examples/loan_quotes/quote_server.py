@@ -0,0 +1,394 @@
+#! /usr/bin/python
+"""Serve quotes for loans over a socket.
+
+Module containing a server in front of a QuoteEngine, speaking JSON lines
+over a TCP or a Unix socket. Every line sent by a client is a request and
+is answered by a line with its response:
+  {"op": "quote", "amount": 1000, "months": 36}
+      -> {"reservation_id": 1, "rate": 0.07, "monthly": 30.88, ...}
+  {"op": "preview", "amount": 1000, "months": 36}
+      -> {"rate": 0.07, "monthly": 30.88, ...}
+  {"op": "commit", "reservation_id": 1} -> {"committed": 1}
+  {"op": "release", "reservation_id": 1} -> {"released": 1}
+  {"op": "stats"} -> {"requests": 1, "batches": 1, "p50": 0.0001, ...}
+Failed requests are answered by {"error": "<message>"}.
+Each connection is served by its own thread, while quote requests of all
+the connections are queued and served in batches by a single thread, in
+one pass over the lenders order book. A batch contains the requests queued
+while the previous one was served, plus the ones arriving within a time
+window.
+"""
+
+import os
+import sys
+import json
+import time
+import Queue
+import socket
+import argparse
+import threading
+import SocketServer
+
+from collections import deque
+
+from quote import QuoteEngine,\
+                  QuoteException,\
+                  RESERVATION_TIMEOUT
+
+# Seconds to wait for more requests to a batch after its first one.
+BATCH_WINDOW = 0.0
+
+# Maximum number of quote requests served in a batch.
+MAX_BATCH_REQUESTS = 256
+
+# Number of the latest request latencies that percentiles are measured on.
+LATENCY_SAMPLES = 10000
+
+# Percentiles of the request latencies reported by the stats.
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+class LatencyStats(object):
+    """Latencies of the latest served requests, in seconds
+
+    Args:
+        samples: <int> number of the latest latencies kept
+    """
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self._latencies = deque(maxlen=samples)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+
+    def add_batch(self, latencies):
+        """Record the latencies of the requests of a served batch
+
+        Args:
+            latencies: <list> of <float> seconds
+        """
+        with self._lock:
+            self._latencies.extend(latencies)
+            self.requests += len(latencies)
+            self.batches += 1
+
+    def get_stats(self):
+        """Get the counters and the latency percentiles
+
+        Returns:
+            <dict> containing requests, batches and a p<N> latency for
+            each of the LATENCY_PERCENTILES, None if there are no requests
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {'requests': self.requests, 'batches': self.batches}
+        for percentile in LATENCY_PERCENTILES:
+            stats['p%d' % (percentile)] = latencies[
+                min(len(latencies)-1, len(latencies)*percentile/100)]\
+                if latencies else None
+        return stats
+
+
+class QuoteBatcher(object):
+    """Queue serving quote requests of many threads in batches
+
+    Args:
+        engine: <QuoteEngine> serving the quotes
+        window: <float> seconds to wait for more requests to a batch
+        max_batch: <int> maximum number of requests in a batch
+    """
+    def __init__(self, engine, window=BATCH_WINDOW,
+                 max_batch=MAX_BATCH_REQUESTS):
+        self.engine = engine
+        self.stats = LatencyStats()
+        self._window = window
+        self._max_batch = max_batch
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def quote(self, request, months):
+        """Get a quote, waiting for the batch it is served in
+
+        Args:
+            request: <int> amount of loan request
+            months: <int> number of months for repayment
+
+        Returns:
+            <Reservation> object holding the quote
+
+        Raises:
+            QuoteException: if the quote is unavailable
+            Exception: raised by the engine while serving the batch
+        """
+        pending = _PendingQuote(request, months)
+        self._queue.put(pending)
+        pending.done.wait()
+        if isinstance(pending.result, Exception):
+            raise pending.result
+        return pending.result
+
+    def close(self):
+        """Stop serving batches, after the queued requests"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _serve(self):
+        """Serve batches of the queued requests until closed"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self._window
+            while batch[-1] is not None and len(batch) < self._max_batch:
+                try:
+                    timeout = deadline - time.time()
+                    if timeout > 0:
+                        batch.append(self._queue.get(timeout=timeout))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            closed = batch[-1] is None
+            if closed:
+                batch.pop()
+            if batch:
+                self._serve_batch(batch)
+            if closed:
+                break
+
+    def _serve_batch(self, batch):
+        """Serve a batch of requests, whose waiters are always released
+        with either their results or the exception of the engine"""
+        try:
+            results = self.engine.quote_many([(pending.request,
+                                               pending.months)
+                                              for pending in batch])
+        except Exception as exc:  # pylint: disable=broad-except
+            results = [exc] * len(batch)
+        now = time.time()
+        self.stats.add_batch([now - pending.start for pending in batch])
+        for pending, result in zip(batch, results):
+            pending.result = result
+            pending.done.set()
+
+
+class _PendingQuote(object):
+    """Quote request waiting to be served in a batch"""
+    __slots__ = ['request', 'months', 'start', 'result', 'done']
+
+    def __init__(self, request, months):
+        self.request = request
+        self.months = months
+        self.start = time.time()
+        self.result = None
+        self.done = threading.Event()
+
+
+def _get_loan_request(request):
+    """Get the amount and months of a quote or preview request
+
+    Args:
+        request: <dict> decoded request
+
+    Returns:
+        <tuple> of the <int> amount of loan request and number of months
+
+    Raises:
+        QuoteException: if the amount or months are not positive
+    """
+    amount, months = int(request['amount']), int(request['months'])
+    if amount <= 0 or months <= 0:
+        raise QuoteException('Invalid loan request: amount %d, months %d' %
+                             (amount, months))
+    return amount, months
+
+
+class QuoteRequestHandler(SocketServer.StreamRequestHandler):
+    """Handler answering the JSON lines requests of a connection"""
+    def setup(self):
+        # Requests and responses are small lines, which are not delayed.
+        self.disable_nagle_algorithm = \
+            self.server.address_family == socket.AF_INET
+        SocketServer.StreamRequestHandler.setup(self)
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.respond(json.loads(line))
+            except (QuoteException, ValueError, TypeError, KeyError,
+                    AttributeError, OverflowError) as exc:
+                response = {'error': '%s - %s' % (exc.__class__.__name__,
+                                                  exc)}
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+
+class QuoteServerMixIn(object):
+    """Server answering quote requests by a QuoteBatcher
+
+    Args:
+        batcher: <QuoteBatcher> serving the quote requests
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def respond(self, request):
+        """Get the response to a request
+
+        Args:
+            request: <dict> decoded request
+
+        Returns:
+            <dict> response to be encoded
+
+        Raises:
+            QuoteException: on an unknown operation or reservation, an
+                invalid loan request, or if the quote is unavailable
+        """
+        operation = request.get('op')
+        if operation == 'quote':
+            reservation = self.batcher.quote(*_get_loan_request(request))
+            quote = reservation.quote
+            return {'reservation_id': reservation.reservation_id,
+                    'amount': quote.request, 'rate': quote.rate,
+                    'monthly': quote.monthly, 'total': quote.total,
+                    'expires': reservation.expires}
+        elif operation == 'preview':
+            preview = self.batcher.engine.preview(
+                *_get_loan_request(request))
+            return {'amount': preview.request, 'rate': preview.rate,
+                    'monthly': preview.monthly, 'total': preview.total}
+        elif operation == 'commit':
+            self.batcher.engine.commit(request['reservation_id'])
+            return {'committed': request['reservation_id']}
+        elif operation == 'release':
+            self.batcher.engine.release(request['reservation_id'])
+            return {'released': request['reservation_id']}
+        elif operation == 'stats':
+            stats = self.batcher.stats.get_stats()
+            stats['available'] = self.batcher.engine.available()
+            stats['reserved'] = self.batcher.engine.reserved()
+            return stats
+        raise QuoteException('Unknown operation: "%s"' % (operation,))
+
+    def server_close(self):
+        """Close the server socket and stop serving batches"""
+        self.batcher.close()
+
+
+class TCPQuoteServer(QuoteServerMixIn, SocketServer.ThreadingTCPServer):
+    """Quote server on a TCP socket"""
+    def __init__(self, address, batcher):
+        self.batcher = batcher
+        SocketServer.ThreadingTCPServer.__init__(self, address,
+                                                 QuoteRequestHandler)
+
+    def server_close(self):
+        SocketServer.ThreadingTCPServer.server_close(self)
+        QuoteServerMixIn.server_close(self)
+
+
+if hasattr(socket, 'AF_UNIX'):
+    class UnixQuoteServer(QuoteServerMixIn,
+                          SocketServer.ThreadingUnixStreamServer):
+        """Quote server on a Unix socket"""
+        def __init__(self, address, batcher):
+            self.batcher = batcher
+            SocketServer.ThreadingUnixStreamServer.__init__(
+                self, address, QuoteRequestHandler)
+
+        def server_close(self):
+            SocketServer.ThreadingUnixStreamServer.server_close(self)
+            QuoteServerMixIn.server_close(self)
+            os.unlink(self.server_address)
+
+
+def make_server(engine, address, window=BATCH_WINDOW,
+                max_batch=MAX_BATCH_REQUESTS):
+    """Create a quote server, which is started by serve_forever
+
+    Args:
+        engine: <QuoteEngine> serving the quotes
+        address: <tuple> of host and port of a TCP socket, port 0 for any
+                 <string> path of a Unix socket
+        window: <float> seconds to wait for more requests to a batch
+        max_batch: <int> maximum number of requests in a batch
+
+    Returns:
+        <TCPQuoteServer> or <UnixQuoteServer> object
+    """
+    batcher = QuoteBatcher(engine, window, max_batch)
+    if isinstance(address, basestring):
+        return UnixQuoteServer(address, batcher)
+    return TCPQuoteServer(address, batcher)
+
+
+class QuoteClient(object):
+    """Client of a quote server
+
+    Args:
+        address: <tuple> of host and port of a TCP socket
+                 <string> path of a Unix socket
+    """
+    def __init__(self, address):
+        if isinstance(address, basestring):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                                    1)
+        self._socket.connect(address)
+        self._rfile = self._socket.makefile('r')
+
+    def request(self, **request):
+        """Send a request and get its response
+
+        Args:
+            request: keyword arguments of the request
+
+        Returns:
+            <dict> response
+
+        Raises:
+            QuoteException: on an error response
+        """
+        self._socket.sendall(json.dumps(request) + '\n')
+        response = json.loads(self._rfile.readline())
+        if 'error' in response:
+            raise QuoteException(response['error'])
+        return response
+
+    def close(self):
+        """Close the connection"""
+        self._rfile.close()
+        self._socket.close()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    PARSER = argparse.ArgumentParser()
+    PARSER.add_argument('lenders_file', help='lenders csv file')
+    PARSER.add_argument('--host', default='127.0.0.1',
+                        help='host of the TCP socket (default: 127.0.0.1)')
+    PARSER.add_argument('--port', type=int, default=8642,
+                        help='port of the TCP socket (default: 8642)')
+    PARSER.add_argument('--unix', metavar='PATH',
+                        help='serve on a Unix socket instead of TCP')
+    PARSER.add_argument('--window', type=float, default=BATCH_WINDOW,
+                        help='seconds to wait for more requests to a batch')
+    PARSER.add_argument('--timeout', type=float, default=RESERVATION_TIMEOUT,
+                        help='seconds that the offers of a quote are '
+                             'reserved')
+    ARGS = PARSER.parse_args()
+
+    try:
+        SERVER = make_server(QuoteEngine.from_file(ARGS.lenders_file,
+                                                   timeout=ARGS.timeout),
+                             ARGS.unix or (ARGS.host, ARGS.port),
+                             ARGS.window)
+    except (IOError, ValueError, socket.error) as exc:
+        print "%s - %s" % (exc.__class__.__name__, exc)
+        sys.exit(1)
+    try:
+        SERVER.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    SERVER.server_close()
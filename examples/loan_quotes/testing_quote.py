@@ -2,17 +2,30 @@
 
 import os
 import heapq
+import random
+import socket
 import unittest
 import tempfile
+import threading
 
-from quote import Offer,\
+from quote import numpy,\
+                  Offer,\
+                  OrderBook,\
+                  PrefixSums,\
+                  PREVIEW_MONTHS_CACHED,\
+                  QuoteEngine,\
                   QuoteException,\
                   get_quote,\
+                  price_quotes,\
+                  get_order_book,\
                   get_lenders_data
+from quote_server import QuoteClient,\
+                         QuoteBatcher,\
+                         make_server
 
 
-class QuoteTester(unittest.TestCase):
-    """Tester class for quote module"""
+class LendersTestBase(unittest.TestCase):
+    """Base tester class creating a lenders data file"""
     @classmethod
     def setUpClass(cls):
         # Predefined lenders data to test quote functionality
@@ -35,6 +48,9 @@ class QuoteTester(unittest.TestCase):
         # Clean up lenders data file
         os.unlink(cls.lendersfile)
 
+
+class QuoteTester(LendersTestBase):
+    """Tester class for quote module"""
     def test_get_equal_quote(self):
         """test on quote that matches exactly minimum possibe of lenders"""
         ldata = get_lenders_data(self.lendersfile)
@@ -60,6 +76,18 @@ class QuoteTester(unittest.TestCase):
         ldata = get_lenders_data(self.lendersfile)
         with self.assertRaises(QuoteException):
             get_quote(ldata, 1000000, 36)
+        self.assertEqual(len(ldata), 5)
+        self.assertEqual(sum(o.avail for o in ldata), 600)
+
+    def test_invalid_request(self):
+        """test requests of amount or months that are not positive"""
+        for ldata in (get_lenders_data(self.lendersfile),
+                      get_order_book(self.lendersfile)):
+            for request, months in ((100, 0), (0, 36), (-5, 36)):
+                with self.assertRaises(QuoteException):
+                    get_quote(ldata, request, months)
+            self.assertEqual(len(ldata), 5)
+            self.assertEqual(sum(o.avail for o in ldata), 600)
 
     def test_offer_representation(self):
         """test offer's string representation"""
@@ -89,5 +117,396 @@ class QuoteTester(unittest.TestCase):
         self.assertEqual(len(ldata), 2)
 
 
+class OrderBookTester(LendersTestBase):
+    """Tester class for the order book of rate levels"""
+    def test_order_book_levels(self):
+        """test aggregation of offers by rate level"""
+        book = get_order_book(self.lendersfile)
+        self.assertEqual(book.levels(), [(0.05, 200), (0.06, 150),
+                                         (0.07, 200), (0.08, 50)])
+        self.assertEqual((len(book), book.avail), (5, 600))
+        self.assertEqual([o.lender for o in book], ['A', 'B', 'C', 'D', 'E'])
+
+    def test_order_book_partial_fill(self):
+        """test part of an offer is taken in place"""
+        book = get_order_book(self.lendersfile)
+        first = next(iter(book))
+        quote = get_quote(book, 250, 36)
+        self.assertEqual([(o.lender, o.avail) for o in quote.offers],
+                         [('A', 200), ('B', 50)])
+        self.assertEqual(book.levels(), [(0.06, 100), (0.07, 200),
+                                         (0.08, 50)])
+        self.assertIsNot(first, next(iter(book)))
+        self.assertEqual((len(book), book.avail), (4, 350))
+
+        # The rest of B has less available than C, which is taken first.
+        quote = get_quote(book, 60, 36)
+        self.assertEqual([(o.lender, o.avail) for o in quote.offers],
+                         [('C', 50), ('B', 10)])
+        book.add(Offer('F', 0.05, 10))
+        self.assertEqual(book.levels()[0], (0.05, 10))
+        with self.assertRaises(QuoteException):
+            get_quote(book, 1000, 36)
+        self.assertEqual((len(book), book.avail), (4, 300))
+
+    def test_order_book_merge_offers(self):
+        """test offers added back are merged into their lenders ones"""
+        book = OrderBook([Offer('A', 0.05, 1000), Offer('B', 0.05, 600)])
+        for request in (306, 403, 500, 1200, 1597):
+            for offer in get_quote(book, request, 36).offers:
+                book.add(offer)
+            self.assertEqual(len(book), 2)
+            self.assertEqual(book.avail, 1600)
+        offers = get_quote(book, 900, 36).offers
+        self.assertEqual([(o.lender, o.avail) for o in offers], [('A', 900)])
+
+    def test_order_book_duplicate_lender(self):
+        """test offers of a lender at the same rate are merged in copies"""
+        ldata = [Offer('A', 0.05, 100), Offer('A', 0.05, 50),
+                 Offer('B', 0.06, 100)]
+        heapq.heapify(ldata)
+        self.assertEqual(price_quotes(ldata, [(150, 36)])[0].rate, 0.05)
+        self.assertEqual(sorted(o.avail for o in ldata), [50, 100, 100])
+        book = OrderBook(ldata)
+        self.assertEqual(len(book), 2)
+        self.assertEqual(book.avail, 250)
+        offers = get_quote(book, 120, 36).offers
+        self.assertEqual([(o.lender, o.avail) for o in offers], [('A', 120)])
+        self.assertEqual(sorted(o.avail for o in ldata), [50, 100, 100])
+
+    def test_order_book_as_heap(self):
+        """test quotes of the order book match those of the heap"""
+        rand = random.Random(5)
+        avails = rand.sample(xrange(1, 10000), 2000)
+        offers = [('L%d' % i, rand.choice((0.05, 0.061, 0.07, 0.085)), avail)
+                  for i, avail in enumerate(avails)]
+        heap = [Offer(*offer) for offer in offers]
+        heapq.heapify(heap)
+        book = OrderBook(Offer(*offer) for offer in offers)
+        for request in (rand.randrange(1, 50000) for _ in xrange(200)):
+            try:
+                expected = get_quote(heap, request, 36)
+            except QuoteException:
+                self.assertRaises(QuoteException, get_quote, book, request,
+                                  36)
+                continue
+            # Lenders of equal rate and available amount are taken in any
+            # order, so their amounts are compared.
+            quote = get_quote(book, request, 36)
+            self.assertEqual(sorted((o.rate, o.avail) for o in quote.offers),
+                             sorted((o.rate, o.avail)
+                                    for o in expected.offers))
+            self.assertAlmostEqual(quote.rate, expected.rate)
+            self.assertAlmostEqual(quote.monthly, expected.monthly)
+        self.assertEqual(book.avail, sum(o.avail for o in heap))
+
+    def test_prefix_sums(self):
+        """test prefix sums updated in place"""
+        rand = random.Random(7)
+        values = [rand.randrange(10) for _ in xrange(100)]
+        sums = PrefixSums(values)
+        for _ in xrange(100):
+            idx = rand.randrange(len(values))
+            delta = rand.randrange(-values[idx], 10)
+            values[idx] += delta
+            sums.add(idx, delta)
+            count = rand.randrange(len(values)+1)
+            self.assertEqual(sums.prefix(count), sum(values[:count]))
+            total = rand.randrange(1, sum(values)+1)
+            count = sums.search(total)
+            self.assertLess(sum(values[:count]), total)
+            self.assertGreaterEqual(sum(values[:count+1]), total)
+        self.assertEqual(len(sums), 100)
+
+    def test_order_book_preview(self):
+        """test previews match the quotes while the book changes"""
+        rand = random.Random(3)
+        rates = [0.05, 0.061, 0.07, 0.085]
+        book = OrderBook(Offer('L%d' % i, rand.choice(rates),
+                               rand.randrange(1, 1000)) for i in xrange(500))
+
+        def check_previews():
+            """Compare previews to the quotes of a copy of the book, of
+            more numbers of months than are cached"""
+            for request in (1, 999, 5000, book.avail/2, book.avail):
+                for months in [12, 36] + range(1, PREVIEW_MONTHS_CACHED):
+                    preview = book.preview(request, months)
+                    quote = get_quote(OrderBook(Offer(o.lender, o.rate,
+                                                      o.avail)
+                                                for o in book),
+                                      request, months)
+                    self.assertAlmostEqual(preview.rate, quote.rate)
+                    self.assertAlmostEqual(preview.monthly, quote.monthly)
+                    self.assertAlmostEqual(preview.total, quote.total)
+                    self.assertEqual(preview.request, request)
+
+        avail = book.avail
+        check_previews()
+        self.assertEqual(book.avail, avail)
+        for _ in xrange(20):
+            get_quote(book, rand.randrange(1, 20000), 36)
+            book.add(Offer('N', rand.choice(rates), rand.randrange(1, 500)))
+            check_previews()
+        book.add(Offer('N', 0.04, 100))
+        check_previews()
+        self.assertEqual(book.preview(100, 36).rate, 0.04)
+        self.assertEqual(book.preview(100, 36).get_message().count(
+            '\nRate: 4.0%\n'), 1)
+        for request in (0, book.avail+1):
+            with self.assertRaises(QuoteException):
+                book.preview(request, 36)
+
+    def price_quotes_common(self, use_numpy):
+        """Test pricing a grid of requests at once"""
+        rand = random.Random(11)
+        book = OrderBook(Offer('L%d' % i, rand.choice((0.05, 0.061, 0.07)),
+                               rand.randrange(1, 1000)) for i in xrange(300))
+        requests = [(amount, months) for amount in (1, 250, 10**4, book.avail)
+                    for months in (12, 36, 60)] + [(0.5, 36), (100, 0.5)]
+        results = price_quotes(book, requests + [(0, 36), (100, 0),
+                                                 (book.avail+1, 36)],
+                               use_numpy=use_numpy)
+        self.assertEqual(len(results), len(requests)+3)
+        for (amount, months), result in zip(requests, results):
+            preview = book.preview(amount, months)
+            self.assertEqual(result.request, amount)
+            self.assertAlmostEqual(result.rate, preview.rate)
+            self.assertAlmostEqual(result.monthly, preview.monthly)
+            self.assertAlmostEqual(result.total, preview.total)
+        for result in results[-3:]:
+            self.assertIsInstance(result, QuoteException)
+        self.assertEqual(price_quotes(book, [], use_numpy=use_numpy), [])
+
+        # Lenders data of a heap are priced without being changed.
+        ldata = get_lenders_data(self.lendersfile)
+        result = price_quotes(ldata, [(550, 36)], use_numpy=use_numpy)[0]
+        self.assertEqual(result.rate, 0.06)
+        self.assertAlmostEqual(result.monthly,
+                               get_quote(ldata, 550, 36).monthly)
+        self.assertIsInstance(price_quotes([], [(1, 36)],
+                                           use_numpy=use_numpy)[0],
+                              QuoteException)
+
+    def test_price_quotes(self):
+        """test pricing a grid of requests one at a time"""
+        self.price_quotes_common(use_numpy=False)
+
+    @unittest.skipIf(numpy is None, 'numpy is not available')
+    def test_price_quotes_numpy(self):
+        """test pricing a grid of requests over numpy arrays"""
+        self.price_quotes_common(use_numpy=True)
+
+
+class QuoteEngineTester(LendersTestBase):
+    """Tester class for the quote engine with reservations"""
+    def setUp(self):
+        self.now = 0.0
+        self.engine = QuoteEngine.from_file(self.lendersfile, timeout=10,
+                                            clock=lambda: self.now)
+
+    def test_engine_release(self):
+        """test released offers are back to be quoted"""
+        reservation = self.engine.quote(550, 36)
+        self.assertEqual(self.engine.available(), 50)
+        with self.assertRaises(QuoteException):
+            self.engine.quote(100, 36)
+        self.engine.release(reservation.reservation_id)
+        self.assertEqual(self.engine.available(), 600)
+        quote = self.engine.quote(550, 36).quote
+        self.assertEqual(quote.rate, 0.06)
+        with self.assertRaises(QuoteException):
+            self.engine.release(reservation.reservation_id)
+
+    def test_engine_invalid_requests(self):
+        """test invalid requests do not take any offers"""
+        results = self.engine.quote_many([(100, 0), (0, 36), (-5, 36),
+                                          (601, 36), (100, 36)])
+        for result in results[:-1]:
+            self.assertIsInstance(result, QuoteException)
+        self.assertEqual(results[-1].quote.request, 100)
+        self.assertEqual(self.engine.available(), 500)
+        self.assertEqual(self.engine.reserved(), 1)
+
+    def test_engine_failed_quote(self):
+        """test offers of a quote failing in any way are put back"""
+        engine = QuoteEngine([Offer('Z', 0.0, 100), Offer('B', 0.06, 100)])
+        with self.assertRaises(ZeroDivisionError):
+            engine.quote(50, 36)
+        self.assertEqual(engine.available(), 200)
+        results = self.engine.quote_many([(100, 36), (100, 'x'), (200, 36)])
+        self.assertIsInstance(results[1], TypeError)
+        self.assertEqual([result.quote.request for result in results[::2]],
+                         [100, 200])
+        self.assertEqual(self.engine.available(), 300)
+        self.assertEqual(self.engine.reserved(), 2)
+
+    def test_engine_preview(self):
+        """test previews do not reserve any offers"""
+        reservation = self.engine.quote(200, 36)
+        preview = self.engine.preview(300, 36)
+        self.assertAlmostEqual(preview.rate, (100*0.06+50*0.06+150*0.07)/300)
+        self.assertEqual(self.engine.available(), 400)
+        self.engine.release(reservation.reservation_id)
+        self.assertEqual(self.engine.preview(550, 36).rate, 0.06)
+        with self.assertRaises(QuoteException):
+            self.engine.preview(601, 36)
+
+    def test_engine_commit(self):
+        """test committed offers are not available any more"""
+        reservation = self.engine.quote(300, 36)
+        self.assertEqual(self.engine.reserved(), 1)
+        quote = self.engine.commit(reservation.reservation_id)
+        self.assertIs(quote, reservation.quote)
+        self.assertEqual(self.engine.reserved(), 0)
+        self.assertEqual(self.engine.available(), 300)
+        with self.assertRaises(QuoteException):
+            self.engine.commit(reservation.reservation_id)
+
+    def test_engine_expiry(self):
+        """test reservations are released after their timeout"""
+        first = self.engine.quote(200, 36)
+        self.now = 5
+        second = self.engine.quote(100, 36)
+        self.assertEqual(self.engine.available(), 300)
+        self.now = 10
+        self.assertEqual(self.engine.available(), 500)
+        with self.assertRaises(QuoteException):
+            self.engine.commit(first.reservation_id)
+        self.engine.commit(second.reservation_id)
+        self.now = 20
+        self.assertEqual(self.engine.expire(), 0)
+        self.assertEqual(self.engine.available(), 500)
+
+    def test_engine_concurrent_quotes(self):
+        """test concurrent quotes never reserve the same offers"""
+        reservations = []
+
+        def reserve():
+            """Reserve quotes until the offers are exhausted"""
+            while True:
+                try:
+                    reservations.append(self.engine.quote(50, 36))
+                except QuoteException:
+                    break
+
+        threads = [threading.Thread(target=reserve) for _ in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(reservations), 12)
+        self.assertEqual(self.engine.available(), 0)
+        for reservation in reservations:
+            self.engine.release(reservation.reservation_id)
+        self.assertEqual(self.engine.available(), 600)
+
+
+class QuoteServerTester(LendersTestBase):
+    """Tester class for the quote server"""
+    def start_server(self, address, **kwargs):
+        """Start a quote server on the lenders data in a thread
+
+        Returns:
+            address of the server
+        """
+        self.engine = QuoteEngine.from_file(self.lendersfile)
+        server = make_server(self.engine, address, **kwargs)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop_server():
+            """Stop the server and wait for its thread"""
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.addCleanup(stop_server)
+        return server.server_address
+
+    def test_server_requests(self):
+        """test quote, commit and release requests to the server"""
+        client = QuoteClient(self.start_server(('127.0.0.1', 0)))
+        self.addCleanup(client.close)
+        response = client.request(op='quote', amount=550, months=36)
+        self.assertEqual(response['rate'], 0.06)
+        self.assertEqual(response['amount'], 550)
+        self.assertEqual(client.request(op='stats')['available'], 50)
+        self.assertEqual(client.request(op='preview', amount=50,
+                                        months=36)['rate'], 0.08)
+        client.request(op='release',
+                       reservation_id=response['reservation_id'])
+        response = client.request(op='quote', amount=300, months=36)
+        client.request(op='commit', reservation_id=response['reservation_id'])
+        stats = client.request(op='stats')
+        self.assertEqual((stats['available'], stats['reserved']), (300, 0))
+        self.assertEqual(stats['requests'], 2)
+        self.assertGreater(stats['p50'], 0)
+        for request in ({'op': 'quote', 'amount': 1000, 'months': 36},
+                        {'op': 'commit', 'reservation_id': 1},
+                        {'op': 'quote', 'amount': 'x', 'months': 36},
+                        {'op': 'quote', 'amount': 0, 'months': 36},
+                        {'op': 'quote', 'amount': 1e400, 'months': 36},
+                        {'op': 'preview', 'amount': 100,
+                         'months': float('nan')},
+                        {'op': 'quote', 'amount': 100, 'months': 0},
+                        {'op': 'preview', 'amount': 100, 'months': -1},
+                        {'op': 'unknown'}):
+            with self.assertRaises(QuoteException):
+                client.request(**request)
+        self.assertEqual(client.request(op='quote', amount=300,
+                                        months=36)['amount'], 300)
+
+    def test_batcher_engine_error(self):
+        """test requests of a batch failed by the engine are answered"""
+        batcher = QuoteBatcher(QuoteEngine.from_file(self.lendersfile))
+        self.addCleanup(batcher.close)
+        with self.assertRaises(TypeError):
+            batcher.quote(100, 'x')
+        self.assertEqual(batcher.quote(100, 36).quote.request, 100)
+
+    def test_server_concurrent_clients(self):
+        """test batched quotes of concurrent clients"""
+        address = self.start_server(('127.0.0.1', 0), window=0.05)
+        reservations = []
+
+        def reserve():
+            """Reserve quotes until the offers are exhausted"""
+            client = QuoteClient(address)
+            while True:
+                try:
+                    reservations.append(client.request(op='quote', amount=25,
+                                                       months=36))
+                except QuoteException:
+                    break
+            client.close()
+
+        threads = [threading.Thread(target=reserve) for _ in xrange(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(reservations), 24)
+        self.assertEqual(len(set(r['reservation_id'] for r in reservations)),
+                         24)
+        client = QuoteClient(address)
+        stats = client.request(op='stats')
+        client.close()
+        self.assertEqual(stats['requests'], 30)
+        # Requests of the clients arriving within a window are batched.
+        self.assertLess(stats['batches'], 30)
+        self.assertLessEqual(stats['p50'], stats['p99'])
+
+    @unittest.skipIf(not hasattr(socket, 'AF_UNIX'), 'no Unix sockets')
+    def test_server_unix_socket(self):
+        """test quote requests to a server on a Unix socket"""
+        path = os.path.join(tempfile.mkdtemp(), 'quote.sock')
+        self.addCleanup(os.rmdir, os.path.dirname(path))
+        client = QuoteClient(self.start_server(path))
+        response = client.request(op='quote', amount=300, months=36)
+        client.close()
+        self.assertEqual(response['amount'], 300)
+        self.assertAlmostEqual(response['rate'], 16/300.0)
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=3)